@@ -5,12 +5,27 @@ DeepSeek AI 对话助手 + RAG 知识库 - Streamlit 应用
 import streamlit as st
 from datetime import datetime
 import os
+import shutil
+import tempfile
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from pathlib import Path
 from loguru import logger
 
 from src.deepseek_client import DeepSeekClient
 from src.embedding_handler import BGEEmbeddingHandler
+from src.embedding_cache import EmbeddingCache
+from src.embedding_pool import EmbeddingPool
+from src.query_cache import QueryEmbeddingCache
 from src.memory_kb_handler import MemoryKBHandler
+from src.sharded_kb_handler import ShardedKBHandler
+from src.bm25_index import BM25Index
+from src.ivf_index import IVFIndex
+from src.hnsw_index import HNSWIndex
+from src.quantization import ProductQuantizedIndex, ScalarQuantizedIndex
 from src.document_processor import DocumentProcessor
+from src.ingest_manifest import IngestManifest
+from src.ingest_pipeline import IngestionPipeline
 from src.rag_service import RAGService
 from config import settings
 
@@ -45,23 +60,156 @@ st.markdown(
 )
 
 
+def kb_index_factory():
+    """
+    根据配置返回创建内存知识库检索索引的工厂（flat 时为 None）
+
+    返回可 pickle 的 partial，分片知识库在每个分片进程内调用它创建各自的索引
+    """
+    if settings.KB_INDEX in ("sq8", "pq") and settings.KB_VECTOR_STORAGE != "disk":
+        # float 矩阵仍常驻内存，量化编码叠加在其上，内存只增不减
+        logger.warning(
+            f"KB_INDEX={settings.KB_INDEX} with KB_VECTOR_STORAGE={settings.KB_VECTOR_STORAGE} keeps the "
+            f"float32 vectors resident in addition to the codes; set KB_VECTOR_STORAGE=disk to reduce memory"
+        )
+    if settings.KB_INDEX == "ivf":
+        return partial(IVFIndex, nlist=settings.KB_IVF_NLIST, nprobe=settings.KB_IVF_NPROBE)
+    if settings.KB_INDEX == "hnsw":
+        return partial(HNSWIndex, M=settings.KB_HNSW_M, ef_search=settings.KB_HNSW_EF_SEARCH)
+    if settings.KB_INDEX == "sq8":
+        return partial(ScalarQuantizedIndex, rerank=settings.KB_QUANT_RERANK)
+    if settings.KB_INDEX == "pq":
+        return partial(
+            ProductQuantizedIndex, n_subvectors=settings.KB_PQ_SUBVECTORS, rerank=settings.KB_QUANT_RERANK
+        )
+    return None
+
+
+@st.cache_resource
+def get_query_cache() -> QueryEmbeddingCache:
+    """所有会话共享的查询向量缓存"""
+    return QueryEmbeddingCache(
+        max_size=settings.QUERY_CACHE_SIZE, ttl_seconds=settings.QUERY_CACHE_TTL
+    )
+
+
+def embedding_handler_kwargs() -> dict:
+    """BGEEmbeddingHandler 的模型相关参数，批量导入的工作进程使用同一份配置"""
+    return dict(
+        batch_size=settings.EMBEDDING_BATCH_SIZE,
+        backend=settings.EMBEDDING_BACKEND,
+        onnx_dir=settings.EMBEDDING_ONNX_DIR,
+        onnx_quantize=settings.EMBEDDING_ONNX_QUANTIZE,
+        onnx_threads=settings.EMBEDDING_ONNX_THREADS,
+    )
+
+
+@st.cache_resource
+def get_embedding_handler() -> BGEEmbeddingHandler:
+    """所有会话共享的 BGE 向量化处理器，每个进程只加载一次模型"""
+    logger.info("Loading BGE embedding model...")
+    cache = (
+        EmbeddingCache(settings.EMBEDDING_CACHE_PATH)
+        if settings.EMBEDDING_CACHE_ENABLED
+        else None
+    )
+    embedding_handler = BGEEmbeddingHandler(
+        cache=cache,
+        query_cache=get_query_cache(),
+        query_batch_size=settings.QUERY_BATCH_SIZE,
+        query_batch_wait_ms=settings.QUERY_BATCH_WAIT_MS,
+        **embedding_handler_kwargs(),
+    )
+    logger.info("BGE model loaded successfully")
+    return embedding_handler
+
+
+@st.cache_resource
+def get_kb_handler():
+    """所有会话共享的知识库，从快照 + WAL 恢复，避免重启后重新解析和向量化"""
+    embedding_handler = get_embedding_handler()
+    index_factory = kb_index_factory()
+    if settings.KB_SHARDS > 1:
+        return ShardedKBHandler(
+            embedding_handler,
+            n_shards=settings.KB_SHARDS,
+            persist_directory=settings.DATA_DIR / "memory_kb_sharded",
+            vector_storage=settings.KB_VECTOR_STORAGE,
+            index_factory=index_factory,
+            lexical_index_factory=BM25Index if settings.KB_HYBRID_SEARCH else None,
+            wal_compact_bytes=settings.KB_WAL_COMPACT_BYTES,
+        )
+    return MemoryKBHandler(
+        embedding_handler,
+        persist_directory=settings.KB_SNAPSHOT_DIR,
+        wal_compact_bytes=settings.KB_WAL_COMPACT_BYTES,
+        index=index_factory() if index_factory is not None else None,
+        vector_storage=settings.KB_VECTOR_STORAGE,
+        lexical_index=BM25Index() if settings.KB_HYBRID_SEARCH else None,
+    )
+
+
+@st.cache_resource
+def get_embedding_pool() -> EmbeddingPool:
+    """
+    所有会话共享的多进程向量化工作池，首次大批量导入时启动，之后常驻复用，模型只加载一次
+
+    解析进程与向量化工作进程同时运行，每个工作进程的线程数按扣除解析进程后的核数平分
+    """
+    threads = max(1, ((os.cpu_count() or 1) - settings.PARSE_WORKERS) // settings.EMBEDDING_WORKERS)
+    return EmbeddingPool(
+        embedding_handler_kwargs(),
+        n_workers=settings.EMBEDDING_WORKERS,
+        max_in_flight=settings.EMBEDDING_POOL_IN_FLIGHT,
+        cache_path=settings.EMBEDDING_CACHE_PATH if settings.EMBEDDING_CACHE_ENABLED else None,
+        threads_per_worker=threads,
+    )
+
+
+@st.cache_resource
+def get_ingest_manifest() -> IngestManifest:
+    """所有会话共享的增量入库清单"""
+    return IngestManifest(settings.INGEST_MANIFEST_PATH)
+
+
+@st.cache_resource
+def get_deepseek_client() -> DeepSeekClient:
+    """所有会话共享的 DeepSeek 客户端"""
+    return DeepSeekClient()
+
+
+@st.cache_resource
+def get_rag_service() -> RAGService:
+    """所有会话共享的 RAG 服务"""
+    return RAGService(
+        get_embedding_handler(),
+        get_kb_handler(),
+        get_deepseek_client(),
+        top_k=5,
+    )
+
+
 def initialize_session_state():
-    """初始化 session state"""
+    """
+    初始化 session state
+
+    模型、知识库和 RAG 服务是进程级单例（st.cache_resource），所有会话共享同一份；
+    session state 中只保存对它们的引用和各会话自己的对话历史。加载失败不会被缓存，
+    下一个会话会重新尝试
+    """
     if "messages" not in st.session_state:
         st.session_state.messages = []
 
     if "deepseek_client" not in st.session_state:
         try:
-            st.session_state.deepseek_client = DeepSeekClient()
+            st.session_state.deepseek_client = get_deepseek_client()
         except ValueError as e:
             st.session_state.deepseek_client = None
             st.session_state.api_error = str(e)
 
     if "embedding_handler" not in st.session_state:
         try:
-            logger.info("Loading BGE embedding model...")
-            st.session_state.embedding_handler = BGEEmbeddingHandler()
-            logger.info("BGE model loaded successfully")
+            st.session_state.embedding_handler = get_embedding_handler()
         except Exception as e:
             logger.error(f"Failed to load BGE model: {str(e)}")
             st.session_state.embedding_handler = None
@@ -70,9 +218,7 @@ def initialize_session_state():
     if "kb_handler" not in st.session_state:
         try:
             if st.session_state.get("embedding_handler"):
-                st.session_state.kb_handler = MemoryKBHandler(
-                    st.session_state.embedding_handler
-                )
+                st.session_state.kb_handler = get_kb_handler()
             else:
                 st.session_state.kb_handler = None
         except Exception as e:
@@ -86,12 +232,7 @@ def initialize_session_state():
                 and st.session_state.get("kb_handler")
                 and st.session_state.get("deepseek_client")
             ):
-                st.session_state.rag_service = RAGService(
-                    st.session_state.embedding_handler,
-                    st.session_state.kb_handler,
-                    st.session_state.deepseek_client,
-                    top_k=5,
-                )
+                st.session_state.rag_service = get_rag_service()
             else:
                 st.session_state.rag_service = None
         except Exception as e:
@@ -191,8 +332,14 @@ def handle_user_input(user_input: str, use_rag: bool):
             logger.error(f"Error generating response: {str(e)}")
 
 
-def upload_documents_to_knowledge_base(uploaded_files):
-    """上传文档到知识库"""
+def upload_documents_to_knowledge_base(uploaded_files, collection: str):
+    """
+    上传文档到知识库
+
+    Args:
+        uploaded_files: Streamlit 上传的文件列表
+        collection: 文档分组，同一分组内的同名文件视为同一文件的新版本，替换之前入库的版本
+    """
     if not uploaded_files:
         return
 
@@ -203,41 +350,71 @@ def upload_documents_to_knowledge_base(uploaded_files):
     progress_bar = st.progress(0)
     status_text = st.empty()
 
-    try:
-        all_chunks = []
-        all_metadata = []
-
-        for idx, uploaded_file in enumerate(uploaded_files):
-            status_text.text(f"处理文件 {idx + 1}/{len(uploaded_files)}: {uploaded_file.name}")
-
-            # 保存临时文件
-            temp_path = settings.DATA_DIR / "temp" / uploaded_file.name
-            temp_path.parent.mkdir(parents=True, exist_ok=True)
+    # 每次上传使用独立的临时目录，避免多个会话同时上传同名文件时互相覆盖
+    (settings.DATA_DIR / "temp").mkdir(parents=True, exist_ok=True)
+    temp_dir = Path(tempfile.mkdtemp(dir=settings.DATA_DIR / "temp"))
 
+    try:
+        files = []
+        for uploaded_file in uploaded_files:
+            temp_path = temp_dir / uploaded_file.name
             with open(temp_path, "wb") as f:
                 f.write(uploaded_file.getbuffer())
+            files.append((str(temp_path), {"filename": uploaded_file.name, "collection": collection}))
 
-            # 处理文档
-            chunks, metadata = st.session_state.document_processor.process_file(str(temp_path))
-
-            # 添加文件名到元数据
-            metadata["filename"] = uploaded_file.name
-
-            # 为每个分块创建元数据副本
-            all_chunks.extend(chunks)
-            all_metadata.extend([{**metadata, "chunk_index": i} for i in range(len(chunks))])
-
-            # 删除临时文件
-            os.remove(temp_path)
+        processor = st.session_state.document_processor
+        pipeline = IngestionPipeline(
+            chunk_size=processor.chunk_size,
+            chunk_overlap=processor.chunk_overlap,
+            n_workers=settings.PARSE_WORKERS,
+        )
 
-            progress_bar.progress((idx + 1) / len(uploaded_files))
+        def on_file_parsed(parsed: int, total: int, chunks: int):
+            status_text.text(f"已解析 {parsed}/{total} 个文件，已产生 {chunks} 个文本块，正在向量化...")
+            progress_bar.progress(parsed / total)
 
-        # 添加到知识库
-        if all_chunks:
-            status_text.text(f"添加 {len(all_chunks)} 个文本块到知识库...")
-            st.session_state.rag_service.add_documents(all_chunks, all_metadata)
-            status_text.text(f"✅ 成功添加 {len(all_chunks)} 个文本块")
-            logger.info(f"Successfully added {len(all_chunks)} chunks to knowledge base")
+        # 大批量导入：使用常驻的多进程工作池向量化，结果按批流式写入知识库
+        use_pool = settings.EMBEDDING_WORKERS > 0 and len(files) >= settings.EMBEDDING_POOL_MIN_FILES
+        embedder = get_embedding_pool() if use_pool else None
+        try:
+            stats = pipeline.run(
+                st.session_state.kb_handler,
+                files,
+                embedder=embedder,
+                progress_callback=on_file_parsed,
+                manifest=get_ingest_manifest() if settings.INGEST_MANIFEST_ENABLED else None,
+            )
+        except BrokenProcessPool:
+            # 解析进程池或向量化工作池的进程异常退出；只有使用了向量化工作池时才需要丢弃它，
+            # 工作池不可再用，丢弃缓存，下次导入时重新启动
+            if embedder is not None:
+                logger.error("Embedding pool is broken, restarting it on the next upload")
+                embedder.close()
+                get_embedding_pool.clear()
+            raise
+
+        for path, error in stats["failed"]:
+            st.warning(f"⚠️ {Path(path).name} 处理失败: {error}")
+
+        if stats["skipped"]:
+            st.info(f"ℹ️ {len(stats['skipped'])} 个文件未变化，已跳过: {', '.join(stats['skipped'])}")
+
+        if stats["chunks"]:
+            status_text.text(
+                f"✅ 成功添加 {stats['added']} 个文本块"
+                f"（共 {stats['chunks']} 个，{stats['chunks'] - stats['added']} 个已在知识库中"
+                f"，删除 {stats['deleted']} 个过期文本块）"
+            )
+            st.caption(
+                f"耗时 {stats['wall_seconds']:.1f} 秒 · "
+                f"解析 {stats['parse_chars_per_s'] / 1000:.0f}K 字/秒/进程 · "
+                f"分块 {stats['split_chunks_per_s']:.0f} 块/秒 · "
+                f"向量化 + 写入 {stats['embed_chunks_per_s']:.1f} 块/秒"
+            )
+            logger.info(f"Successfully added {stats['added']} chunks to knowledge base")
+        elif stats["skipped"] and len(stats["skipped"]) == len(files):
+            progress_bar.progress(1.0)
+            status_text.text("✅ 所有文件均未变化，无需更新")
         else:
             status_text.text("❌ 未能从文件中提取内容")
 
@@ -245,6 +422,9 @@ def upload_documents_to_knowledge_base(uploaded_files):
         status_text.error(f"❌ 错误: {str(e)}")
         logger.error(f"Error uploading documents: {str(e)}")
 
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
 
 def main():
     """主函数"""
@@ -360,6 +540,21 @@ def main():
             with col3:
                 st.metric("状态", kb_info["status"])
 
+            embedding_cache = st.session_state.embedding_handler.cache
+            if embedding_cache is not None:
+                cache_stats = embedding_cache.stats()
+                st.caption(
+                    f"向量缓存命中率: {cache_stats['hit_rate']:.1%} · "
+                    f"已缓存 {cache_stats['entries']} 条 / "
+                    f"{cache_stats['bytes_stored'] / 1024 / 1024:.1f} MB"
+                )
+
+            query_stats = get_query_cache().stats()
+            st.caption(
+                f"查询缓存命中率: {query_stats['hit_rate']:.1%} "
+                f"（命中 {query_stats['hits']} / 未命中 {query_stats['misses']}）"
+            )
+
             st.divider()
 
             # 上传文档
@@ -371,9 +566,18 @@ def main():
                 help="支持的格式: PDF, Word (.docx, .doc), Text (.txt)",
             )
 
+            collection = st.text_input(
+                "文档分组",
+                value="default",
+                key="collection",
+                help="知识库由所有会话共享。同一分组内上传同名文件会替换该文件之前的版本，"
+                "不同用户或用途请使用不同的分组，避免互相覆盖",
+            ).strip() or "default"
+            st.caption(f"同一分组内的同名文件会被替换：当前分组「{collection}」")
+
             if st.button("添加到知识库", use_container_width=True):
                 if uploaded_files:
-                    upload_documents_to_knowledge_base(uploaded_files)
+                    upload_documents_to_knowledge_base(uploaded_files, collection)
                 else:
                     st.warning("请先选择文件")
 
@@ -381,9 +585,16 @@ def main():
 
             # 清空知识库
             st.subheader("⚠️ 危险操作")
-            if st.button("🗑️ 清空知识库", use_container_width=True, type="secondary"):
+            if st.button(
+                "🗑️ 清空知识库",
+                use_container_width=True,
+                type="secondary",
+                help="知识库由所有会话共享，清空后对所有用户生效",
+            ):
                 try:
                     st.session_state.rag_service.clear_knowledge_base()
+                    if settings.INGEST_MANIFEST_ENABLED:
+                        get_ingest_manifest().clear()
                     st.success("✅ 知识库已清空")
                     st.rerun()
                 except Exception as e:
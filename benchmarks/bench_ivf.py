@@ -0,0 +1,69 @@
+"""
+IVF 索引速度 / 召回率基准测试
+
+在带聚类结构的合成向量上，对比 IVFIndex 在不同 nprobe 下的单查询延迟和
+recall@k（相对于精确暴力检索），用于选择 nlist / nprobe
+
+用法：
+    python benchmarks/bench_ivf.py [--n 200000] [--nlist 1024] [--nprobe 1 4 16 64]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from common import make_clustered_data, make_queries, time_per_call  # noqa: E402
+from src.ivf_index import IVFIndex  # noqa: E402
+from src.vector_utils import top_k_indices  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--n", type=int, default=200_000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--nlist", type=int, default=1024)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    rng = np.random.default_rng(0)
+    matrix = make_clustered_data(args.n, args.dim, n_topics=args.nlist // 4 or 1, rng=rng)
+
+    queries = make_queries(matrix, args.queries, rng)
+
+    exact = [top_k_indices(matrix @ q, args.top_k) for q in queries]
+    exact_ms = time_per_call(lambda: [top_k_indices(matrix @ q, args.top_k) for q in queries], 1) / args.queries
+
+    index = IVFIndex(nlist=args.nlist)
+    start = time.perf_counter()
+    index.add(np.arange(args.n), matrix)
+    build_s = time.perf_counter() - start
+
+    print(f"n={args.n} dim={args.dim} nlist={args.nlist} top_k={args.top_k} build={build_s:.1f}s")
+    print(f"exact: {exact_ms:.3f} ms/query")
+    print(f"{'nprobe':>7} | {'ms/query':>9} | {'recall@k':>8} | {'speedup':>8}")
+    print("-" * 42)
+
+    for nprobe in args.nprobe:
+        index.nprobe = nprobe
+        approx = [index.search(q, matrix, args.top_k)[0] for q in queries]
+        recall = np.mean(
+            [len(np.intersect1d(a, e)) / len(e) for a, e in zip(approx, exact)]
+        )
+        ivf_ms = time_per_call(
+            lambda: [index.search(q, matrix, args.top_k) for q in queries], 1
+        ) / args.queries
+        print(f"{nprobe:>7} | {ivf_ms:>9.3f} | {recall:>8.3f} | {exact_ms / ivf_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
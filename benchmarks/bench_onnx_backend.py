@@ -0,0 +1,132 @@
+"""
+ONNX Runtime 后端一致性检查与吞吐对比
+
+用同一批文本分别跑 PyTorch（FlagModel）、ONNX fp32 和 ONNX int8 三种后端：
+- 一致性：每条文本 / 查询向量与 PyTorch 结果的余弦相似度（平均 / 最小），
+  以及查询在语料上 top-k 检索结果与 PyTorch 的重合率
+- 吞吐：文档向量化的 docs/s
+
+任一 ONNX 后端的文本向量平均余弦低于 --min-cosine 时以非零状态退出，可作为一致性检查使用。
+需要 FlagEmbedding 和 onnxruntime，首次运行会把模型导出到 --onnx-dir
+
+用法：
+    python benchmarks/bench_onnx_backend.py [--docs 1000] [--threads 4] [--corpus chunks.txt]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.embedding_handler import BGEEmbeddingHandler  # noqa: E402
+
+SENTENCES = [
+    "知识库检索增强生成通过先检索相关文档再生成答案来减少模型幻觉。",
+    "向量数据库按照余弦相似度返回与查询最接近的文本块。",
+    "上传的 PDF 文件会被切分为带有重叠的文本块，然后逐批向量化。",
+    "在没有 GPU 的服务器上，可以使用量化模型降低推理延迟。",
+    "The embedding model maps each chunk to a 512-dimensional normalized vector.",
+    "季度财报显示营业收入同比增长百分之十二，净利润率保持稳定。",
+    "系统管理员需要定期备份快照目录和预写日志文件。",
+    "用户可以在侧边栏中调整温度和最大 token 数等对话参数。",
+]
+QUERIES = [
+    "什么是检索增强生成？",
+    "没有显卡时怎么加速向量化？",
+    "PDF 是如何被切分的？",
+    "公司的利润情况如何？",
+    "如何备份知识库？",
+    "How large are the embedding vectors?",
+]
+
+
+def make_corpus(n_docs: int, seed: int = 0):
+    """由示例句子随机拼接出长短不一的文本块"""
+    rng = np.random.default_rng(seed)
+    counts = np.clip(rng.lognormal(mean=1.2, sigma=0.7, size=n_docs), 1, 20).astype(int)
+    return ["".join(rng.choice(SENTENCES, size=count)) for count in counts]
+
+
+def cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return np.sum(a * b, axis=1)
+
+
+def top_k(queries: np.ndarray, docs: np.ndarray, k: int) -> np.ndarray:
+    return np.argsort(-(queries @ docs.T), axis=1)[:, :k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--model", default="BAAI/bge-small-zh-v1.5")
+    parser.add_argument("--onnx-dir", default=None, help="ONNX 导出目录，默认 data/onnx/<模型名>")
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--corpus", default=None, help="语料文件，每行一个文本块（默认随机生成）")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=0, help="ONNX Runtime 算子内线程数，0 表示自动")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    if args.corpus:
+        texts = [line.strip() for line in open(args.corpus, encoding="utf-8") if line.strip()]
+    else:
+        texts = make_corpus(args.docs)
+    onnx_dir = args.onnx_dir or Path(__file__).resolve().parent.parent / "data" / "onnx" / Path(args.model).name
+
+    backends = {
+        "torch": dict(backend="torch"),
+        "onnx-fp32": dict(backend="onnx", onnx_dir=onnx_dir, onnx_threads=args.threads),
+        "onnx-int8": dict(backend="onnx", onnx_dir=onnx_dir, onnx_quantize=True, onnx_threads=args.threads),
+    }
+
+    print(f"model: {args.model}, corpus: {len(texts)} chunks, batch size {args.batch_size}")
+    print(
+        f"{'backend':<10} | {'docs/s':>8} | {'doc cos mean':>12} | {'doc cos min':>11} | "
+        f"{'query cos min':>13} | {'top-' + str(args.top_k) + ' overlap':>14}"
+    )
+    print("-" * 86)
+
+    reference = None
+    failed = False
+    for name, kwargs in backends.items():
+        handler = BGEEmbeddingHandler(args.model, batch_size=args.batch_size, **kwargs)
+        handler.embed_texts(texts[: args.batch_size])  # 预热
+
+        start = time.perf_counter()
+        docs = handler.embed_texts(texts)
+        elapsed = time.perf_counter() - start
+        queries = handler.embed_queries(QUERIES)
+
+        if reference is None:
+            reference = (docs, queries, top_k(queries, docs, args.top_k))
+            print(f"{name:<10} | {len(texts) / elapsed:>8.1f} | {'-':>12} | {'-':>11} | {'-':>13} | {'-':>14}")
+            continue
+
+        ref_docs, ref_queries, ref_top = reference
+        doc_cos = cosine(docs, ref_docs)
+        query_cos = cosine(queries, ref_queries)
+        found = top_k(queries, docs, args.top_k)
+        overlap = np.mean([len(set(a) & set(b)) / args.top_k for a, b in zip(found, ref_top)])
+        print(
+            f"{name:<10} | {len(texts) / elapsed:>8.1f} | {doc_cos.mean():>12.5f} | {doc_cos.min():>11.5f} | "
+            f"{query_cos.min():>13.5f} | {overlap:>14.1%}"
+        )
+        if doc_cos.mean() < args.min_cosine:
+            failed = True
+
+    if failed:
+        print(f"FAILED: mean cosine below {args.min_cosine}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+量化存储的内存 / 召回率基准测试
+
+对比 float32 精确检索与 int8 标量量化、PQ 量化（含 / 不含 float 重排）的
+每向量字节数、单查询延迟和 recall@k。
+
+另外分别用 vector_storage="memory" / "disk" 构建完整的 MemoryKBHandler，
+用 tracemalloc 统计构建完成后知识库实际持有的堆内存（包括扩容余量、码本和 ID 等固定开销）：
+只有 disk 存储时量化才能降低常驻内存，memory 存储时编码叠加在 float 矩阵之上。
+disk 存储的 float 向量位于可被回收的页缓存中，不计入堆内存
+
+用法：
+    python benchmarks/bench_quantization.py [--n 100000] [--dim 512] [--rerank 50]
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from common import make_clustered_data, make_queries, time_per_call  # noqa: E402
+from src.memory_kb_handler import MemoryKBHandler  # noqa: E402
+from src.quantization import ProductQuantizedIndex, ScalarQuantizedIndex  # noqa: E402
+from src.vector_utils import top_k_indices  # noqa: E402
+
+
+def kb_heap_bytes(matrix: np.ndarray, index, vector_storage: str) -> int:
+    """构建一个知识库，返回构建完成后它仍持有的堆内存字节数（tracemalloc 统计）"""
+    persist_directory = tempfile.mkdtemp(prefix="kb_quant_") if vector_storage == "disk" else None
+    try:
+        tracemalloc.start()
+        kb = MemoryKBHandler(
+            None,
+            persist_directory=persist_directory,
+            wal_compact_bytes=1 << 62,
+            index=index,
+            vector_storage=vector_storage,
+        )
+        for start in range(0, len(matrix), 50_000):
+            end = min(start + 50_000, len(matrix))
+            kb.add_embeddings(matrix[start:end], [""] * (end - start), ids=[f"chunk_{i}" for i in range(start, end)])
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        kb.close()
+        return current
+    finally:
+        if persist_directory is not None:
+            shutil.rmtree(persist_directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--n", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--rerank", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=100)
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    rng = np.random.default_rng(0)
+    matrix = make_clustered_data(args.n, args.dim, n_topics=256, rng=rng)
+    queries = make_queries(matrix, args.queries, rng)
+    exact = [top_k_indices(matrix @ q, args.top_k) for q in queries]
+    exact_ms = time_per_call(lambda: [top_k_indices(matrix @ q, args.top_k) for q in queries], 1)
+
+    float_bytes = args.dim * 4
+    print(f"n={args.n} dim={args.dim} top_k={args.top_k}")
+    print(f"{'mode':<18} | {'bytes/vec':>9} | {'ratio':>6} | {'ms/query':>9} | {'recall@k':>8}")
+    print("-" * 64)
+    print(f"{'float32 exact':<18} | {float_bytes:>9} | {'1.0x':>6} | {exact_ms / args.queries:>9.3f} | {1.0:>8.3f}")
+
+    modes = [
+        ("int8", lambda rerank: ScalarQuantizedIndex(rerank=rerank)),
+        ("pq", lambda rerank: ProductQuantizedIndex(rerank=rerank)),
+    ]
+    for name, factory in modes:
+        index = factory(0)
+        index.add(np.arange(args.n), matrix)
+
+        for rerank in (0, args.rerank):
+            index.rerank = rerank
+            approx = [index.search(q, matrix, args.top_k)[0] for q in queries]
+            recall = np.mean([len(np.intersect1d(a, e)) / len(e) for a, e in zip(approx, exact)])
+            ms = time_per_call(lambda: [index.search(q, matrix, args.top_k) for q in queries], 1)
+
+            label = f"{name} + rerank {rerank}" if rerank else name
+            ratio = f"{float_bytes / index.code_size:.0f}x"
+            print(
+                f"{label:<18} | {index.code_size:>9} | {ratio:>6} | "
+                f"{ms / args.queries:>9.3f} | {recall:>8.3f}"
+            )
+
+    print()
+    print(f"{'KB resident heap':<18} | {'storage':>7} | {'MB':>8} | {'vs float':>8}")
+    print("-" * 50)
+    baseline = kb_heap_bytes(matrix, None, "memory")
+    print(f"{'float32 flat':<18} | {'memory':>7} | {baseline / 1024 / 1024:>8.1f} | {'1.00x':>8}")
+    for name, factory in modes:
+        for vector_storage in ("memory", "disk"):
+            heap = kb_heap_bytes(matrix, factory(args.rerank), vector_storage)
+            print(
+                f"{name:<18} | {vector_storage:>7} | {heap / 1024 / 1024:>8.1f} | "
+                f"{heap / baseline:>7.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
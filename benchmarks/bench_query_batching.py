@@ -0,0 +1,114 @@
+"""
+查询微批处理延迟 / 吞吐基准测试
+
+在不同并发调用方数量下，对比逐条 encode_queries 与 EmbeddingBroker 微批处理的
+单查询平均 / p95 延迟和总吞吐
+
+默认使用模拟编码器：每次前向 = 固定开销 + 每条查询的边际开销，并用锁模拟
+同一个模型实例在 CPU 上同一时刻只能跑一个前向；安装 FlagEmbedding 后可用
+--model 测量真实的 BGE 模型
+
+用法：
+    python benchmarks/bench_query_batching.py [--concurrency 1 8 32] [--model BAAI/bge-small-zh-v1.5]
+"""
+import argparse
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.embedding_broker import EmbeddingBroker  # noqa: E402
+
+
+class SyntheticEncoder:
+    """模拟 CPU 上的 BGE 前向：固定开销 + 每条查询的边际开销，串行执行"""
+
+    def __init__(self, overhead_ms: float, per_item_ms: float, dim: int = 512):
+        self.overhead = overhead_ms / 1000
+        self.per_item = per_item_ms / 1000
+        self.dim = dim
+        self._lock = threading.Lock()
+
+    def encode_queries(self, queries):
+        with self._lock:
+            time.sleep(self.overhead + self.per_item * len(queries))
+        return np.zeros((len(queries), self.dim), dtype=np.float32)
+
+
+def run(embed_fn, concurrency: int, per_caller: int):
+    """concurrency 个线程各自串行发起 per_caller 次查询，返回 (平均延迟, p95 延迟, 吞吐)"""
+    latencies = []
+    lock = threading.Lock()
+
+    def caller(worker: int):
+        local = []
+        for i in range(per_caller):
+            start = time.perf_counter()
+            embed_fn(f"第 {worker} 位用户的第 {i} 个问题")
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=caller, args=(w,)) for w in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    return latencies.mean(), np.percentile(latencies, 95), len(latencies) / wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--queries-per-caller", type=int, default=20)
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=2.0)
+    parser.add_argument("--model", default=None, help="使用真实的 BGE 模型（需要 FlagEmbedding）")
+    parser.add_argument("--overhead-ms", type=float, default=8.0, help="模拟编码器的单次前向固定开销")
+    parser.add_argument("--per-item-ms", type=float, default=0.6, help="模拟编码器的每条查询边际开销")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    if args.model:
+        from src.embedding_handler import BGEEmbeddingHandler
+
+        encoder = BGEEmbeddingHandler(args.model).model
+        label = args.model
+    else:
+        encoder = SyntheticEncoder(args.overhead_ms, args.per_item_ms)
+        label = f"synthetic ({args.overhead_ms} ms + {args.per_item_ms} ms/query)"
+
+    print(f"encoder: {label}")
+    print(f"{'callers':>7} | {'mode':<7} | {'mean ms':>8} | {'p95 ms':>8} | {'qps':>8} | {'avg batch':>9}")
+    print("-" * 62)
+
+    for concurrency in args.concurrency:
+        mean, p95, qps = run(
+            lambda q: encoder.encode_queries([q])[0], concurrency, args.queries_per_caller
+        )
+        print(f"{concurrency:>7} | {'direct':<7} | {mean:>8.2f} | {p95:>8.2f} | {qps:>8.1f} | {1:>9.1f}")
+
+        broker = EmbeddingBroker(
+            encoder.encode_queries,
+            max_batch_size=args.max_batch_size,
+            max_wait_ms=args.max_wait_ms,
+        )
+        mean, p95, qps = run(broker.embed_query, concurrency, args.queries_per_caller)
+        broker.close()
+        avg_batch = broker.queries / broker.batches
+        print(f"{concurrency:>7} | {'broker':<7} | {mean:>8.2f} | {p95:>8.2f} | {qps:>8.1f} | {avg_batch:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
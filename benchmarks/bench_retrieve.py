@@ -0,0 +1,76 @@
+"""
+MemoryKBHandler 单查询检索延迟基准测试
+
+对比两种实现：
+- 旧路径：向量存于 Python 列表，每次查询 np.array() 重建矩阵，
+  sklearn cosine_similarity 重新归一化，再做全量 argsort
+- 新路径：写入时归一化的连续 float32 矩阵，矩阵-向量点积 + argpartition
+
+用法：
+    python benchmarks/bench_retrieve.py [--sizes 10000 100000 1000000] [--dim 512]
+"""
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from common import RandomEmbeddingHandler, fill_kb, time_per_call  # noqa: E402
+from src.memory_kb_handler import MemoryKBHandler  # noqa: E402
+
+try:
+    from sklearn.metrics.pairwise import cosine_similarity
+except ImportError:
+    cosine_similarity = None
+
+
+def legacy_retrieve(embedding_list, query_embedding, top_k):
+    """旧版 retrieve() 的打分与排序路径"""
+    embeddings_array = np.array(embedding_list)
+    similarities = cosine_similarity([query_embedding], embeddings_array)[0]
+    return np.argsort(-similarities)[:top_k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--skip-legacy", action="store_true", help="不运行旧路径（大规模时内存占用很高）")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    embedding_handler = RandomEmbeddingHandler(dim=args.dim)
+    query_embedding = embedding_handler.embed_query("benchmark")
+
+    print(f"{'chunks':>10} | {'legacy (ms)':>12} | {'current (ms)':>12} | {'speedup':>8}")
+    print("-" * 52)
+
+    for n_docs in args.sizes:
+        kb = MemoryKBHandler(embedding_handler)
+        fill_kb(kb, n_docs)
+
+        current_ms = time_per_call(lambda: kb.retrieve("benchmark", top_k=args.top_k), args.repeat)
+
+        if args.skip_legacy or cosine_similarity is None:
+            print(f"{n_docs:>10} | {'-':>12} | {current_ms:>12.2f} | {'-':>8}")
+            continue
+
+        # 旧路径的存储形式：每行一个独立的 numpy 数组
+        embedding_list = list(kb.embeddings.astype(np.float64))
+        legacy_ms = time_per_call(
+            lambda: legacy_retrieve(embedding_list, query_embedding, args.top_k), args.repeat
+        )
+        del embedding_list
+
+        print(f"{n_docs:>10} | {legacy_ms:>12.2f} | {current_ms:>12.2f} | {legacy_ms / current_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
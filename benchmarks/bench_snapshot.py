@@ -0,0 +1,83 @@
+"""
+MemoryKBHandler 快照保存 / 加载耗时基准测试
+
+文档默认约 800 字符（与应用的分块大小一致）并带有文件名 / 页码元数据，
+同时报告快照大小和首次按行读取文档的耗时
+
+用法：
+    python benchmarks/bench_snapshot.py [--sizes 100000 1000000] [--dim 512] [--doc-chars 800]
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from loguru import logger
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from common import RandomEmbeddingHandler, fill_kb  # noqa: E402
+from src.memory_kb_handler import MemoryKBHandler  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--doc-chars", type=int, default=800, help="每条文档的字符数")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    embedding_handler = RandomEmbeddingHandler(dim=args.dim)
+
+    print(f"doc chars: {args.doc_chars}, dim: {args.dim}")
+    print(
+        f"{'chunks':>10} | {'size (MB)':>9} | {'save (s)':>9} | {'load mmap (s)':>13} | "
+        f"{'load full (s)':>13} | {'1k reads (ms)':>13}"
+    )
+    print("-" * 84)
+
+    rng = np.random.default_rng(0)
+    for n_docs in args.sizes:
+        kb = MemoryKBHandler(embedding_handler)
+        fill_kb(kb, n_docs, doc_chars=args.doc_chars)
+        snapshot_dir = Path(tempfile.mkdtemp(prefix="kb_snapshot_"))
+
+        try:
+            start = time.perf_counter()
+            kb.save(snapshot_dir)
+            save_s = time.perf_counter() - start
+            size_mb = sum(p.stat().st_size for p in snapshot_dir.iterdir()) / 1024 / 1024
+            del kb
+
+            timings = []
+            for mmap in (True, False):
+                restored = MemoryKBHandler(embedding_handler)
+                start = time.perf_counter()
+                restored.load(snapshot_dir, mmap=mmap)
+                timings.append(time.perf_counter() - start)
+                if mmap:
+                    # 检索结果按行读取文档和元数据：mmap 加载时这一步才解码
+                    rows = rng.integers(0, n_docs, 1000)
+                    start = time.perf_counter()
+                    for row in rows.tolist():
+                        restored.documents[row], restored.metadata[row]
+                    reads_ms = (time.perf_counter() - start) * 1000
+                del restored
+
+            print(
+                f"{n_docs:>10} | {size_mb:>9.0f} | {save_s:>9.2f} | {timings[0]:>13.3f} | "
+                f"{timings[1]:>13.3f} | {reads_ms:>13.1f}"
+            )
+        finally:
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+基准测试公共工具
+提供不依赖 BGE 模型的随机向量化处理器，便于单独测量检索 / 存储路径
+"""
+import time
+from typing import Callable, List
+
+import numpy as np
+
+
+class RandomEmbeddingHandler:
+    """
+    随机向量化处理器
+
+    接口与 BGEEmbeddingHandler 保持一致，但只生成固定种子的随机向量，
+    用于在没有模型的环境下构造大规模知识库
+    """
+
+    def __init__(self, dim: int = 512, seed: int = 0):
+        self.model_name = f"random-{dim}"
+        self.dim = dim
+        self.rng = np.random.default_rng(seed)
+
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        return self.rng.standard_normal((len(texts), self.dim), dtype=np.float32)
+
+    def embed_query(self, query: str) -> np.ndarray:
+        return self.rng.standard_normal(self.dim, dtype=np.float32)
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        return self.rng.standard_normal((len(queries), self.dim), dtype=np.float32)
+
+    def get_embedding_dim(self) -> int:
+        return self.dim
+
+
+def make_chunks(start: int, end: int, doc_chars: int, seed: int = 0) -> List[str]:
+    """
+    生成编号为 [start, end) 的随机文本块
+
+    doc_chars 为 0 时只生成 "chunk {i}" 这样的短文本；否则从一段随机汉字中截取
+    约 doc_chars 个字符，模拟真实分块的长度
+    """
+    if doc_chars <= 0:
+        return [f"chunk {i}" for i in range(start, end)]
+    rng = np.random.default_rng(seed)
+    pool = "".join(map(chr, rng.integers(0x4E00, 0x9FA5, 1 << 20)))
+    offsets = rng.integers(0, len(pool) - doc_chars, end)
+    return [f"chunk {i} {pool[offsets[i] : offsets[i] + doc_chars]}" for i in range(start, end)]
+
+
+def fill_kb(kb, n_docs: int, batch_size: int = 50_000, doc_chars: int = 0) -> None:
+    """
+    向知识库批量写入 n_docs 条随机文档
+
+    Args:
+        doc_chars: 每条文档的字符数，0 表示使用很短的占位文本（只测量向量路径时）
+    """
+    for start in range(0, n_docs, batch_size):
+        end = min(start + batch_size, n_docs)
+        kb.add_documents(
+            make_chunks(start, end, doc_chars),
+            metadata=[
+                {"filename": f"file_{i // 500}.pdf", "chunk_index": i % 500, "page": i % 500 // 3 + 1}
+                for i in range(start, end)
+            ],
+            ids=[f"chunk_{i}" for i in range(start, end)],
+        )
+
+
+def time_per_call(fn: Callable[[], object], repeat: int = 20) -> float:
+    """返回 fn 的单次调用平均耗时（毫秒），先预热一次"""
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def make_clustered_data(n: int, dim: int, n_topics: int, rng: np.random.Generator) -> np.ndarray:
+    """生成带主题聚类结构的归一化向量，近似真实文档向量的分布"""
+    topics = rng.standard_normal((n_topics, dim), dtype=np.float32)
+    labels = rng.integers(0, n_topics, n)
+    noise = rng.standard_normal((n, dim), dtype=np.float32) * 0.6
+    vectors = topics[labels] + noise
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def make_queries(matrix: np.ndarray, n_queries: int, rng: np.random.Generator) -> np.ndarray:
+    """取库中向量加扰动作为查询"""
+    picks = rng.choice(len(matrix), n_queries, replace=False)
+    queries = matrix[picks] + rng.standard_normal((n_queries, matrix.shape[1]), dtype=np.float32) * 0.3
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
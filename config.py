@@ -27,10 +27,64 @@ class Settings(BaseSettings):
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
     DEBUG_MODE: bool = os.getenv("DEBUG_MODE", "False").lower() == "true"
 
+    # 文档解析配置：并行解析上传文件的进程数（1 表示逐个解析）
+    PARSE_WORKERS: int = int(os.getenv("PARSE_WORKERS", "4"))
+    # 增量入库：按 "分组/文件名" 记录文件哈希与分块，重新上传时跳过未变化的文件、只处理变化的分块；
+    # 同一分组内上传同名文件会替换之前的版本
+    INGEST_MANIFEST_ENABLED: bool = os.getenv("INGEST_MANIFEST_ENABLED", "True").lower() == "true"
+
+    # 内存知识库配置
+    KB_WAL_COMPACT_BYTES: int = int(os.getenv("KB_WAL_COMPACT_BYTES", str(64 * 1024 * 1024)))
+    # float 向量存放位置：memory 或 disk（持久化目录中的内存映射文件）
+    KB_VECTOR_STORAGE: str = os.getenv("KB_VECTOR_STORAGE", "memory")
+    # 检索索引：flat（暴力检索）、ivf、hnsw、sq8（int8 量化）或 pq（乘积量化）
+    # sq8 / pq 只有配合 KB_VECTOR_STORAGE=disk 才能降低常驻内存，否则编码叠加在 float 矩阵之上
+    # hnsw 建图为纯 Python 逐个插入，每个节点约 4-5 ms（随图规模增长）：写入、WAL 重放、
+    # 以及从没有图结构的快照加载时都要付出这部分时间（检索不会被阻塞）
+    KB_INDEX: str = os.getenv("KB_INDEX", "flat")
+    KB_IVF_NLIST: int = int(os.getenv("KB_IVF_NLIST", "1024"))
+    KB_IVF_NPROBE: int = int(os.getenv("KB_IVF_NPROBE", "16"))
+    KB_HNSW_M: int = int(os.getenv("KB_HNSW_M", "16"))
+    KB_HNSW_EF_SEARCH: int = int(os.getenv("KB_HNSW_EF_SEARCH", "64"))
+    KB_PQ_SUBVECTORS: int = int(os.getenv("KB_PQ_SUBVECTORS", "128"))
+    # 量化检索后用 float 向量重排的候选数量，0 表示不重排
+    KB_QUANT_RERANK: int = int(os.getenv("KB_QUANT_RERANK", "50"))
+    # 混合检索：稠密检索与 BM25 关键词检索做倒数排名融合（默认关闭）。
+    # 开启后结果按融合排名排序，distances 仍为稠密余弦距离，不再随排名单调递增
+    KB_HYBRID_SEARCH: bool = os.getenv("KB_HYBRID_SEARCH", "False").lower() == "true"
+    # 分片工作进程数量，大于 1 时使用 ShardedKBHandler（仅暴力检索）
+    KB_SHARDS: int = int(os.getenv("KB_SHARDS", "1"))
+
+    # 向量化配置
+    # 文档向量化批大小（文本按 token 长度分桶后逐批编码）
+    EMBEDDING_BATCH_SIZE: int = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+    # 推理后端：torch（FlagModel）或 onnx（ONNX Runtime，需要 onnxruntime）
+    EMBEDDING_BACKEND: str = os.getenv("EMBEDDING_BACKEND", "torch")
+    # ONNX 后端：是否使用动态 int8 量化模型，以及算子内线程数（0 表示自动）
+    EMBEDDING_ONNX_QUANTIZE: bool = os.getenv("EMBEDDING_ONNX_QUANTIZE", "False").lower() == "true"
+    EMBEDDING_ONNX_THREADS: int = int(os.getenv("EMBEDDING_ONNX_THREADS", "0"))
+    # 大批量导入：工作进程数（0 表示在应用进程内向量化）、启用工作池的最少文件数、最大在途批次数（0 表示 2 × 进程数）。
+    # 工作池在首次大批量导入时启动并常驻（各进程保留一份模型），每个进程的线程数为 (CPU 核数 - PARSE_WORKERS) / 进程数
+    EMBEDDING_WORKERS: int = int(os.getenv("EMBEDDING_WORKERS", "0"))
+    EMBEDDING_POOL_MIN_FILES: int = int(os.getenv("EMBEDDING_POOL_MIN_FILES", "20"))
+    EMBEDDING_POOL_IN_FLIGHT: int = int(os.getenv("EMBEDDING_POOL_IN_FLIGHT", "0"))
+    # 文档向量磁盘缓存（按模型名 + 内容哈希复用已计算的向量）
+    EMBEDDING_CACHE_ENABLED: bool = os.getenv("EMBEDDING_CACHE_ENABLED", "True").lower() == "true"
+    # 查询向量 LRU 缓存：容量与有效期（秒，0 表示不过期）
+    QUERY_CACHE_SIZE: int = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+    QUERY_CACHE_TTL: float = float(os.getenv("QUERY_CACHE_TTL", "0"))
+    # 查询微批处理：单批最大查询数（1 表示关闭）与最长等待时间（毫秒）
+    QUERY_BATCH_SIZE: int = int(os.getenv("QUERY_BATCH_SIZE", "32"))
+    QUERY_BATCH_WAIT_MS: float = float(os.getenv("QUERY_BATCH_WAIT_MS", "2"))
+
     # 项目路径
     PROJECT_ROOT: Path = Path(__file__).parent
     DATA_DIR: Path = PROJECT_ROOT / "data"
     LOGS_DIR: Path = PROJECT_ROOT / "logs"
+    KB_SNAPSHOT_DIR: Path = DATA_DIR / "memory_kb"
+    EMBEDDING_CACHE_PATH: Path = DATA_DIR / "embedding_cache.sqlite3"
+    EMBEDDING_ONNX_DIR: Path = DATA_DIR / "onnx" / "bge-small-zh-v1.5"
+    INGEST_MANIFEST_PATH: Path = DATA_DIR / "ingest_manifest.sqlite3"
 
     class Config:
         env_file = ".env"
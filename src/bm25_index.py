@@ -0,0 +1,320 @@
+"""
+BM25 稀疏词项索引
+弥补稠密向量对产品型号、错误码、人名等精确字面匹配的不足，
+由 MemoryKBHandler 与稠密检索结果做倒数排名融合（RRF）
+
+分词不依赖词典：
+    - 中日韩文字按字符二元组（bigram）切分，单字成段时保留单字
+    - 拉丁字母与数字按单词切分并转小写，保留 "err-404"、"v1.2" 这类连字符 / 点号复合词
+
+倒排表按词项存储 (行号, 词频)，检索时只访问查询词项的倒排表并稀疏累加 BM25 分数，
+删除时扣减文档频率和总长度，倒排表中的墓碑行由调用方在检索时屏蔽
+"""
+import math
+import re
+import unicodedata
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.kb_snapshot import decode_strings, encode_strings
+from src.vector_utils import top_k_indices
+
+_CJK = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af"
+_TOKEN_PATTERN = re.compile(rf"[{_CJK}]+|[0-9a-z]+(?:[-_.][0-9a-z]+)*")
+_CJK_PATTERN = re.compile(rf"[{_CJK}]")
+
+# 词频按 uint16 存储
+_MAX_TF = 65535
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    把文本切分为检索词项
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        词项列表（保留重复，用于统计词频）
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(text):
+        segment = match.group()
+        if _CJK_PATTERN.match(segment):
+            if len(segment) == 1:
+                tokens.append(segment)
+            else:
+                tokens.extend(segment[i : i + 2] for i in range(len(segment) - 1))
+        else:
+            tokens.append(segment)
+    return tokens
+
+
+class BM25Index:
+    """BM25 稀疏倒排索引，行号空间与 MemoryKBHandler 的向量矩阵一致"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """
+        Args:
+            k1: 词频饱和参数
+            b: 文档长度归一化参数
+        """
+        self.k1 = k1
+        self.b = b
+        self.reset()
+
+    def reset(self) -> None:
+        """清空索引"""
+        self._term_id: Dict[str, int] = {}
+        self._post_rows: List[array] = []
+        self._post_tfs: List[array] = []
+        self._df: List[int] = []
+        self._cache: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        self._doc_len = np.zeros(0, dtype=np.float32)
+        self._n_rows = 0
+        self._n_docs = 0
+        self._total_len = 0.0
+
+    def _grow(self, n_rows: int) -> None:
+        if n_rows > len(self._doc_len):
+            doc_len = np.zeros(max(n_rows, 2 * len(self._doc_len)), dtype=np.float32)
+            doc_len[: self._n_rows] = self._doc_len[: self._n_rows]
+            self._doc_len = doc_len
+        self._n_rows = max(self._n_rows, n_rows)
+
+    def prepare(self, documents: List[str]):
+        """
+        分词并统计一批文档的词频，不修改索引，可以在检索进行时调用
+
+        Args:
+            documents: 文档内容列表
+
+        Returns:
+            交给 add 的中间结果：(批内词表, 批内词项号, 批内行偏移, 词频, 文档长度)，
+            后三者按 (词项, 行) 排序
+        """
+        vocab: Dict[str, int] = {}
+        term_ids: List[int] = []
+        lengths = np.zeros(len(documents), dtype=np.int64)
+        for offset, text in enumerate(documents):
+            tokens = tokenize(text)
+            lengths[offset] = len(tokens)
+            term_ids.extend(vocab.setdefault(term, len(vocab)) for term in tokens)
+
+        # 用 numpy 统计 (词项, 行) 的词频
+        n_docs = max(len(documents), 1)
+        keys = np.array(term_ids, dtype=np.int64) * n_docs + np.repeat(
+            np.arange(len(documents), dtype=np.int64), lengths
+        )
+        keys, tfs = np.unique(keys, return_counts=True)
+        return (
+            list(vocab),
+            keys // n_docs,
+            (keys % n_docs).astype(np.uint32),
+            np.minimum(tfs, _MAX_TF).astype(np.uint16),
+            lengths,
+        )
+
+    def add(self, start_row: int, documents: List[str], prepared=None) -> None:
+        """
+        索引从 start_row 开始的连续若干行
+
+        Args:
+            start_row: 第一篇文档的行号
+            documents: 文档内容列表
+            prepared: prepare(documents) 的结果（可选），提供时不再重复分词
+        """
+        vocab, terms, offsets, tfs, lengths = prepared or self.prepare(documents)
+        self._grow(start_row + len(documents))
+
+        # 把批内词项映射到全局词项号，再按词项追加到倒排表
+        global_ids = [self._term_id.setdefault(term, len(self._term_id)) for term in vocab]
+        for _ in range(len(self._term_id) - len(self._df)):
+            self._post_rows.append(array("I"))
+            self._post_tfs.append(array("H"))
+            self._df.append(0)
+
+        if len(terms):
+            rows = offsets + np.uint32(start_row)
+            bounds = np.flatnonzero(np.diff(terms)) + 1
+            starts = np.concatenate(([0], bounds))
+            ends = np.concatenate((bounds, [len(terms)]))
+            for local_id, begin, end in zip(terms[starts].tolist(), starts.tolist(), ends.tolist()):
+                term_id = global_ids[local_id]
+                self._post_rows[term_id].frombytes(rows[begin:end].tobytes())
+                self._post_tfs[term_id].frombytes(tfs[begin:end].tobytes())
+                self._df[term_id] += end - begin
+
+        self._doc_len[start_row : start_row + len(documents)] = lengths
+        self._total_len += float(lengths.sum())
+        self._n_docs += len(documents)
+        self._cache.clear()
+
+    def remove(self, row: int, document: str) -> None:
+        """
+        从统计量中扣除一篇文档（倒排表中的条目由调用方通过墓碑屏蔽）
+
+        Args:
+            row: 文档行号
+            document: 文档内容，用于找出其包含的词项
+        """
+        for term in set(tokenize(document)):
+            term_id = self._term_id.get(term)
+            if term_id is not None:
+                self._df[term_id] -= 1
+        self._total_len -= float(self._doc_len[row])
+        self._n_docs -= 1
+
+    def _postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        cached = self._cache.get(term_id)
+        if cached is None:
+            cached = (
+                np.array(self._post_rows[term_id], dtype=np.int64),
+                np.array(self._post_tfs[term_id], dtype=np.float32),
+            )
+            self._cache[term_id] = cached
+        return cached
+
+    def search(
+        self,
+        query: str,
+        k: int,
+        deleted: Optional[np.ndarray] = None,
+        candidates: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        BM25 检索 top-k
+
+        Args:
+            query: 查询文本
+            k: 返回数量
+            deleted: 墓碑标记（可选），为 True 的行不会被返回
+            candidates: 候选行号（可选，升序），如元数据过滤的结果
+
+        Returns:
+            (行号数组, BM25 分数数组)，按分数降序；没有任何词项命中时为空
+        """
+        term_ids = [
+            self._term_id[term]
+            for term in set(tokenize(query))
+            if term in self._term_id and self._df[self._term_id[term]] > 0
+        ]
+        if not term_ids or self._n_docs <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        avg_len = self._total_len / self._n_docs
+        all_rows, all_scores = [], []
+        for term_id in term_ids:
+            rows, tfs = self._postings(term_id)
+            df = self._df[term_id]
+            idf = math.log(1 + (self._n_docs - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self._doc_len[rows] / avg_len)
+            all_rows.append(rows)
+            all_scores.append(idf * tfs * (self.k1 + 1) / (tfs + norm))
+
+        # 只在命中查询词项的行上稀疏累加
+        rows, inverse = np.unique(np.concatenate(all_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+
+        keep = np.ones(len(rows), dtype=bool)
+        if deleted is not None:
+            keep &= ~deleted[rows]
+        if candidates is not None:
+            keep &= np.isin(rows, candidates, assume_unique=True)
+        rows, scores = rows[keep], scores[keep]
+
+        top = top_k_indices(scores, k)
+        return rows[top], scores[top]
+
+    def _compacted(self, live_rows: np.ndarray):
+        """
+        按 live_rows 重新编号，返回 CSR 形式的 (词表列表, 偏移, 行号, 词频, 文档长度)
+
+        直接以零拷贝视图读取倒排表，不经过检索缓存，避免为整个索引生成一份常驻副本
+        """
+        new_row = np.full(self._n_rows, -1, dtype=np.int64)
+        new_row[live_rows] = np.arange(len(live_rows))
+
+        vocab, offsets, rows_parts, tfs_parts = [], [0], [], []
+        for term, term_id in self._term_id.items():
+            rows = np.frombuffer(self._post_rows[term_id], dtype=np.uint32)
+            tfs = np.frombuffer(self._post_tfs[term_id], dtype=np.uint16)
+            mapped = new_row[rows]
+            keep = mapped >= 0
+            if not keep.any():
+                continue
+            vocab.append(term)
+            rows_parts.append(mapped[keep])
+            tfs_parts.append(tfs[keep])
+            offsets.append(offsets[-1] + int(keep.sum()))
+
+        return (
+            vocab,
+            np.array(offsets, dtype=np.int64),
+            np.concatenate(rows_parts) if rows_parts else np.empty(0, dtype=np.int64),
+            np.concatenate(tfs_parts) if tfs_parts else np.empty(0, dtype=np.uint16),
+            self._doc_len[live_rows],
+        )
+
+    def _load_csr(self, vocab, offsets, rows, tfs, doc_len) -> None:
+        self.reset()
+        rows = np.asarray(rows, dtype=np.uint32)
+        tfs = np.asarray(tfs).astype(np.uint16)
+        for term_id, term in enumerate(vocab):
+            start, end = offsets[term_id], offsets[term_id + 1]
+            self._term_id[term] = term_id
+            self._post_rows.append(array("I", rows[start:end].tobytes()))
+            self._post_tfs.append(array("H", tfs[start:end].tobytes()))
+            self._df.append(int(end - start))
+
+        self._doc_len = np.array(doc_len, dtype=np.float32)
+        self._n_rows = len(self._doc_len)
+        self._n_docs = self._n_rows
+        self._total_len = float(self._doc_len.sum())
+
+    def remap(self, live_rows: np.ndarray) -> None:
+        """
+        回收墓碑行后按新行号重建倒排表
+
+        Args:
+            live_rows: 旧行号空间中保留的行，按顺序编号为 0..len-1
+        """
+        self._load_csr(*self._compacted(live_rows))
+
+    def state(self, live_rows: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        导出与快照对齐的索引状态（快照只包含 live_rows 中的行，并按顺序重新编号）
+
+        词表按快照文本列的布局保存为 UTF-8 数据 + 偏移
+        """
+        vocab, offsets, rows, tfs, doc_len = self._compacted(live_rows)
+        vocab_blob, vocab_offsets = encode_strings(vocab)
+        return {
+            "bm25_vocab_blob": vocab_blob,
+            "bm25_vocab_offsets": vocab_offsets,
+            "bm25_offsets": offsets,
+            "bm25_rows": rows,
+            "bm25_tfs": tfs,
+            "bm25_doc_len": doc_len,
+        }
+
+    def load_state(self, state: Dict[str, np.ndarray]) -> bool:
+        """
+        从快照恢复索引状态
+
+        Returns:
+            快照中是否包含 BM25 状态
+        """
+        if "bm25_vocab_blob" not in state:
+            return False
+        self._load_csr(
+            decode_strings(state["bm25_vocab_blob"], state["bm25_vocab_offsets"]),
+            state["bm25_offsets"],
+            state["bm25_rows"],
+            state["bm25_tfs"],
+            state["bm25_doc_len"],
+        )
+        return True
@@ -2,10 +2,21 @@
 ChromaDB 知识库管理模块
 """
 import chromadb
-from typing import List, Dict, Optional
+import numpy as np
+from typing import Callable, Iterable, List, Dict, Optional
 from loguru import logger
 from pathlib import Path
 
+from src.content_hash import content_ids, select_new
+from src.stream_ingest import add_documents_stream
+
+
+def _to_chroma_where(where: Optional[Dict]) -> Optional[Dict]:
+    """ChromaDB 要求多个字段的过滤条件显式写成 $and"""
+    if not where or len(where) == 1:
+        return where or None
+    return {"$and": [{key: value} for key, value in where.items()]}
+
 
 class ChromaHandler:
     """ChromaDB 知识库管理器"""
@@ -62,7 +73,8 @@ class ChromaHandler:
         Args:
             documents: 文档内容列表
             metadata: 元数据列表（可选），每个元数据对应一个文档
-            ids: 文档 ID 列表（可选），如果不提供会自动生成
+            ids: 文档 ID 列表（可选），如果不提供会使用内容哈希生成，
+                集合中已有的内容直接跳过，不再向量化
 
         Raises:
             ValueError: 参数验证失败
@@ -74,37 +86,127 @@ class ChromaHandler:
         if metadata is None:
             metadata = [{} for _ in documents]
 
-        if ids is None:
-            ids = [f"doc_{i}_{hash(doc)}" for i, doc in enumerate(documents)]
-
         if len(documents) != len(metadata):
             raise ValueError("documents and metadata must have the same length")
 
         try:
+            if ids is None:
+                total = len(documents)
+                ids = content_ids(documents)
+                documents, metadata, ids = select_new(
+                    documents, metadata, ids, self.get_existing_ids(ids)
+                )
+                if len(documents) < total:
+                    logger.info(f"Skipping {total - len(documents)} chunks already in the knowledge base")
+                if not documents:
+                    return
+
             logger.info(f"Adding {len(documents)} documents to knowledge base")
 
             # 向量化文档
             embeddings = self.embedding_handler.embed_texts(documents)
+            self.add_embeddings(embeddings, documents, metadata, ids)
 
-            # 添加到 ChromaDB
-            self.collection.add(
-                embeddings=embeddings.tolist(),
-                metadatas=metadata,
-                documents=documents,
-                ids=ids,
-            )
+        except Exception as e:
+            logger.error(f"Error adding documents: {str(e)}")
+            raise
 
-            logger.info(f"Successfully added {len(documents)} documents")
-            logger.info(f"Collection now contains {self.collection.count()} documents")
+    def add_embeddings(
+        self,
+        embeddings: np.ndarray,
+        documents: List[str],
+        metadata: Optional[List[Dict]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> None:
+        """
+        添加已向量化的文档
 
+        Args:
+            embeddings: 文档向量，形状为 (n_docs, embedding_dim)
+            documents: 文档内容列表
+            metadata: 元数据列表（可选）
+            ids: 文档 ID 列表（可选），不提供时使用内容哈希
+        """
+        if not documents:
+            raise ValueError("Documents list cannot be empty")
+
+        if metadata is None:
+            metadata = [{} for _ in documents]
+        if ids is None:
+            ids = content_ids(documents)
+
+        self.collection.add(
+            embeddings=np.asarray(embeddings).tolist(),
+            metadatas=metadata,
+            documents=documents,
+            ids=ids,
+        )
+
+        logger.info(f"Successfully added {len(documents)} documents")
+        logger.info(f"Collection now contains {self.collection.count()} documents")
+
+    def add_documents_stream(
+        self,
+        documents: Iterable[str],
+        metadata: Optional[Iterable[Dict]] = None,
+        batch_size: int = 256,
+        embedder=None,
+        progress_callback: Optional[Callable[[int], None]] = None,
+    ) -> int:
+        """
+        流式添加文档：逐批去重、向量化并写入，峰值内存与 batch_size 成正比
+
+        Args:
+            documents: 文档内容的可迭代对象（可以是生成器）
+            metadata: 与 documents 对齐的元数据可迭代对象（可选）
+            batch_size: 每批文档数
+            embedder: 提供 embed_stream 的向量化器（可选），默认使用 embedding_handler
+            progress_callback: 每写入一批后以已处理的文档数调用（可选）
+
+        Returns:
+            实际写入的文档数（已在集合中的内容被跳过）
+        """
+        try:
+            return add_documents_stream(
+                self,
+                embedder or self.embedding_handler,
+                documents,
+                metadata,
+                batch_size=batch_size,
+                progress_callback=progress_callback,
+            )
         except Exception as e:
             logger.error(f"Error adding documents: {str(e)}")
             raise
 
+    def add_references(self, doc_ids: List[str], metadata: List[Dict]) -> int:
+        """
+        与 MemoryKBHandler 接口一致。ChromaDB 的元数据只能是标量值，无法记录共用分块的其他来源，
+        共用分块保留第一个写入它的文件的元数据
+
+        Returns:
+            元数据被更新的文档数量（总是 0）
+        """
+        return 0
+
+    def remove_references(self, doc_ids: List[str], **filters) -> int:
+        """
+        与 MemoryKBHandler 接口一致。ChromaDB 中没有记录其他来源，无需处理
+
+        Returns:
+            元数据被更新的文档数量（总是 0）
+        """
+        return 0
+
+    def get_existing_ids(self, ids: List[str]) -> List[str]:
+        """返回 ids 中已在集合中的文档 ID"""
+        return self.collection.get(ids=ids, include=[])["ids"]
+
     def retrieve(
         self,
         query: str,
         top_k: int = 5,
+        where: Optional[Dict] = None,
     ) -> Dict:
         """
         检索相关文档
@@ -112,6 +214,7 @@ class ChromaHandler:
         Args:
             query: 查询文本
             top_k: 返回最相关的 k 个文档
+            where: 元数据过滤条件（可选），如 {"filename": "manual.pdf"}
 
         Returns:
             包含检索结果的字典，包含：
@@ -133,6 +236,7 @@ class ChromaHandler:
             results = self.collection.query(
                 query_embeddings=[query_embedding.tolist()],
                 n_results=top_k,
+                where=_to_chroma_where(where),
                 include=["documents", "metadatas", "distances"],
             )
 
@@ -149,6 +253,61 @@ class ChromaHandler:
             logger.error(f"Error retrieving documents: {str(e)}")
             raise
 
+    def retrieve_many(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        where: Optional[Dict] = None,
+    ) -> List[Dict]:
+        """
+        批量检索相关文档
+
+        所有查询一次性向量化，并在一次 collection.query 调用中完成搜索
+
+        Args:
+            queries: 查询文本列表
+            top_k: 每个查询返回最相关的 k 个文档
+            where: 元数据过滤条件（可选），对所有查询生效
+
+        Returns:
+            检索结果字典列表，与 queries 一一对应，格式同 retrieve()
+        """
+        if not queries:
+            return []
+
+        if any(not query or not query.strip() for query in queries):
+            raise ValueError("Query cannot be empty")
+
+        try:
+            logger.debug(f"Retrieving top {top_k} documents for {len(queries)} queries")
+
+            # 一次性向量化所有查询
+            query_embeddings = self.embedding_handler.embed_queries(queries)
+
+            # 在 ChromaDB 中批量搜索
+            results = self.collection.query(
+                query_embeddings=query_embeddings.tolist(),
+                n_results=top_k,
+                where=_to_chroma_where(where),
+                include=["documents", "metadatas", "distances"],
+            )
+
+            logger.debug(f"Retrieved documents for {len(queries)} queries")
+
+            return [
+                {
+                    "ids": results["ids"][i],
+                    "documents": results["documents"][i],
+                    "metadatas": results["metadatas"][i],
+                    "distances": results["distances"][i],
+                }
+                for i in range(len(queries))
+            ]
+
+        except Exception as e:
+            logger.error(f"Error retrieving documents: {str(e)}")
+            raise
+
     def delete_document(self, doc_id: str) -> None:
         """
         删除指定的文档
@@ -164,6 +323,23 @@ class ChromaHandler:
             logger.error(f"Error deleting document: {str(e)}")
             raise
 
+    def delete_documents(self, doc_ids: List[str]) -> int:
+        """
+        批量删除文档（不存在的 ID 被忽略）
+
+        Returns:
+            删除的文档数量
+        """
+        try:
+            existing = self.get_existing_ids(list(dict.fromkeys(doc_ids)))
+            if existing:
+                self.collection.delete(ids=existing)
+            logger.info(f"Deleted {len(existing)} documents. Collection now contains {self.collection.count()} documents")
+            return len(existing)
+        except Exception as e:
+            logger.error(f"Error deleting documents: {str(e)}")
+            raise
+
     def clear_collection(self) -> None:
         """清空整个集合"""
         try:
@@ -0,0 +1,84 @@
+"""
+文本内容哈希工具
+用规范化文本的 blake2b 摘要作为分块的稳定 ID：同一段内容在任何进程、
+任何一次上传中都得到相同的 ID，重复上传时可以据此跳过已入库的分块
+"""
+import hashlib
+import unicodedata
+from typing import Collection, Dict, List, Tuple
+
+
+def normalize_text(text: str) -> str:
+    """NFKC 规范化并合并空白字符，使仅有空白 / 全半角差异的文本得到相同摘要"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def content_hash(text: str) -> str:
+    """规范化文本的 blake2b 摘要（128 位十六进制）"""
+    return hashlib.blake2b(normalize_text(text).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def content_id(document: str) -> str:
+    """为单个文档生成基于内容哈希的 ID"""
+    return f"doc_{content_hash(document)}"
+
+
+def content_ids(documents: List[str]) -> List[str]:
+    """为文档生成基于内容哈希的 ID"""
+    return [content_id(doc) for doc in documents]
+
+
+def partition_new(
+    documents: List[str],
+    metadata: List[Dict],
+    ids: List[str],
+    existing: Collection[str],
+) -> Tuple[List[str], List[Dict], List[str], List[Dict], List[str]]:
+    """
+    把一批文档分为需要写入的新文档，以及已入库或与同批次前面的文档重复的共用分块
+
+    共用分块不再向量化，其元数据交给知识库的 add_references 记为该分块的其他来源
+
+    Args:
+        documents: 文档内容列表
+        metadata: 元数据列表
+        ids: 文档 ID 列表
+        existing: 已在知识库中的 ID
+
+    Returns:
+        (新文档, 新文档的元数据, 新文档的 ID, 共用分块的元数据, 共用分块的 ID)
+    """
+    seen = set(existing)
+    kept_docs, kept_meta, kept_ids = [], [], []
+    shared_meta, shared_ids = [], []
+    for doc, meta, doc_id in zip(documents, metadata, ids):
+        if doc_id in seen:
+            shared_meta.append(meta)
+            shared_ids.append(doc_id)
+            continue
+        seen.add(doc_id)
+        kept_docs.append(doc)
+        kept_meta.append(meta)
+        kept_ids.append(doc_id)
+    return kept_docs, kept_meta, kept_ids, shared_meta, shared_ids
+
+
+def select_new(
+    documents: List[str],
+    metadata: List[Dict],
+    ids: List[str],
+    existing: Collection[str],
+) -> Tuple[List[str], List[Dict], List[str]]:
+    """
+    去掉已入库的文档以及同一批次内的重复文档（保留第一次出现）
+
+    Args:
+        documents: 文档内容列表
+        metadata: 元数据列表
+        ids: 文档 ID 列表
+        existing: 已在知识库中的 ID
+
+    Returns:
+        过滤后的 (文档, 元数据, ID)
+    """
+    return partition_new(documents, metadata, ids, existing)[:3]
@@ -2,8 +2,9 @@
 文档处理模块
 支持 PDF、Word、TXT 等多种格式
 """
+import bisect
 import os
-from typing import List, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from pathlib import Path
 from loguru import logger
 
@@ -19,6 +20,9 @@ except ImportError:
 
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
+# 流式分块时，缓冲区累积到 chunk_size 的多少倍再切分一次
+_STREAM_BUFFER_CHUNKS = 8
+
 
 class DocumentProcessor:
     """文档处理器"""
@@ -81,32 +85,65 @@ class DocumentProcessor:
             logger.error(f"Error loading file {file_path}: {str(e)}")
             raise
 
-    def _load_pdf(self, file_path: Path) -> Tuple[str, dict]:
-        """加载 PDF 文件"""
-        if PyPDF2 is None:
-            raise ImportError("PyPDF2 is not installed. Install it with: pip install PyPDF2")
+    def load_pages(self, file_path: str) -> Tuple[Iterator[Tuple[Optional[int], str]], dict]:
+        """
+        按页惰性加载文件
 
-        try:
-            text_content = []
-            with open(file_path, "rb") as f:
-                pdf_reader = PyPDF2.PdfReader(f)
-                num_pages = len(pdf_reader.pages)
+        PDF 在迭代时才逐页提取文本，其他格式整体作为一页（页码为 None）
 
-                for page_num, page in enumerate(pdf_reader.pages):
-                    text_content.append(page.extract_text())
+        Args:
+            file_path: 文件路径
 
-            text = "\n".join(text_content)
-            metadata = {
-                "source": str(file_path),
-                "format": "pdf",
-                "pages": num_pages,
-            }
-            return text, metadata
+        Returns:
+            ((页码, 页面文本) 迭代器, 元数据字典)，页码从 1 开始
+        """
+        file_path = Path(file_path)
+        if not file_path.exists():
+            raise FileNotFoundError(f"File not found: {file_path}")
+
+        if file_path.suffix.lower() == ".pdf":
+            logger.info(f"Loading file page by page: {file_path}")
+            return self._iter_pdf_pages(file_path)
+
+        text, metadata = self.load_file(str(file_path))
+        return iter([(None, text)]), metadata
 
+    def _iter_pdf_pages(self, file_path: Path) -> Tuple[Iterator[Tuple[int, str]], dict]:
+        """打开 PDF 并返回逐页提取文本的迭代器（文件在迭代结束时关闭）"""
+        if PyPDF2 is None:
+            raise ImportError("PyPDF2 is not installed. Install it with: pip install PyPDF2")
+
+        f = open(file_path, "rb")
+        try:
+            pdf_reader = PyPDF2.PdfReader(f)
+            num_pages = len(pdf_reader.pages)
         except Exception as e:
+            f.close()
             logger.error(f"Error reading PDF: {str(e)}")
             raise
 
+        def pages() -> Iterator[Tuple[int, str]]:
+            with f:
+                for page_num, page in enumerate(pdf_reader.pages, start=1):
+                    try:
+                        yield page_num, page.extract_text() or ""
+                    except Exception as e:
+                        logger.error(f"Error reading PDF page {page_num}: {str(e)}")
+                        raise
+
+        metadata = {
+            "source": str(file_path),
+            "format": "pdf",
+            "pages": num_pages,
+        }
+        return pages(), metadata
+
+    def _load_pdf(self, file_path: Path) -> Tuple[str, dict]:
+        """加载 PDF 文件"""
+        pages, metadata = self._iter_pdf_pages(file_path)
+        text = "\n".join(text for _, text in pages)
+        return text, metadata
+
     def _load_docx(self, file_path: Path) -> Tuple[str, dict]:
         """加载 Word 文件"""
         if Document is None:
@@ -180,6 +217,88 @@ class DocumentProcessor:
             logger.error(f"Error splitting text: {str(e)}")
             raise
 
+    def split_pages(
+        self,
+        pages: Iterable[Tuple[Optional[int], str]],
+        metadata: Optional[Dict] = None,
+    ) -> Iterator[Tuple[str, Dict]]:
+        """
+        流式分块：边读入页面边切分，分块可以跨越页面边界
+
+        缓冲区达到 chunk_size 的若干倍时切分一次，输出除最后一块外的所有分块，
+        最后一块的起点之后的文本留到下一轮，因此峰值内存与分块大小成正比，与文件页数无关
+
+        Args:
+            pages: (页码, 页面文本) 的可迭代对象，页码为 None 表示不分页
+            metadata: 文件元数据（可选），复制到每个分块的元数据中
+
+        Yields:
+            (分块文本, 分块元数据)；元数据包含 chunk_index，分页文件还包含
+            分块起止页码 page 和 page_end
+        """
+        metadata = metadata or {}
+        buffer = ""
+        page_starts: List[int] = []  # 各页在缓冲区中的起始位置
+        page_numbers: List[Optional[int]] = []
+        chunk_index = 0
+
+        def emit(final: bool) -> Iterator[Tuple[str, Dict]]:
+            nonlocal buffer, page_starts, page_numbers, chunk_index
+            chunks = self.splitter.split_text(buffer)
+            ready = chunks if final else chunks[:-1]
+
+            offset = 0
+            for chunk in ready:
+                start = buffer.find(chunk, offset)
+                if start < 0:
+                    start = offset
+                offset = start + 1
+
+                chunk_metadata = {**metadata, "chunk_index": chunk_index}
+                first_page = page_numbers[bisect.bisect_right(page_starts, start) - 1]
+                if first_page is not None:
+                    last = max(start, start + len(chunk) - 1)
+                    chunk_metadata["page"] = first_page
+                    chunk_metadata["page_end"] = page_numbers[bisect.bisect_right(page_starts, last) - 1]
+                chunk_index += 1
+                yield chunk, chunk_metadata
+
+            if not final and chunks:
+                # 保留最后一块的起点之后的文本，与后续页面一起重新切分
+                cut = buffer.find(chunks[-1], offset)
+                if cut < 0:
+                    cut = max(len(buffer) - len(chunks[-1]), 0)
+                first = bisect.bisect_right(page_starts, cut) - 1
+                page_starts = [0] + [start - cut for start in page_starts[first + 1 :]]
+                page_numbers = page_numbers[first:]
+                buffer = buffer[cut:]
+
+        for page_num, text in pages:
+            if buffer:
+                buffer += "\n"
+            page_starts.append(len(buffer))
+            page_numbers.append(page_num)
+            buffer += text
+
+            if len(buffer) >= self.chunk_size * _STREAM_BUFFER_CHUNKS:
+                yield from emit(final=False)
+
+        if buffer.strip():
+            yield from emit(final=True)
+
+    def process_file_stream(self, file_path: str) -> Iterator[Tuple[str, Dict]]:
+        """
+        流式处理文件：逐页加载 -> 跨页分块，首个分块在整个文件解析完之前即可产出
+
+        Args:
+            file_path: 文件路径
+
+        Yields:
+            (分块文本, 分块元数据)
+        """
+        pages, metadata = self.load_pages(file_path)
+        yield from self.split_pages(pages, metadata)
+
     def process_file(self, file_path: str) -> Tuple[List[str], dict]:
         """
         处理文件：加载 -> 分割
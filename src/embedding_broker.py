@@ -0,0 +1,114 @@
+"""
+查询向量微批处理
+把并发到达的单条查询在几毫秒的窗口内攒成一批，用一次 encode_queries 完成前向计算，
+再通过 Future 把各自的结果交还给调用方，避免 CPU 上大量 batch=1 的小前向
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List
+
+import numpy as np
+from loguru import logger
+
+
+class EmbeddingBroker:
+    """查询向量微批处理器"""
+
+    def __init__(
+        self,
+        encode_fn: Callable[[List[str]], np.ndarray],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 2.0,
+    ):
+        """
+        启动后台批处理线程
+
+        Args:
+            encode_fn: 批量编码函数，如 FlagModel.encode_queries
+            max_batch_size: 单批最多包含的查询数
+            max_wait_ms: 收到第一条查询后最多等待多少毫秒再发车
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue" = queue.Queue()
+        self._closed = False
+
+        self.batches = 0
+        self.queries = 0
+
+        self._thread = threading.Thread(target=self._run, name="embedding-broker", daemon=True)
+        self._thread.start()
+
+    def submit(self, query: str) -> Future:
+        """
+        提交一条查询
+
+        Returns:
+            完成后结果为形状 (embedding_dim,) 向量的 Future
+        """
+        if self._closed:
+            raise RuntimeError("EmbeddingBroker is closed")
+        future: Future = Future()
+        self._queue.put((query, future))
+        return future
+
+    def embed_query(self, query: str) -> np.ndarray:
+        """提交查询并阻塞等待其向量"""
+        return self.submit(query).result()
+
+    def _collect(self) -> list:
+        """阻塞等待第一条请求，然后在等待窗口内尽量攒满一批"""
+        batch = [self._queue.get()]
+        if batch[0] is None:
+            return []
+
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # 关闭信号：处理完已收集的请求后退出
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            if not batch:
+                return
+
+            # 调用方可能已经取消
+            batch = [(query, future) for query, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            try:
+                embeddings = self.encode_fn([query for query, _ in batch])
+            except Exception as e:
+                logger.error(f"Error embedding query batch: {str(e)}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.queries += len(batch)
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+    def close(self) -> None:
+        """处理完已提交的请求后停止后台线程"""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
@@ -0,0 +1,143 @@
+"""
+文档向量磁盘缓存
+以 (模型名, 内容哈希) 为键，把 float32 向量保存在 SQLite 文件中，
+重启或重新导入相同文件时直接复用已计算的向量，只把未命中的文本交给模型。
+条目数和字节数在写入的同一事务中累加到统计表，查询统计时无需扫描缓存
+"""
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Union
+
+import numpy as np
+from loguru import logger
+
+# 单条 SQL 中 IN (...) 的最大参数个数（SQLite 默认上限为 999）
+_LOOKUP_BATCH = 500
+
+
+class EmbeddingCache:
+    """基于 SQLite 的文档向量缓存"""
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        打开（或创建）缓存文件
+
+        Args:
+            path: SQLite 文件路径
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (model, hash)
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache_stats (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                entries INTEGER NOT NULL,
+                bytes INTEGER NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+        if self._conn.execute("SELECT 1 FROM cache_stats WHERE id = 0").fetchone() is None:
+            # 新建或旧版本的缓存文件：只在这里统计一次已有条目
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO cache_stats (id, entries, bytes) "
+                    "SELECT 0, COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+                )
+
+        self.hits = 0
+        self.misses = 0
+
+        logger.info(f"Embedding cache opened at {self.path}")
+
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, np.ndarray]:
+        """
+        批量查找向量
+
+        Args:
+            model: 模型名
+            hashes: 内容哈希列表
+
+        Returns:
+            命中的 内容哈希 -> float32 向量
+        """
+        unique = list(dict.fromkeys(hashes))
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for start in range(0, len(unique), _LOOKUP_BATCH):
+                batch = unique[start : start + _LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                    [model, *batch],
+                )
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+
+            hit_count = sum(1 for key in hashes if key in found)
+            self.hits += hit_count
+            self.misses += len(hashes) - hit_count
+        return found
+
+    def put_many(self, model: str, hashes: List[str], vectors: np.ndarray) -> None:
+        """
+        批量写入向量（已存在的键保持不变）
+
+        Args:
+            model: 模型名
+            hashes: 内容哈希列表
+            vectors: 与 hashes 对齐的向量，形状为 (n, embedding_dim)
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            with self._conn:
+                inserted = self._conn.executemany(
+                    "INSERT OR IGNORE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                    [(model, key, vector.tobytes()) for key, vector in zip(hashes, vectors)],
+                ).rowcount
+                if inserted > 0:
+                    self._conn.execute(
+                        "UPDATE cache_stats SET entries = entries + ?, bytes = bytes + ? WHERE id = 0",
+                        (inserted, inserted * vectors[0].nbytes),
+                    )
+
+    def stats(self) -> Dict:
+        """
+        缓存统计
+
+        Returns:
+            包含 hits、misses、hit_rate（本进程内）以及 entries、bytes_stored（缓存文件内）的字典
+        """
+        with self._lock:
+            entries, bytes_stored = self._conn.execute(
+                "SELECT entries, bytes FROM cache_stats WHERE id = 0"
+            ).fetchone()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+            "bytes_stored": bytes_stored,
+        }
+
+    def close(self) -> None:
+        """关闭缓存文件"""
+        with self._lock:
+            self._conn.close()
@@ -1,37 +1,102 @@
 """
 BGE 向量化处理模块
-使用 BGE-Small-zh-v1.5 模型进行文本向量化
+使用 BGE-Small-zh-v1.5 模型进行文本向量化，支持 PyTorch（FlagModel）和 ONNX Runtime 两种后端
 """
+import itertools
 import numpy as np
-from typing import List, Union
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
 from FlagEmbedding import FlagModel
 from loguru import logger
 
+from src.content_hash import content_hash
+from src.embedding_broker import EmbeddingBroker
+from src.embedding_cache import EmbeddingCache
+from src.length_batching import bucketed_encode
+from src.onnx_encoder import ONNXEncoder
+from src.query_cache import QueryEmbeddingCache
+
+# BGE 检索查询的前缀指令
+QUERY_INSTRUCTION = "为这个句子生成表示以用于检索相关文章："
+
 
 class BGEEmbeddingHandler:
     """BGE 向量化处理器"""
 
-    def __init__(self, model_name: str = "BAAI/bge-small-zh-v1.5"):
+    def __init__(
+        self,
+        model_name: str = "BAAI/bge-small-zh-v1.5",
+        cache: Optional[EmbeddingCache] = None,
+        query_cache: Optional[QueryEmbeddingCache] = None,
+        query_batch_size: int = 1,
+        query_batch_wait_ms: float = 2.0,
+        batch_size: int = 64,
+        backend: str = "torch",
+        onnx_dir: Optional[Union[str, Path]] = None,
+        onnx_quantize: bool = False,
+        onnx_threads: int = 0,
+    ):
         """
         初始化 BGE 模型
 
         Args:
             model_name: 模型名称，默认为 BGE-Small-zh-v1.5
+            cache: 文档向量磁盘缓存（可选），命中的文本不再经过模型
+            query_cache: 查询向量 LRU 缓存（可选），可在多个会话间共享
+            query_batch_size: 大于 1 时启用查询微批处理，并发的 embed_query 调用
+                合并为一次 encode_queries，单批最多包含该数量的查询
+            query_batch_wait_ms: 微批处理的最长等待时间（毫秒）
+            batch_size: 文档向量化的批大小，文本按 token 长度分桶后逐批编码
+            backend: 推理后端，torch（FlagModel）或 onnx（ONNX Runtime，适合无 GPU 的 CPU 部署）
+            onnx_dir: ONNX 模型的导出目录，backend 为 onnx 时必填，首次使用时自动导出
+            onnx_quantize: 是否使用动态 int8 量化的 ONNX 模型
+            onnx_threads: ONNX Runtime 的算子内线程数，0 表示自动
         """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        if backend not in ("torch", "onnx"):
+            raise ValueError(f"Unsupported embedding backend: {backend}")
+        if backend == "onnx" and onnx_dir is None:
+            raise ValueError("onnx_dir is required for the onnx backend")
+
         self.model_name = model_name
-        logger.info(f"Loading BGE model: {model_name}")
+        self.batch_size = batch_size
+        self.backend = backend
+        # int8 量化后的向量与原模型略有差异，磁盘缓存中单独存放
+        self.cache_key = f"{model_name}@int8" if backend == "onnx" and onnx_quantize else model_name
+        self.cache = cache
+        self.query_cache = query_cache
+        logger.info(f"Loading BGE model: {model_name} (backend: {backend})")
 
-        try:
-            self.model = FlagModel(
+        if backend == "onnx":
+            self.model = ONNXEncoder(
                 model_name,
-                query_instruction_for_retrieval="为这个句子生成表示以用于检索相关文章：",
-                use_fp16=True,  # 使用 FP16 加速（如果 GPU 支持）
+                onnx_dir,
+                quantize=onnx_quantize,
+                intra_op_threads=onnx_threads,
+                query_instruction_for_retrieval=QUERY_INSTRUCTION,
+            )
+            logger.info(f"BGE model loaded with ONNX Runtime: {model_name}")
+        else:
+            try:
+                self.model = FlagModel(
+                    model_name,
+                    query_instruction_for_retrieval=QUERY_INSTRUCTION,
+                    use_fp16=True,  # 使用 FP16 加速（如果 GPU 支持）
+                )
+                logger.info(f"BGE model loaded successfully: {model_name}")
+            except Exception as e:
+                logger.warning(f"Failed to load with FP16, trying without FP16: {str(e)}")
+                self.model = FlagModel(model_name)
+                logger.info(f"BGE model loaded (without FP16): {model_name}")
+
+        self._broker: Optional[EmbeddingBroker] = None
+        if query_batch_size > 1:
+            self._broker = EmbeddingBroker(
+                self.model.encode_queries,
+                max_batch_size=query_batch_size,
+                max_wait_ms=query_batch_wait_ms,
             )
-            logger.info(f"BGE model loaded successfully: {model_name}")
-        except Exception as e:
-            logger.warning(f"Failed to load with FP16, trying without FP16: {str(e)}")
-            self.model = FlagModel(model_name)
-            logger.info(f"BGE model loaded (without FP16): {model_name}")
 
     def embed_texts(self, texts: List[str]) -> np.ndarray:
         """
@@ -49,13 +114,76 @@ class BGEEmbeddingHandler:
 
         try:
             logger.debug(f"Embedding {len(texts)} texts")
-            embeddings = self.model.encode(texts)
+            if self.cache is not None:
+                embeddings = self._embed_texts_cached(texts)
+            else:
+                embeddings = self._encode_texts(texts)
             logger.debug(f"Embedding completed, shape: {embeddings.shape}")
             return embeddings
         except Exception as e:
             logger.error(f"Error embedding texts: {str(e)}")
             raise
 
+    def embed_stream(
+        self, texts: Iterable[str], batch_size: int = 256
+    ) -> Iterator[Tuple[List[str], np.ndarray]]:
+        """
+        流式批量向量化文本
+
+        按需从 texts 中读取，每次只向量化一批，适合无法一次性放入内存的语料
+
+        Args:
+            texts: 文本的可迭代对象（可以是生成器）
+            batch_size: 每批文本数
+
+        Yields:
+            (该批文本, 形状为 (len(该批文本), embedding_dim) 的向量数组)
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+
+        iterator = iter(texts)
+        while True:
+            batch = list(itertools.islice(iterator, batch_size))
+            if not batch:
+                return
+            yield batch, self.embed_texts(batch)
+
+    def _encode_texts(self, texts: List[str]) -> np.ndarray:
+        """按 token 长度排序分桶后逐批编码，使每批内长度相近、padding 最少，结果按原顺序返回"""
+        try:
+            lengths = [len(ids) for ids in self.model.tokenizer(texts, add_special_tokens=False)["input_ids"]]
+        except Exception:
+            # 分词器不可用时退回按字符数排序
+            lengths = None
+        return bucketed_encode(
+            texts,
+            lambda batch: self.model.encode(batch, batch_size=self.batch_size),
+            self.batch_size,
+            lengths,
+        )
+
+    def _embed_texts_cached(self, texts: List[str]) -> np.ndarray:
+        """先查磁盘缓存，只把未命中（且去重后）的文本交给模型，结果写回缓存"""
+        hashes = [content_hash(text) for text in texts]
+        found = self.cache.get_many(self.cache_key, hashes)
+
+        missing = {}  # 内容哈希 -> 文本
+        for key, text in zip(hashes, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+
+        if missing:
+            encoded = np.asarray(self._encode_texts(list(missing.values())), dtype=np.float32)
+            self.cache.put_many(self.cache_key, list(missing), encoded)
+            found.update(zip(missing, encoded))
+
+        logger.info(
+            f"Embedding cache: {len(texts) - len(missing)}/{len(texts)} texts served from cache, "
+            f"{len(missing)} encoded"
+        )
+        return np.stack([found[key] for key in hashes])
+
     def embed_query(self, query: str) -> np.ndarray:
         """
         向量化查询文本
@@ -72,15 +200,66 @@ class BGEEmbeddingHandler:
             logger.warning("Empty query provided")
             return np.array([])
 
+        if self.query_cache is not None:
+            cached = self.query_cache.get(query)
+            if cached is not None:
+                logger.debug(f"Query embedding cache hit: {query[:50]}...")
+                return cached
+
         try:
             logger.debug(f"Embedding query: {query[:50]}...")
-            embeddings = self.model.encode_queries([query])
-            logger.debug(f"Query embedding completed, shape: {embeddings.shape}")
-            return embeddings[0] if len(embeddings) > 0 else np.array([])
+            if self._broker is not None:
+                # 与其他线程同时到达的查询合并为一批前向计算
+                embedding = self._broker.embed_query(query)
+            else:
+                embeddings = self.model.encode_queries([query])
+                if len(embeddings) == 0:
+                    return np.array([])
+                embedding = embeddings[0]
+            logger.debug(f"Query embedding completed, shape: {embedding.shape}")
+            if self.query_cache is not None:
+                self.query_cache.put(query, embedding)
+            return embedding
         except Exception as e:
             logger.error(f"Error embedding query: {str(e)}")
             raise
 
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """
+        批量向量化查询文本
+
+        与 embed_query 使用相同的检索指令，但所有查询在一次 encode_queries 调用中完成
+
+        Args:
+            queries: 查询文本列表
+
+        Returns:
+            向量数组，形状为 (n_queries, embedding_dim)
+        """
+        if not queries:
+            logger.warning("Empty query list provided")
+            return np.array([])
+
+        try:
+            logger.debug(f"Embedding {len(queries)} queries")
+            if self.query_cache is None:
+                embeddings = self.model.encode_queries(queries)
+            else:
+                # 只把缓存未命中的查询交给模型
+                cached = [self.query_cache.get(query) for query in queries]
+                missing = [i for i, vector in enumerate(cached) if vector is None]
+                if missing:
+                    encoded = self.model.encode_queries([queries[i] for i in missing])
+                    for i, vector in zip(missing, encoded):
+                        self.query_cache.put(queries[i], vector)
+                        cached[i] = vector
+                embeddings = np.stack(cached)
+            logger.debug(f"Query embedding completed, shape: {embeddings.shape}")
+            return embeddings
+        except Exception as e:
+            logger.error(f"Error embedding queries: {str(e)}")
+            raise
+
     def embed_single_text(self, text: str) -> np.ndarray:
         """
         向量化单个文本
@@ -0,0 +1,180 @@
+"""
+多进程批量向量化
+大批量导入时把文本块按批分发给若干工作进程（每个进程只加载一次模型），
+在途批次数有上限，结果按提交顺序流式写回知识库，
+协调进程中同一时刻只保留少量批次的文本和向量
+"""
+import itertools
+import multiprocessing as mp
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+# 工作进程中的向量化处理器（由 _init_worker 创建）
+_worker_handler = None
+
+
+def _init_worker(handler_kwargs: Dict, cache_path: Optional[str], threads: int) -> None:
+    """工作进程初始化：限制线程数后加载一次模型"""
+    global _worker_handler
+
+    # 多个进程各自占满所有核心会互相争抢，必须在导入 torch 之前设置
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[name] = str(threads)
+
+    from src.embedding_cache import EmbeddingCache
+    from src.embedding_handler import BGEEmbeddingHandler
+
+    handler_kwargs = dict(handler_kwargs)
+    if handler_kwargs.get("backend") == "onnx" and not handler_kwargs.get("onnx_threads"):
+        handler_kwargs["onnx_threads"] = threads
+    cache = EmbeddingCache(cache_path) if cache_path else None
+    _worker_handler = BGEEmbeddingHandler(cache=cache, **handler_kwargs)
+
+
+def _embed_batch(texts: List[str]) -> np.ndarray:
+    """在工作进程中向量化一批文本"""
+    return np.asarray(_worker_handler.embed_texts(texts), dtype=np.float32)
+
+
+class EmbeddingPool:
+    """多进程向量化工作池"""
+
+    def __init__(
+        self,
+        handler_kwargs: Optional[Dict] = None,
+        n_workers: int = 2,
+        max_in_flight: int = 0,
+        batch_size: int = 256,
+        cache_path: Optional[str] = None,
+        threads_per_worker: int = 0,
+    ):
+        """
+        启动工作进程（模型在各进程中异步加载）
+
+        工作池可以长期保留并在多次导入之间复用（map / embed_stream 可被多个线程同时调用），
+        模型只在启动时加载一次
+
+        Args:
+            handler_kwargs: 传给工作进程中 BGEEmbeddingHandler 的参数（需可 pickle），
+                如 model_name、batch_size、backend
+            n_workers: 工作进程数量
+            max_in_flight: 同时提交给工作池的最大批次数，0 表示 2 × n_workers
+            batch_size: 每次分发给工作进程的文本块数
+            cache_path: 文档向量磁盘缓存路径（可选），各工作进程共享同一个 SQLite 文件
+            threads_per_worker: 每个工作进程的推理线程数，0 表示按 CPU 核数平分给各进程；
+                同时有其他进程（如解析进程）占用 CPU 时应显式传入
+        """
+        if n_workers < 1:
+            raise ValueError("n_workers must be at least 1")
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+
+        self.n_workers = n_workers
+        self.max_in_flight = max_in_flight or 2 * n_workers
+        self.batch_size = batch_size
+
+        threads = threads_per_worker or max(1, (os.cpu_count() or 1) // n_workers)
+        # 使用 spawn 启动，避免 fork 继承协调进程中的模型和线程状态
+        self._executor = ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=mp.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(handler_kwargs or {}, str(cache_path) if cache_path else None, threads),
+        )
+        logger.info(
+            f"Embedding pool started with {n_workers} workers "
+            f"({threads} threads each, max {self.max_in_flight} batches in flight)"
+        )
+
+    def map(self, batches: Iterable[List[str]]) -> Iterator[Tuple[List[str], np.ndarray]]:
+        """
+        并行向量化若干批文本，按提交顺序逐批返回
+
+        批次按需从 batches 中读取，在途批次数不超过 max_in_flight
+
+        Args:
+            batches: 文本批次的可迭代对象
+
+        Yields:
+            (该批文本, 对应的向量数组)
+        """
+        pending = deque()
+        try:
+            for batch in batches:
+                if len(pending) >= self.max_in_flight:
+                    texts, future = pending.popleft()
+                    yield texts, future.result()
+                pending.append((batch, self._executor.submit(_embed_batch, batch)))
+            while pending:
+                texts, future = pending.popleft()
+                yield texts, future.result()
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+    def embed_stream(
+        self, texts: Iterable[str], batch_size: Optional[int] = None
+    ) -> Iterator[Tuple[List[str], np.ndarray]]:
+        """
+        流式并行向量化文本，接口与 BGEEmbeddingHandler.embed_stream 一致
+
+        Args:
+            texts: 文本的可迭代对象（可以是生成器）
+            batch_size: 每批文本数，默认使用工作池的 batch_size
+
+        Yields:
+            (该批文本, 对应的向量数组)，按输入顺序
+        """
+        batch_size = batch_size or self.batch_size
+        iterator = iter(texts)
+        batches = iter(lambda: list(itertools.islice(iterator, batch_size)), [])
+        return self.map(batches)
+
+    def add_documents(
+        self,
+        kb_handler,
+        documents: Iterable[str],
+        metadata: Optional[Iterable[Dict]] = None,
+        progress_callback: Optional[Callable[[int], None]] = None,
+    ) -> int:
+        """
+        用工作池向量化文档并按顺序流式写入知识库
+
+        等价于 kb_handler.add_documents_stream(..., embedder=self)：知识库中已有或已在途的
+        内容直接跳过，每批向量返回后立即写入
+
+        Args:
+            kb_handler: MemoryKBHandler、ShardedKBHandler 或 ChromaHandler
+            documents: 文档内容的可迭代对象（可以是生成器）
+            metadata: 与 documents 对齐的元数据可迭代对象（可选）
+            progress_callback: 每写入一批后以已处理的文档数调用（可选）
+
+        Returns:
+            实际写入的文档数
+        """
+        try:
+            return kb_handler.add_documents_stream(
+                documents,
+                metadata,
+                batch_size=self.batch_size,
+                embedder=self,
+                progress_callback=progress_callback,
+            )
+        except Exception as e:
+            logger.error(f"Error in bulk embedding: {str(e)}")
+            raise
+
+    def close(self) -> None:
+        """等待在途任务完成后关闭工作进程"""
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self) -> "EmbeddingPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
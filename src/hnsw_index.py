@@ -0,0 +1,385 @@
+"""
+HNSW 近似最近邻索引
+纯 Python / NumPy 实现的分层可导航小世界图（Hierarchical Navigable Small World），
+为 MemoryKBHandler 提供不依赖 ChromaDB 的图索引检索
+
+- 支持逐条增量插入，节点编号即知识库的行号
+- 检索时可穿过墓碑节点，但墓碑节点不会出现在结果中
+- M 控制每个节点的邻居数量，ef_search 控制检索时的候选集大小
+
+索引只保存图结构，向量本身仍由知识库的矩阵持有。
+插入由 Python 循环完成，建图速度远低于 C++ 实现（hnswlib）：384 维、默认参数下
+每个节点约 4-5 ms，且随图规模增长，适合增量写入的场景。
+检索只访问传入矩阵范围内的节点，知识库可以在检索进行时插入尚未发布的新行
+"""
+import heapq
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+# 一次插入的节点数达到该值时记录建图耗时
+_LOG_INSERT_MIN = 1000
+
+
+class HNSWIndex:
+    """HNSW 图索引"""
+
+    def __init__(
+        self,
+        M: int = 16,
+        ef_construction: int = 200,
+        ef_search: int = 64,
+        seed: int = 0,
+    ):
+        """
+        初始化 HNSW 索引
+
+        Args:
+            M: 每层每个节点的最大邻居数（第 0 层为 2 * M）
+            ef_construction: 插入时的候选集大小，越大图质量越好、建图越慢
+            ef_search: 检索时的候选集大小，越大召回率越高、速度越慢
+            seed: 随机种子（决定节点层数）
+        """
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.seed = seed
+        self._level_mult = 1 / math.log(M)
+        self.reset()
+
+    @property
+    def is_trained(self) -> bool:
+        """索引是否可用于检索（至少包含一个节点）"""
+        return self._entry_point >= 0
+
+    def reset(self) -> None:
+        """清空图"""
+        self._rng = np.random.default_rng(self.seed)
+        # _links[node][level] 为该节点在该层的邻居列表
+        self._links: List[List[List[int]]] = []
+        self._entry_point = -1
+        self._max_level = -1
+        # 历次入口节点 (节点, 层数)，检索时取其中最后一个可见的节点
+        self._entry_history: List[Tuple[int, int]] = []
+
+    def _max_links(self, level: int) -> int:
+        return 2 * self.M if level == 0 else self.M
+
+    def _search_layer(
+        self,
+        query: np.ndarray,
+        entry_points: List[int],
+        ef: int,
+        level: int,
+        matrix: np.ndarray,
+        deleted: Optional[np.ndarray] = None,
+    ) -> List[Tuple[float, int]]:
+        """
+        在单层上做贪心的最佳优先搜索
+
+        Returns:
+            (相似度, 节点) 列表，最多 ef 个，未排序
+        """
+        n_rows = len(matrix)
+        visited = set(entry_points)
+        entry_scores = matrix[entry_points] @ query
+
+        candidates = []  # 按相似度从高到低弹出：存 (-sim, node)
+        results = []  # 堆顶为当前结果中相似度最低者：存 (sim, node)
+        for node, score in zip(entry_points, entry_scores.tolist()):
+            heapq.heappush(candidates, (-score, node))
+            if deleted is None or not deleted[node]:
+                heapq.heappush(results, (score, node))
+
+        while candidates:
+            neg_score, node = heapq.heappop(candidates)
+            if len(results) >= ef and -neg_score < results[0][0]:
+                break
+
+            neighbors = [n for n in self._links[node][level] if n < n_rows and n not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+
+            for neighbor, score in zip(neighbors, (matrix[neighbors] @ query).tolist()):
+                if len(results) < ef or score > results[0][0]:
+                    heapq.heappush(candidates, (-score, neighbor))
+                    if deleted is None or not deleted[neighbor]:
+                        heapq.heappush(results, (score, neighbor))
+                        if len(results) > ef:
+                            heapq.heappop(results)
+
+        return results
+
+    def _select_neighbors(
+        self,
+        candidates: List[Tuple[float, int]],
+        max_links: int,
+        matrix: np.ndarray,
+    ) -> List[int]:
+        """
+        启发式邻居选择：只保留比已选邻居更接近目标的候选，使图在不同方向上保持连通
+
+        Args:
+            candidates: (与目标的相似度, 节点) 列表
+            max_links: 最多选择的邻居数
+        """
+        candidates = sorted(candidates, reverse=True)
+        if len(candidates) <= max_links:
+            return [node for _, node in candidates]
+
+        nodes = [node for _, node in candidates]
+        vectors = matrix[nodes]
+        selected: List[int] = []
+        for i, (score, node) in enumerate(candidates):
+            if selected:
+                # 若候选与某个已选邻居的相似度高于它与目标的相似度，则跳过
+                if np.max(vectors[selected] @ vectors[i]) > score:
+                    continue
+            selected.append(i)
+            if len(selected) >= max_links:
+                break
+
+        return [nodes[i] for i in selected]
+
+    def _insert(self, node: int, matrix: np.ndarray) -> None:
+        """插入一个节点"""
+        level = int(-math.log(1.0 - self._rng.random()) * self._level_mult)
+        self._links.append([[] for _ in range(level + 1)])
+
+        if self._entry_point < 0:
+            self._set_entry_point(node, level)
+            return
+
+        query = matrix[node]
+        entry_points = [self._entry_point]
+
+        # 在高于新节点层数的层上贪心下降
+        for lc in range(self._max_level, level, -1):
+            best = max(self._search_layer(query, entry_points, 1, lc, matrix))
+            entry_points = [best[1]]
+
+        for lc in range(min(level, self._max_level), -1, -1):
+            found = self._search_layer(query, entry_points, self.ef_construction, lc, matrix)
+            neighbors = self._select_neighbors(found, self.M, matrix)
+            self._links[node][lc] = neighbors
+
+            # 建立反向连接，超出上限时重新挑选邻居
+            max_links = self._max_links(lc)
+            for neighbor in neighbors:
+                links = self._links[neighbor][lc]
+                links.append(node)
+                if len(links) > max_links:
+                    scores = (matrix[links] @ matrix[neighbor]).tolist()
+                    self._links[neighbor][lc] = self._select_neighbors(
+                        list(zip(scores, links)), max_links, matrix
+                    )
+
+            entry_points = [n for _, n in found]
+
+        if level > self._max_level:
+            self._set_entry_point(node, level)
+
+    def _set_entry_point(self, node: int, level: int) -> None:
+        self._entry_point = node
+        self._max_level = level
+        self._entry_history.append((node, level))
+
+    def add(self, rows: np.ndarray, matrix: np.ndarray) -> None:
+        """
+        按行号顺序插入新增的行
+
+        Args:
+            rows: 新增行的行号（必须紧接在已有节点之后）
+            matrix: 知识库的完整向量矩阵（已归一化）
+        """
+        rows = np.asarray(rows)
+        if len(rows) == 0:
+            return
+        if rows[0] != len(self._links):
+            raise ValueError(f"HNSW rows must be appended in order: expected {len(self._links)}, got {rows[0]}")
+
+        if len(rows) < _LOG_INSERT_MIN:
+            for row in rows.tolist():
+                self._insert(row, matrix)
+            return
+
+        logger.info(f"Inserting {len(rows)} nodes into HNSW graph ({len(self._links)} existing)")
+        start = time.perf_counter()
+        for row in rows.tolist():
+            self._insert(row, matrix)
+        elapsed = time.perf_counter() - start
+        logger.info(
+            f"HNSW inserted {len(rows)} nodes in {elapsed:.1f}s "
+            f"({elapsed * 1000 / len(rows):.1f} ms/node, {len(self._links)} nodes total)"
+        )
+
+    def search(
+        self,
+        query: np.ndarray,
+        matrix: np.ndarray,
+        k: int,
+        deleted: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        近似检索
+
+        Args:
+            query: 已归一化的查询向量
+            matrix: 知识库的完整向量矩阵（已归一化）
+            k: 返回的结果数量
+            deleted: 墓碑掩码（可选），为 True 的行可以被穿过但不会被返回
+
+        Returns:
+            (行号数组, 相似度数组)，按相似度降序
+        """
+        # 取传入矩阵范围内最新的入口节点，入口节点与其层数总是成对读取
+        entry_point, max_level = next(
+            (entry for entry in reversed(self._entry_history) if entry[0] < len(matrix)), (-1, -1)
+        )
+        if entry_point < 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        entry_points = [entry_point]
+        for lc in range(max_level, 0, -1):
+            best = max(self._search_layer(query, entry_points, 1, lc, matrix))
+            entry_points = [best[1]]
+
+        found = self._search_layer(query, entry_points, max(self.ef_search, k), 0, matrix, deleted)
+        found = sorted(found, reverse=True)[:k]
+        return (
+            np.array([node for _, node in found], dtype=np.int64),
+            np.array([score for score, _ in found], dtype=np.float32),
+        )
+
+    def _compacted_graph(self, live_rows: np.ndarray, matrix: np.ndarray):
+        """
+        去掉不在 live_rows 中的节点，并按 live_rows 的顺序重新编号
+
+        失去邻居的节点会从被删邻居的邻居中补选，保持图的连通性
+
+        Args:
+            live_rows: 保留的旧行号（升序）
+            matrix: 旧行号空间下的向量矩阵
+
+        Returns:
+            (新的邻接表, 入口节点, 最高层)
+        """
+        live = np.zeros(len(self._links), dtype=bool)
+        live[live_rows] = True
+        new_id = np.full(len(self._links), -1, dtype=np.int64)
+        new_id[live_rows] = np.arange(len(live_rows))
+
+        links: List[List[List[int]]] = []
+        for node in live_rows.tolist():
+            node_links = []
+            for lc, neighbors in enumerate(self._links[node]):
+                kept = [n for n in neighbors if live[n]]
+                if len(kept) < len(neighbors):
+                    # 从被删邻居的同层邻居中补充候选
+                    candidates = set(kept)
+                    for n in neighbors:
+                        if not live[n] and lc < len(self._links[n]):
+                            candidates.update(m for m in self._links[n][lc] if live[m] and m != node)
+                    candidates = list(candidates)
+                    if candidates:
+                        scores = (matrix[candidates] @ matrix[node]).tolist()
+                        kept = self._select_neighbors(
+                            list(zip(scores, candidates)), self._max_links(lc), matrix
+                        )
+                node_links.append([int(new_id[n]) for n in kept])
+            links.append(node_links)
+
+        if not links:
+            return links, -1, -1
+
+        # 入口节点取层数最高的存活节点
+        levels = [len(node_links) - 1 for node_links in links]
+        entry_point = int(np.argmax(levels))
+        return links, entry_point, levels[entry_point]
+
+    def remap(self, live_rows: np.ndarray, matrix: np.ndarray) -> None:
+        """
+        知识库回收墓碑行后重排行号：新行号 i 对应旧行号 live_rows[i]
+
+        Args:
+            live_rows: 保留下来的旧行号（升序）
+            matrix: 回收后的向量矩阵（新行号空间）
+        """
+        if not self.is_trained:
+            return
+
+        # 补选邻居需要旧行号空间下的向量，这里按旧行号构造一个稀疏视图
+        old_space = _RowMap(matrix, live_rows, len(self._links))
+        self._links, self._entry_point, self._max_level = self._compacted_graph(live_rows, old_space)
+        self._entry_history = [(self._entry_point, self._max_level)] if self._entry_point >= 0 else []
+        logger.debug(f"HNSW graph remapped to {len(self._links)} nodes")
+
+    def state(self, live_rows: np.ndarray, matrix: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        导出与快照对齐的图结构（快照只包含 live_rows 中的行，并按顺序重新编号）
+
+        Args:
+            live_rows: 写入快照的行号
+            matrix: 当前行号空间下的向量矩阵
+        """
+        if not self.is_trained:
+            return {}
+
+        if len(live_rows) == len(self._links):
+            links, entry_point, max_level = self._links, self._entry_point, self._max_level
+        else:
+            links, entry_point, max_level = self._compacted_graph(live_rows, matrix)
+
+        flat_lists = [neighbors for node_links in links for neighbors in node_links]
+        offsets = np.zeros(len(flat_lists) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(neighbors) for neighbors in flat_lists])
+        flat = [n for neighbors in flat_lists for n in neighbors]
+
+        return {
+            "hnsw_levels": np.array([len(node_links) for node_links in links], dtype=np.int8),
+            "hnsw_offsets": offsets,
+            "hnsw_links": np.array(flat, dtype=np.int32),
+            "hnsw_meta": np.array([entry_point, max_level], dtype=np.int64),
+        }
+
+    def load_state(self, state: Dict[str, np.ndarray]) -> bool:
+        """
+        从快照恢复图结构
+
+        Returns:
+            快照中是否包含 HNSW 状态
+        """
+        if "hnsw_levels" not in state:
+            return False
+
+        flat = np.asarray(state["hnsw_links"]).tolist()
+        offsets = np.asarray(state["hnsw_offsets"]).tolist()
+        lists = [flat[offsets[i] : offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+        self._links = []
+        position = 0
+        for n_levels in np.asarray(state["hnsw_levels"]).tolist():
+            self._links.append(lists[position : position + n_levels])
+            position += n_levels
+
+        self._entry_point, self._max_level = (int(v) for v in state["hnsw_meta"])
+        self._entry_history = [(self._entry_point, self._max_level)] if self._entry_point >= 0 else []
+        # 让之后插入的节点层数与恢复前的随机序列无关
+        self._rng = np.random.default_rng([self.seed, len(self._links)])
+        return True
+
+
+class _RowMap:
+    """把新行号空间的矩阵以旧行号访问（仅支持按存活旧行号的列表取行）"""
+
+    def __init__(self, matrix: np.ndarray, live_rows: np.ndarray, n_old: int):
+        self._matrix = matrix
+        self._new_id = np.full(n_old, -1, dtype=np.int64)
+        self._new_id[live_rows] = np.arange(len(live_rows))
+
+    def __getitem__(self, old_rows):
+        return self._matrix[self._new_id[old_rows]]
@@ -0,0 +1,161 @@
+"""
+增量入库清单
+按来源（如上传的文件名）记录文件内容哈希及其分块的内容哈希 ID，
+再次上传时据此跳过未变化的文件，并找出新增 / 消失的分块，使更新代价与改动量成正比
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Collection, List, Optional, Union
+
+from loguru import logger
+
+# 单条 SQL 中 IN (...) 的最大参数个数（SQLite 默认上限为 999）
+_LOOKUP_BATCH = 500
+# 计算文件哈希时每次读取的字节数
+_READ_SIZE = 1 << 20
+
+
+def file_hash(path: Union[str, Path]) -> str:
+    """文件内容的 blake2b 摘要（128 位十六进制），按块读取，不把整个文件读入内存"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_READ_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestManifest:
+    """基于 SQLite 的入库清单"""
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        打开（或创建）清单文件
+
+        Args:
+            path: SQLite 文件路径
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sources (
+                source TEXT PRIMARY KEY,
+                file_hash TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS source_chunks (
+                source TEXT NOT NULL,
+                chunk_id TEXT NOT NULL,
+                PRIMARY KEY (source, chunk_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS source_chunks_by_chunk ON source_chunks (chunk_id);
+            """
+        )
+        self._conn.commit()
+
+        logger.info(f"Ingest manifest opened at {self.path}")
+
+    def get_file_hash(self, source: str) -> Optional[str]:
+        """返回来源上次入库时的文件哈希，未记录时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_hash FROM sources WHERE source = ?", (source,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_chunk_ids(self, source: str) -> List[str]:
+        """返回来源上次入库时的全部分块 ID"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunk_id FROM source_chunks WHERE source = ?", (source,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def orphaned(self, source: str, chunk_ids: Collection[str]) -> List[str]:
+        """
+        返回 chunk_ids 中没有被其他来源引用的 ID
+
+        相同内容的分块在所有文件中共用一个 ID，只有不再被任何来源引用时才能从知识库删除
+        """
+        chunk_ids = list(chunk_ids)
+        shared = set()
+        with self._lock:
+            for start in range(0, len(chunk_ids), _LOOKUP_BATCH):
+                batch = chunk_ids[start : start + _LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT DISTINCT chunk_id FROM source_chunks "
+                    f"WHERE source != ? AND chunk_id IN ({placeholders})",
+                    [source, *batch],
+                )
+                shared.update(row[0] for row in rows)
+        return [chunk_id for chunk_id in chunk_ids if chunk_id not in shared]
+
+    def update(
+        self,
+        source: str,
+        file_hash: str,
+        added: Collection[str],
+        removed: Collection[str],
+    ) -> None:
+        """
+        记录来源的新文件哈希，并只写入分块 ID 的增量
+
+        Args:
+            source: 来源名
+            file_hash: 新的文件哈希
+            added: 新增的分块 ID
+            removed: 消失的分块 ID
+        """
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sources (source, file_hash, updated_at) VALUES (?, ?, ?)",
+                    (source, file_hash, time.time()),
+                )
+                self._conn.executemany(
+                    "DELETE FROM source_chunks WHERE source = ? AND chunk_id = ?",
+                    [(source, chunk_id) for chunk_id in removed],
+                )
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO source_chunks (source, chunk_id) VALUES (?, ?)",
+                    [(source, chunk_id) for chunk_id in added],
+                )
+
+    def add_chunks(self, source: str, chunk_ids: Collection[str]) -> None:
+        """
+        记录来源引用的分块，不更新文件哈希
+
+        用于处理失败的文件：已写入知识库的分块仍归属该来源，按引用计数参与之后的删除；
+        文件哈希不变，下次上传时会重新解析该文件
+
+        Args:
+            source: 来源名
+            chunk_ids: 分块 ID
+        """
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO source_chunks (source, chunk_id) VALUES (?, ?)",
+                    [(source, chunk_id) for chunk_id in chunk_ids],
+                )
+
+    def clear(self) -> None:
+        """清空清单（知识库被清空时调用）"""
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM source_chunks")
+                self._conn.execute("DELETE FROM sources")
+
+    def close(self) -> None:
+        """关闭清单文件"""
+        with self._lock:
+            self._conn.close()
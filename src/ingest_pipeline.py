@@ -0,0 +1,351 @@
+"""
+多文件流水线入库
+文件在进程池中并行解析和分块，每个文件完成后其分块立即交给向量化和写入，
+解析与向量化同时进行；单个文件时在当前进程内逐页流式解析，
+首批分块在文件解析完之前就开始向量化。并统计各阶段的吞吐
+
+提供入库清单时按文件增量更新：文件哈希未变且分块仍在知识库中的文件直接跳过，
+变化的文件只向量化新增分块，并删除不再被任何文件引用的旧分块。
+清单以 "分组/文件名" 为来源名，同一分组内的同名文件视为同一文件的新版本并替换旧版本
+"""
+import multiprocessing as mp
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+from src.content_hash import content_id
+from src.document_processor import DocumentProcessor
+from src.ingest_manifest import IngestManifest, file_hash
+from src.metadata_index import SOURCE_FIELDS
+
+# 工作进程中的文档处理器（由 _init_worker 创建）
+_worker_processor: Optional[DocumentProcessor] = None
+
+
+def _init_worker(chunk_size: int, chunk_overlap: int) -> None:
+    """工作进程初始化：创建一次文档处理器"""
+    global _worker_processor
+    _worker_processor = DocumentProcessor(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+class _Timed:
+    """包装迭代器，累计花在取下一个元素上的时间、元素个数，以及 (页码, 页面文本) 元素的文本字符数"""
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self.seconds = 0.0
+        self.count = 0
+        self.chars = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            item = next(self._iterator)
+        finally:
+            self.seconds += time.perf_counter() - start
+        self.count += 1
+        self.chars += len(item[1]) if isinstance(item[1], str) else 0
+        return item
+
+
+def source_name(path: str, extra_metadata: Dict) -> str:
+    """
+    文件在入库清单中的来源名：有 collection 时为 "collection/filename"，否则为 filename（没有时为文件路径）
+    """
+    name = extra_metadata.get("filename", path)
+    collection = extra_metadata.get("collection")
+    return f"{collection}/{name}" if collection else name
+
+
+def _new_file_stats() -> Dict:
+    return {"chunks": 0, "chars": 0, "parse_seconds": 0.0, "split_seconds": 0.0}
+
+
+def _iter_file(
+    processor: DocumentProcessor, path: str, extra_metadata: Dict, file_stats: Dict
+) -> Iterator[Tuple[str, Dict]]:
+    """
+    逐页解析并流式分块单个文件，结束（或出错）时把解析 / 分块耗时、字符数和分块数累加到 file_stats
+
+    Yields:
+        (分块文本, 分块元数据)
+    """
+    start = time.perf_counter()
+    pages, metadata = processor.load_pages(path)
+    metadata.update(extra_metadata)
+    opened = time.perf_counter() - start
+
+    pages = _Timed(pages)
+    chunks = _Timed(processor.split_pages(pages, metadata))
+    try:
+        yield from chunks
+    finally:
+        file_stats["chunks"] += chunks.count
+        file_stats["chars"] += pages.chars
+        file_stats["parse_seconds"] += opened + pages.seconds
+        file_stats["split_seconds"] += chunks.seconds - pages.seconds
+
+
+def _process_file_in_worker(path: str, extra_metadata: Dict) -> Dict:
+    """在工作进程中处理整个文件，返回分块、元数据和该文件的统计"""
+    file_stats = _new_file_stats()
+    items = list(_iter_file(_worker_processor, path, extra_metadata, file_stats))
+    return {
+        "chunks": [chunk for chunk, _ in items],
+        "metadata": [metadata for _, metadata in items],
+        "stats": file_stats,
+    }
+
+
+class IngestionPipeline:
+    """多文件流水线入库：进程池解析 / 分块 -> 向量化 -> 写入知识库"""
+
+    def __init__(
+        self,
+        chunk_size: int = 800,
+        chunk_overlap: int = 100,
+        n_workers: int = 4,
+        batch_size: int = 256,
+    ):
+        """
+        Args:
+            chunk_size: 分块大小（字符数）
+            chunk_overlap: 分块重叠（字符数）
+            n_workers: 解析进程数量，1 表示在当前进程内逐个解析
+            batch_size: 每批向量化 / 写入的分块数
+        """
+        if n_workers < 1:
+            raise ValueError("n_workers must be at least 1")
+
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.n_workers = n_workers
+        self.batch_size = batch_size
+
+    def run(
+        self,
+        kb_handler,
+        files: List[Tuple[str, Dict]],
+        embedder=None,
+        progress_callback: Optional[Callable[[int, int, int], None]] = None,
+        manifest: Optional[IngestManifest] = None,
+    ) -> Dict:
+        """
+        解析文件并流式写入知识库
+
+        单个文件解析失败时记录错误并继续处理其余文件。提供清单时，处理失败的文件（或写入中途出错时的
+        全部文件）已写入知识库的分块仍记入清单，但不更新文件哈希，下次上传时重新解析
+
+        Args:
+            kb_handler: 提供 add_documents_stream 的知识库处理器
+            files: (文件路径, 附加元数据) 列表，附加元数据合并到该文件每个分块的元数据中；
+                由附加元数据中的 collection 和 filename 组成该文件在入库清单中的来源名（见 source_name），
+                来源名相同的文件会替换之前入库的版本，不同上传者应使用不同的 collection
+            embedder: 提供 embed_stream 的向量化器（可选），默认使用知识库的 embedding_handler
+            progress_callback: 每解析完一个文件后以 (已解析文件数, 需解析的文件数, 已产生分块数) 调用（可选）
+            manifest: 入库清单（可选），提供时按文件增量更新，知识库需提供 delete_documents 和 remove_references
+
+        Returns:
+            统计字典：files、skipped（未变化而跳过的来源名列表）、failed（(文件路径, 错误信息) 列表）、
+            chunks、added、deleted（删除的旧分块数）、chars，
+            各阶段累计耗时 parse_seconds / split_seconds / embed_seconds（向量化 + 写入）、
+            wall_seconds，以及各阶段吞吐 parse_chars_per_s / split_chunks_per_s / embed_chunks_per_s
+        """
+        stats = {
+            "files": len(files),
+            "skipped": [],
+            "failed": [],
+            "chunks": 0,
+            "added": 0,
+            "deleted": 0,
+            "chars": 0,
+            "parse_seconds": 0.0,
+            "split_seconds": 0.0,
+            "embed_seconds": 0.0,
+            "wall_seconds": 0.0,
+        }
+        waited = 0.0  # 写入端等待解析结果的时间
+        start = time.perf_counter()
+
+        # 对照清单找出需要重新解析的文件
+        sources = {path: source_name(path, extra) for path, extra in files}
+        hashes: Dict[str, str] = {}
+        if manifest is not None:
+            changed = []
+            for path, extra in files:
+                hashes[path] = file_hash(path)
+                if manifest.get_file_hash(sources[path]) == hashes[path]:
+                    previous = manifest.get_chunk_ids(sources[path])
+                    # 分块可能已被清空或删除，确认都还在知识库中才跳过
+                    if len(kb_handler.get_existing_ids(previous)) == len(previous):
+                        stats["skipped"].append(sources[path])
+                        continue
+                changed.append((path, extra))
+            if stats["skipped"]:
+                logger.info(f"Skipping {len(stats['skipped'])} unchanged files: {stats['skipped']}")
+            files = changed
+        file_chunk_ids: Dict[str, set] = {path: set() for path, _ in files}
+
+        def add_file_stats(file_stats: Dict) -> None:
+            for key, value in file_stats.items():
+                stats[key] += value
+
+        def report(parsed: int) -> None:
+            if progress_callback is not None:
+                progress_callback(parsed, len(files), stats["chunks"])
+
+        def fail(path: str, error: str) -> None:
+            logger.error(f"Error processing {path}: {error}")
+            stats["failed"].append((path, error))
+
+        def inline_chunks() -> Iterator[Tuple[str, Dict]]:
+            # 逐个文件在当前进程内流式解析：首批分块在文件解析完之前就开始向量化
+            nonlocal waited
+            processor = DocumentProcessor(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
+            for parsed, (path, extra) in enumerate(files, start=1):
+                file_stats = _new_file_stats()
+                try:
+                    for chunk, metadata in _iter_file(processor, path, extra, file_stats):
+                        yield path, chunk, metadata
+                except Exception as e:
+                    fail(path, str(e))
+                waited += file_stats["parse_seconds"] + file_stats["split_seconds"]
+                add_file_stats(file_stats)
+                report(parsed)
+
+        def pooled_chunks() -> Iterator[Tuple[str, Dict]]:
+            nonlocal waited
+            # 使用 spawn 启动，避免 fork 继承主进程中的模型和线程状态
+            with ProcessPoolExecutor(
+                max_workers=min(self.n_workers, len(files)),
+                mp_context=mp.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.chunk_size, self.chunk_overlap),
+            ) as executor:
+                futures = {
+                    executor.submit(_process_file_in_worker, path, extra): path for path, extra in files
+                }
+                completed = as_completed(futures)
+                for parsed in range(1, len(files) + 1):
+                    began = time.perf_counter()
+                    future = next(completed)
+                    waited += time.perf_counter() - began
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        fail(futures[future], str(e))
+                        report(parsed)
+                        continue
+
+                    add_file_stats(result["stats"])
+                    report(parsed)
+                    for chunk, metadata in zip(result["chunks"], result["metadata"]):
+                        yield futures[future], chunk, metadata
+
+        pending_metadata = deque()
+
+        def documents() -> Iterator[str]:
+            if not files:
+                return
+            chunks = inline_chunks() if self.n_workers == 1 or len(files) == 1 else pooled_chunks()
+            for path, chunk, metadata in chunks:
+                if manifest is not None:
+                    file_chunk_ids[path].add(content_id(chunk))
+                pending_metadata.append(metadata)
+                yield chunk
+
+        def metadata() -> Iterator[Dict]:
+            # 与 documents() 一一对应：zip 每取出一个分块，紧接着取出它的元数据
+            while True:
+                yield pending_metadata.popleft()
+
+        try:
+            stats["added"] = kb_handler.add_documents_stream(
+                documents(),
+                metadata(),
+                batch_size=self.batch_size,
+                embedder=embedder,
+            )
+        except Exception:
+            # 写入中途出错：已写入的分块仍记入清单，避免成为无人引用的孤立分块
+            if manifest is not None:
+                for path, _ in files:
+                    self._record_partial(kb_handler, manifest, sources[path], file_chunk_ids[path])
+            raise
+
+        if manifest is not None:
+            failed = {path for path, _ in stats["failed"]}
+            for path, extra in files:
+                if path in failed:
+                    self._record_partial(kb_handler, manifest, sources[path], file_chunk_ids[path])
+                else:
+                    stats["deleted"] += self._apply_manifest(
+                        kb_handler,
+                        manifest,
+                        sources[path],
+                        hashes[path],
+                        file_chunk_ids[path],
+                        {field: extra[field] for field in SOURCE_FIELDS if field in extra},
+                    )
+
+        stats["wall_seconds"] = time.perf_counter() - start
+        stats["embed_seconds"] = max(stats["wall_seconds"] - waited, 0.0)
+        stats["parse_chars_per_s"] = stats["chars"] / stats["parse_seconds"] if stats["parse_seconds"] else 0.0
+        stats["split_chunks_per_s"] = stats["chunks"] / stats["split_seconds"] if stats["split_seconds"] else 0.0
+        stats["embed_chunks_per_s"] = stats["chunks"] / stats["embed_seconds"] if stats["embed_seconds"] else 0.0
+
+        logger.info(
+            f"Ingested {len(files) - len(stats['failed'])}/{len(files)} files in {stats['wall_seconds']:.1f}s: "
+            f"parse {stats['parse_chars_per_s']:.0f} chars/s per worker, "
+            f"split {stats['split_chunks_per_s']:.0f} chunks/s, "
+            f"embed + write {stats['embed_chunks_per_s']:.1f} chunks/s, "
+            f"{stats['added']}/{stats['chunks']} chunks added, {stats['deleted']} stale chunks deleted, "
+            f"{len(stats['skipped'])} unchanged files skipped"
+        )
+        return stats
+
+    @staticmethod
+    def _record_partial(kb_handler, manifest: IngestManifest, source: str, chunk_ids: set) -> None:
+        """
+        处理失败的文件：把已在知识库中的分块记入清单，但不更新文件哈希（下次上传时重新解析）
+        """
+        present = kb_handler.get_existing_ids(list(chunk_ids)) if chunk_ids else []
+        if present:
+            manifest.add_chunks(source, present)
+            logger.warning(f"{source}: ingestion incomplete, {len(present)} chunks already written kept in manifest")
+
+    @staticmethod
+    def _apply_manifest(
+        kb_handler,
+        manifest: IngestManifest,
+        source: str,
+        new_hash: str,
+        chunk_ids: set,
+        source_filter: Dict,
+    ) -> int:
+        """
+        新分块写入后，删除该文件中消失且不再被其他文件引用的旧分块，并更新清单；
+        消失但仍被其他文件引用的分块只去掉该文件的引用（source_filter 为空时无法识别引用，跳过）
+
+        Returns:
+            从知识库删除的分块数
+        """
+        previous = set(manifest.get_chunk_ids(source))
+        removed = previous - chunk_ids
+        stale = manifest.orphaned(source, removed)
+        deleted = kb_handler.delete_documents(stale) if stale else 0
+        still_shared = removed.difference(stale)
+        if still_shared and source_filter:
+            kb_handler.remove_references(list(still_shared), **source_filter)
+        manifest.update(source, new_hash, chunk_ids - previous, removed)
+        if removed or chunk_ids - previous:
+            logger.info(
+                f"{source}: {len(chunk_ids - previous)} new chunks, {len(removed)} removed, {deleted} deleted from KB"
+            )
+        return deleted
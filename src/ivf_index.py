@@ -0,0 +1,217 @@
+"""
+IVF 近似最近邻索引
+纯 NumPy 实现的倒排文件索引（Inverted File），用于加速 MemoryKBHandler 的大规模检索
+
+- 用球面 k-means 把向量划分到 nlist 个粗聚类单元
+- 查询时只对最接近的 nprobe 个单元内的向量精确打分
+- 训练完成后新增向量直接分配到最近的单元，无需重建
+
+索引只保存结构（聚类中心和每个单元的行号），向量本身仍由知识库的矩阵持有。
+检索只返回传入矩阵范围内的行，知识库可以在检索进行时为尚未发布的新行更新索引
+"""
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from src.vector_utils import normalize_rows, top_k_indices
+
+# 分批计算向量与聚类中心相似度时每批的行数，控制临时矩阵大小
+_ASSIGN_BATCH = 65536
+
+
+class IVFIndex:
+    """IVF 倒排索引"""
+
+    def __init__(
+        self,
+        nlist: int = 1024,
+        nprobe: int = 16,
+        n_iter: int = 20,
+        min_train_points: Optional[int] = None,
+        max_train_points: Optional[int] = None,
+        seed: int = 0,
+    ):
+        """
+        初始化 IVF 索引
+
+        Args:
+            nlist: 聚类单元数量
+            nprobe: 每次查询探测的单元数量，越大召回率越高、速度越慢
+            n_iter: k-means 迭代次数
+            min_train_points: 向量数达到该值才训练，之前由知识库暴力检索（默认 39 * nlist）
+            max_train_points: k-means 训练采样的最大向量数（默认 256 * nlist）
+            seed: 随机种子
+        """
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        self.min_train_points = min_train_points or 39 * nlist
+        self.max_train_points = max_train_points or 256 * nlist
+        self.seed = seed
+        self.reset()
+
+    @property
+    def is_trained(self) -> bool:
+        """索引是否已训练并可用于检索"""
+        return self.centroids is not None
+
+    def reset(self) -> None:
+        """清空索引（包括聚类中心）"""
+        self.centroids: Optional[np.ndarray] = None
+        self._cells: List[np.ndarray] = []
+        self._assign = np.empty(0, dtype=np.int32)  # 行号 -> 单元号，-1 表示未分配
+
+    def _nearest_cells(self, vectors: np.ndarray) -> np.ndarray:
+        """返回每个向量最近的聚类单元"""
+        assign = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), _ASSIGN_BATCH):
+            batch = vectors[start : start + _ASSIGN_BATCH]
+            assign[start : start + len(batch)] = np.argmax(batch @ self.centroids.T, axis=1)
+        return assign
+
+    def train(self, vectors: np.ndarray) -> None:
+        """
+        用球面 k-means 训练聚类中心
+
+        Args:
+            vectors: 已归一化的训练向量
+        """
+        rng = np.random.default_rng(self.seed)
+        if len(vectors) > self.max_train_points:
+            sample = np.sort(rng.choice(len(vectors), self.max_train_points, replace=False))
+            vectors = vectors[sample]
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+
+        nlist = min(self.nlist, len(vectors))
+        logger.info(f"Training IVF index: {len(vectors)} points, nlist={nlist}")
+
+        self.centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+        for _ in range(self.n_iter):
+            assign = self._nearest_cells(vectors)
+
+            # 按单元分组求和，得到新的聚类中心
+            order = np.argsort(assign, kind="stable")
+            counts = np.bincount(assign, minlength=nlist)
+            nonempty = np.flatnonzero(counts)
+            boundaries = np.concatenate(([0], np.cumsum(counts[nonempty])[:-1]))
+            sums = np.add.reduceat(vectors[order], boundaries, axis=0)
+
+            centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+            centroids[nonempty] = sums
+            self.centroids = normalize_rows(centroids)
+
+        self._cells = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+
+    def add(self, rows: np.ndarray, matrix: np.ndarray) -> None:
+        """
+        把新增的行加入索引
+
+        尚未训练时，若向量数已达到 min_train_points，则先用全部已有向量训练再加入
+
+        Args:
+            rows: 新增行的行号
+            matrix: 知识库的完整向量矩阵（已归一化）
+        """
+        if not self.is_trained:
+            if len(matrix) < self.min_train_points:
+                return
+            self.train(matrix)
+            rows = np.arange(len(matrix))
+
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return
+
+        if len(self._assign) < len(matrix):
+            grown = np.full(max(len(matrix), 2 * len(self._assign)), -1, dtype=np.int32)
+            grown[: len(self._assign)] = self._assign
+            self._assign = grown
+
+        assign = self._nearest_cells(matrix[rows])
+        self._assign[rows] = assign
+        self._append_to_cells(rows, assign)
+
+    def _append_to_cells(self, rows: np.ndarray, assign: np.ndarray) -> None:
+        """把按单元分组后的行号追加到各单元"""
+        order = np.argsort(assign, kind="stable")
+        cells, starts = np.unique(assign[order], return_index=True)
+        for cell, group in zip(cells, np.split(rows[order], starts[1:])):
+            self._cells[cell] = np.concatenate((self._cells[cell], group))
+
+    def search(
+        self,
+        query: np.ndarray,
+        matrix: np.ndarray,
+        k: int,
+        deleted: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        近似检索
+
+        Args:
+            query: 已归一化的查询向量
+            matrix: 知识库的完整向量矩阵（已归一化）
+            k: 返回的结果数量
+            deleted: 墓碑掩码（可选），为 True 的行会被跳过
+
+        Returns:
+            (行号数组, 相似度数组)，按相似度降序
+        """
+        nprobe = min(self.nprobe, len(self.centroids))
+        probe = top_k_indices(self.centroids @ query, nprobe)
+        candidates = np.concatenate([self._cells[cell] for cell in probe])
+        # 忽略正在写入、尚未对检索可见的行
+        candidates = candidates[candidates < len(matrix)]
+
+        if deleted is not None and len(candidates):
+            candidates = candidates[~deleted[candidates]]
+
+        scores = matrix[candidates] @ query
+        top = top_k_indices(scores, k)
+        return candidates[top], scores[top]
+
+    def remap(self, live_rows: np.ndarray, matrix: np.ndarray) -> None:
+        """
+        知识库回收墓碑行后重排行号：新行号 i 对应旧行号 live_rows[i]
+
+        Args:
+            live_rows: 保留下来的旧行号（升序）
+            matrix: 回收后的向量矩阵（IVF 只需重排单元，不使用向量）
+        """
+        if not self.is_trained:
+            return
+        self._rebuild_cells(self._assign[live_rows])
+
+    def _rebuild_cells(self, assign: np.ndarray) -> None:
+        """根据行号 -> 单元号的映射重建全部单元"""
+        self._assign = np.asarray(assign, dtype=np.int32).copy()
+        self._cells = [np.empty(0, dtype=np.int64) for _ in range(len(self.centroids))]
+        assigned = np.flatnonzero(self._assign >= 0)
+        if len(assigned):
+            self._append_to_cells(assigned, self._assign[assigned])
+
+    def state(self, live_rows: np.ndarray, matrix: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        导出与快照对齐的索引状态（快照只包含 live_rows 中的行，并按顺序重新编号）
+
+        Args:
+            live_rows: 写入快照的行号
+            matrix: 当前行号空间下的向量矩阵（IVF 不使用）
+        """
+        if not self.is_trained:
+            return {}
+        return {"ivf_centroids": self.centroids, "ivf_assign": self._assign[live_rows]}
+
+    def load_state(self, state: Dict[str, np.ndarray]) -> bool:
+        """
+        从快照恢复索引状态
+
+        Returns:
+            快照中是否包含 IVF 状态
+        """
+        if "ivf_centroids" not in state:
+            return False
+        self.centroids = np.asarray(state["ivf_centroids"], dtype=np.float32)
+        self._rebuild_cells(state["ivf_assign"])
+        return True
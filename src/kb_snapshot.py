@@ -0,0 +1,411 @@
+"""
+知识库快照持久化模块
+将 MemoryKBHandler 的向量和文档保存到磁盘目录，并支持内存映射方式加载
+
+快照目录结构：
+    manifest.json         版本、文档数、向量维度
+    vectors.npy           float32 向量矩阵（标准 .npy 格式，可直接 np.memmap）
+    ids.bin               文档 ID（UTF-8，逐条首尾相接）
+    ids.offsets.npy       每条 ID 在 ids.bin 中的起止字节偏移（int64，长度为文档数 + 1）
+    documents.bin         文档内容（UTF-8），偏移在 documents.offsets.npy 中
+    metadata.bin          每条元数据的 JSON（UTF-8），偏移在 metadata.offsets.npy 中
+    extra_*.npy           可选的附加数组（如检索索引的结构），名称记录在 manifest 中
+
+加载时只读取 ID，文档和元数据以内存映射的 LazyColumn 返回，按行号访问时才解码，
+加载耗时和常驻内存与文档长度无关。只接受当前版本（SNAPSHOT_VERSION）的快照
+
+启用 WAL 的持久化目录下，每次整理生成一个按 WAL seq 编号的快照子目录
+（snapshot-000000000042/），加载时使用编号最大的完整快照
+"""
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from loguru import logger
+
+SNAPSHOT_VERSION = 2
+
+MANIFEST_FILE = "manifest.json"
+VECTORS_FILE = "vectors.npy"
+# 文本列：<name>.bin 为 UTF-8 数据，<name>.offsets.npy 为每行的起止偏移
+IDS_COLUMN = "ids"
+DOCUMENTS_COLUMN = "documents"
+METADATA_COLUMN = "metadata"
+
+# 写文本列时每累积多少字节写一次文件
+_WRITE_BUFFER_BYTES = 1 << 22
+
+# 持久化目录中按 WAL seq 编号的快照子目录前缀
+GENERATION_PREFIX = "snapshot-"
+
+
+def fsync_directory(path: Union[str, Path]) -> None:
+    """
+    把目录项（新建、重命名的文件）落盘
+
+    Windows 无法以文件描述符打开目录，此时跳过（NTFS 的元数据由日志保证）
+    """
+    if os.name == "nt":
+        return
+    fd = os.open(str(path), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _sync(f) -> None:
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def _write_json(path: Path, data) -> None:
+    """写入临时文件并落盘后原子替换，避免中途失败或断电留下损坏的文件"""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        _sync(f)
+    os.replace(tmp_path, path)
+
+
+def _write_npy(path: Path, array: np.ndarray) -> None:
+    """以标准 .npy 格式写入临时文件并落盘后原子替换"""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.lib.format.write_array(f, array, allow_pickle=False)
+        _sync(f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: Path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _decode_text(data: bytes) -> str:
+    return data.decode("utf-8")
+
+
+def _encode_text(text: str) -> bytes:
+    return text.encode("utf-8")
+
+
+def _encode_json(value) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class LazyColumn:
+    """
+    快照中按偏移索引的文本列，按行号访问时才从内存映射的数据中解码
+
+    支持 len、下标访问和迭代；追加的新行保存在内存列表中（append / extend），
+    因此可以直接替代 MemoryKBHandler 中的 documents / metadata 列表
+    """
+
+    def __init__(
+        self,
+        blob: np.ndarray,
+        offsets: np.ndarray,
+        decode: Callable[[bytes], object],
+        rows: Optional[np.ndarray] = None,
+    ):
+        """
+        Args:
+            blob: uint8 数据（通常为内存映射）
+            offsets: 每行的起止偏移，长度为行数 + 1
+            decode: 把一行的字节解码为 Python 对象
+            rows: 行号 -> blob 中原始行号的映射（可选，由 take 生成）
+        """
+        self._blob = blob
+        self._offsets = offsets
+        self._decode = decode
+        self._rows = rows
+        self._n_mapped = len(rows) if rows is not None else len(offsets) - 1
+        self._tail: List = []
+
+    def __len__(self) -> int:
+        return self._n_mapped + len(self._tail)
+
+    def _raw(self, i: int) -> bytes:
+        source = int(self._rows[i]) if self._rows is not None else i
+        return self._blob[int(self._offsets[source]) : int(self._offsets[source + 1])].tobytes()
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("LazyColumn index out of range")
+        if i >= self._n_mapped:
+            return self._tail[i - self._n_mapped]
+        return self._decode(self._raw(i))
+
+    def __iter__(self) -> Iterator:
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, value) -> None:
+        self._tail.append(value)
+
+    def extend(self, values: Iterable) -> None:
+        self._tail.extend(values)
+
+    def take(self, rows: np.ndarray) -> "LazyColumn":
+        """
+        按行号取出子列（rows 须升序），映射部分仍引用同一份数据，不解码
+
+        Args:
+            rows: 保留的行号（升序）
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        split = int(np.searchsorted(rows, self._n_mapped))
+        mapped = rows[:split]
+        if self._rows is not None:
+            mapped = self._rows[mapped]
+        column = LazyColumn(self._blob, self._offsets, self._decode, mapped)
+        column._tail = [self._tail[i - self._n_mapped] for i in rows[split:].tolist()]
+        return column
+
+    def iter_encoded(self, encode: Callable[[object], bytes]) -> Iterator[bytes]:
+        """逐行返回编码后的字节，映射部分直接复制原始字节，不经过解码"""
+        for i in range(self._n_mapped):
+            yield self._raw(i)
+        for value in self._tail:
+            yield encode(value)
+
+
+def _write_column(
+    path: Path,
+    name: str,
+    values: Sequence,
+    encode: Callable[[object], bytes],
+) -> None:
+    """把一列文本写为 <name>.bin + <name>.offsets.npy"""
+    if isinstance(values, LazyColumn):
+        encoded = values.iter_encoded(encode)
+    else:
+        encoded = (encode(value) for value in values)
+
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    tmp_path = path / f"{name}.bin.tmp"
+    with open(tmp_path, "wb") as f:
+        buffer, buffered, position = [], 0, 0
+        for i, data in enumerate(encoded, 1):
+            position += len(data)
+            offsets[i] = position
+            buffer.append(data)
+            buffered += len(data)
+            if buffered >= _WRITE_BUFFER_BYTES:
+                f.write(b"".join(buffer))
+                buffer, buffered = [], 0
+        f.write(b"".join(buffer))
+        _sync(f)
+    os.replace(tmp_path, path / f"{name}.bin")
+    _write_npy(path / f"{name}.offsets.npy", offsets)
+
+
+def _open_column(path: Path, name: str, mmap: bool) -> Tuple[np.ndarray, np.ndarray]:
+    """打开一列文本，返回 (uint8 数据, 偏移)"""
+    offsets = np.load(path / f"{name}.offsets.npy", mmap_mode="r" if mmap else None, allow_pickle=False)
+    blob_path = path / f"{name}.bin"
+    # 空文件无法内存映射
+    if mmap and blob_path.stat().st_size > 0:
+        blob = np.memmap(blob_path, dtype=np.uint8, mode="r")
+    else:
+        blob = np.fromfile(blob_path, dtype=np.uint8)
+    return blob, offsets
+
+
+def encode_strings(values: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    把一组字符串编码为首尾相接的 UTF-8 数据和偏移，布局与快照中的文本列相同，
+    可作为附加数组写入快照（避免定长 Unicode 数组按最长字符串为每个元素分配空间）
+
+    Returns:
+        (uint8 数据, int64 偏移，长度为字符串数 + 1)
+    """
+    encoded = [value.encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def decode_strings(blob: np.ndarray, offsets: np.ndarray) -> List[str]:
+    """一次性解码整列文本（encode_strings 的逆操作）"""
+    data = np.asarray(blob).tobytes()
+    bounds = np.asarray(offsets).tolist()
+    return [data[start:end].decode("utf-8") for start, end in zip(bounds, bounds[1:])]
+
+
+def snapshot_exists(path: Union[str, Path]) -> bool:
+    """判断目录下是否存在完整的快照"""
+    return (Path(path) / MANIFEST_FILE).exists()
+
+
+def read_manifest(path: Union[str, Path]) -> Dict:
+    """读取快照的 manifest.json"""
+    return _read_json(Path(path) / MANIFEST_FILE)
+
+
+def generation_path(root: Union[str, Path], wal_seq: int) -> Path:
+    """返回持久化目录下对应 WAL seq 的快照子目录"""
+    return Path(root) / f"{GENERATION_PREFIX}{wal_seq:012d}"
+
+
+def latest_generation(root: Union[str, Path]) -> Optional[Path]:
+    """
+    返回持久化目录下最新的完整快照子目录
+
+    快照子目录按 WAL seq 命名，未写完 manifest 的目录会被忽略
+    """
+    root = Path(root)
+    if not root.exists():
+        return None
+
+    generations = sorted(
+        p for p in root.iterdir()
+        if p.is_dir() and p.name.startswith(GENERATION_PREFIX) and snapshot_exists(p)
+    )
+    return generations[-1] if generations else None
+
+
+def prune_generations(root: Union[str, Path], keep: Path) -> None:
+    """
+    删除 keep 之外的快照子目录
+
+    旧快照可能仍被内存映射（Windows 下无法删除），删除失败会在下次整理时重试
+    """
+    for p in Path(root).iterdir():
+        if p.is_dir() and p.name.startswith(GENERATION_PREFIX) and p != keep:
+            shutil.rmtree(p, ignore_errors=True)
+
+
+def write_snapshot(
+    path: Union[str, Path],
+    vectors: np.ndarray,
+    ids: Sequence[str],
+    documents: Sequence[str],
+    metadata: Sequence[Dict],
+    wal_seq: int = 0,
+    extras: Optional[Dict[str, np.ndarray]] = None,
+) -> None:
+    """
+    写入知识库快照
+
+    manifest.json 最后写入，因此只有全部文件写完后快照才会被视为有效。
+    每个文件在重命名前 fsync，写完 manifest 后再 fsync 快照目录及其父目录，
+    函数返回时快照已完整落盘，调用方可以安全地丢弃被它包含的 WAL 记录
+
+    Args:
+        path: 快照目录
+        vectors: 向量矩阵，形状为 (n_docs, embedding_dim)
+        ids: 文档 ID 列表
+        documents: 文档内容序列（列表或 LazyColumn）
+        metadata: 元数据序列（列表或 LazyColumn）
+        wal_seq: 快照已包含的最后一条 WAL 记录的 seq
+        extras: 附加数组（可选），按名称保存为 extra_<name>.npy
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if not (len(vectors) == len(ids) == len(documents) == len(metadata)):
+        raise ValueError("vectors, ids, documents and metadata must have the same length")
+
+    manifest_path = path / MANIFEST_FILE
+    if manifest_path.exists():
+        # 先让旧快照失效，防止新旧文件混合
+        manifest_path.unlink()
+
+    _write_npy(path / VECTORS_FILE, vectors)
+    extras = extras or {}
+    for name, array in extras.items():
+        _write_npy(path / f"extra_{name}.npy", np.asarray(array))
+
+    _write_column(path, IDS_COLUMN, ids, _encode_text)
+    _write_column(path, DOCUMENTS_COLUMN, documents, _encode_text)
+    _write_column(path, METADATA_COLUMN, metadata, _encode_json)
+
+    dim = int(vectors.shape[1]) if vectors.ndim == 2 else 0
+    _write_json(
+        manifest_path,
+        {
+            "version": SNAPSHOT_VERSION,
+            "count": len(ids),
+            "dim": dim,
+            "wal_seq": wal_seq,
+            "extras": sorted(extras),
+        },
+    )
+    fsync_directory(path)
+    fsync_directory(path.parent)
+    logger.info(f"Snapshot written to {path}: {len(ids)} documents")
+
+
+def read_snapshot(
+    path: Union[str, Path],
+    mmap: bool = True,
+) -> Tuple[np.ndarray, List[str], Sequence[str], Sequence[Dict]]:
+    """
+    读取知识库快照
+
+    Args:
+        path: 快照目录
+        mmap: 是否以内存映射方式打开向量和文本文件（写时复制，不会修改磁盘文件）
+
+    Returns:
+        (向量矩阵, 文档 ID 列表, 文档内容, 元数据)。文档内容和元数据为按需解码的
+        LazyColumn
+
+    Raises:
+        FileNotFoundError: 快照不存在
+        ValueError: 快照版本或内容不一致
+    """
+    path = Path(path)
+    manifest_path = path / MANIFEST_FILE
+    if not manifest_path.exists():
+        raise FileNotFoundError(f"Snapshot not found: {path}")
+
+    manifest = read_manifest(path)
+    version = manifest.get("version")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version: {version}")
+
+    # 空矩阵无法内存映射
+    mmap_mode = "c" if mmap and manifest["count"] > 0 else None
+    vectors = np.load(path / VECTORS_FILE, mmap_mode=mmap_mode, allow_pickle=False)
+    ids = decode_strings(*_open_column(path, IDS_COLUMN, mmap))
+    documents = LazyColumn(*_open_column(path, DOCUMENTS_COLUMN, mmap), _decode_text)
+    metadata = LazyColumn(*_open_column(path, METADATA_COLUMN, mmap), json.loads)
+
+    count = manifest["count"]
+    if not (len(vectors) == len(ids) == len(documents) == len(metadata) == count):
+        raise ValueError(f"Snapshot at {path} is inconsistent")
+
+    logger.info(f"Snapshot loaded from {path}: {count} documents (mmap={mmap})")
+    return vectors, ids, documents, metadata
+
+
+def read_snapshot_extras(path: Union[str, Path], mmap: bool = True) -> Dict[str, np.ndarray]:
+    """
+    读取快照中的附加数组
+
+    Args:
+        path: 快照目录
+        mmap: 是否以内存映射方式打开
+
+    Returns:
+        名称 -> 数组，快照中没有附加数组时返回空字典
+    """
+    path = Path(path)
+    extras = {}
+    for name in read_manifest(path).get("extras", []):
+        extras[name] = np.load(
+            path / f"extra_{name}.npy", mmap_mode="c" if mmap else None, allow_pickle=False
+        )
+    return extras
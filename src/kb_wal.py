@@ -0,0 +1,199 @@
+"""
+知识库预写日志（WAL）模块
+以追加方式记录 MemoryKBHandler 的每次写操作，重启时在最近一次快照之上重放
+
+记录格式（小端）：
+    seq (u64) | op (u8) | meta_len (u32) | vec_len (u32) | crc32 (u32) | meta | vectors
+
+- meta 为 UTF-8 JSON（ids / documents / metadata / dim 等）
+- vectors 为 float32 原始字节（仅 add 记录）
+- seq 单调递增，快照的 manifest 记录其包含的最后一个 seq，重放时跳过已包含的记录
+"""
+import json
+import os
+import struct
+import zlib
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+from loguru import logger
+
+from src.kb_snapshot import fsync_directory
+
+OP_ADD = 1
+OP_DELETE = 2
+OP_CLEAR = 3
+OP_DELETE_MANY = 4
+
+_HEADER = struct.Struct("<QBIII")
+
+
+class WALRecord:
+    """一条已解码的日志记录"""
+
+    __slots__ = ("seq", "op", "meta", "vectors")
+
+    def __init__(self, seq: int, op: int, meta: Dict, vectors: Optional[np.ndarray]):
+        self.seq = seq
+        self.op = op
+        self.meta = meta
+        self.vectors = vectors
+
+
+def _scan(path: Path) -> Tuple[List[WALRecord], int]:
+    """
+    顺序读取日志文件中的完整记录
+
+    遇到截断或校验失败的记录即停止（通常是写入过程中进程崩溃留下的尾部）
+
+    Returns:
+        (记录列表, 最后一条完整记录之后的字节偏移)
+    """
+    records = []
+    good_offset = 0
+
+    if not path.exists():
+        return records, good_offset
+
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                break
+
+            seq, op, meta_len, vec_len, crc = _HEADER.unpack(header)
+            payload = f.read(meta_len + vec_len)
+            if len(payload) < meta_len + vec_len or zlib.crc32(payload) != crc:
+                logger.warning(f"Discarding corrupt WAL tail at offset {good_offset} in {path}")
+                break
+
+            meta = json.loads(payload[:meta_len].decode("utf-8"))
+            vectors = None
+            if vec_len:
+                vectors = np.frombuffer(payload[meta_len:], dtype=np.float32).reshape(-1, meta["dim"])
+
+            records.append(WALRecord(seq, op, meta, vectors))
+            good_offset = f.tell()
+
+    return records, good_offset
+
+
+class WriteAheadLog:
+    """追加写入的二进制操作日志"""
+
+    def __init__(self, path: Union[str, Path], fsync: bool = True):
+        """
+        打开（或创建）日志文件
+
+        已存在的日志会被完整扫描，损坏的尾部会被截断，以保证后续追加的记录可读
+
+        Args:
+            path: 日志文件路径
+            fsync: 每条记录写入后是否调用 fsync 落盘
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.fsync = fsync
+
+        self._records, good_offset = _scan(self.path)
+        if self.path.exists() and self.path.stat().st_size > good_offset:
+            with open(self.path, "r+b") as f:
+                f.truncate(good_offset)
+
+        self.seq = self._records[-1].seq if self._records else 0
+        self._file = open(self.path, "ab")
+
+    def replay(self, after_seq: int = 0) -> Iterator[WALRecord]:
+        """
+        返回打开时读取到的、seq 大于 after_seq 的记录
+
+        Args:
+            after_seq: 快照中已包含的最后一个 seq
+        """
+        records, self._records = self._records, []
+        self.seq = max(self.seq, after_seq)
+        return (record for record in records if record.seq > after_seq)
+
+    def _append(self, op: int, meta: Dict, vectors: Optional[np.ndarray] = None) -> int:
+        meta_bytes = json.dumps(meta, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        vec_bytes = b"" if vectors is None else np.ascontiguousarray(vectors, dtype=np.float32).tobytes()
+        payload = meta_bytes + vec_bytes
+
+        self.seq += 1
+        self._file.write(
+            _HEADER.pack(self.seq, op, len(meta_bytes), len(vec_bytes), zlib.crc32(payload))
+        )
+        self._file.write(payload)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        return self.seq
+
+    def append_add(
+        self,
+        vectors: np.ndarray,
+        documents: List[str],
+        metadata: List[Dict],
+        ids: List[str],
+    ) -> int:
+        """记录一次批量添加，返回记录的 seq"""
+        meta = {"ids": ids, "documents": documents, "metadata": metadata, "dim": int(vectors.shape[1])}
+        return self._append(OP_ADD, meta, vectors)
+
+    def append_delete(self, doc_id: str) -> int:
+        """记录一次删除，返回记录的 seq"""
+        return self._append(OP_DELETE, {"id": doc_id})
+
+    def append_delete_many(self, doc_ids: List[str]) -> int:
+        """记录一次批量删除，返回记录的 seq"""
+        return self._append(OP_DELETE_MANY, {"ids": doc_ids})
+
+    def append_clear(self) -> int:
+        """记录一次清空，返回记录的 seq"""
+        return self._append(OP_CLEAR, {})
+
+    def reserve_seq(self) -> int:
+        """
+        为不经过 WAL 的整体状态替换（如加载外部快照）分配一个新的 seq
+
+        该 seq 不写入日志，只用于让随后生成的快照比之前的快照更新
+        """
+        self.seq += 1
+        return self.seq
+
+    def size_bytes(self) -> int:
+        """当前日志文件大小（字节）"""
+        return self._file.tell()
+
+    def truncate_through(self, offset: int) -> None:
+        """
+        丢弃 offset 之前的内容（这些记录已被折叠进快照），只保留之后追加的记录
+
+        调用前快照必须已经落盘（write_snapshot 返回时保证）；替换后的日志及其目录项同样落盘
+
+        Args:
+            offset: 快照对应的日志字节偏移
+        """
+        self._file.flush()
+        self._file.close()
+
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(self.path, "rb") as src, open(tmp_path, "wb") as dst:
+            src.seek(offset)
+            while True:
+                block = src.read(1 << 20)
+                if not block:
+                    break
+                dst.write(block)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp_path, self.path)
+        fsync_directory(self.path.parent)
+
+        self._file = open(self.path, "ab")
+
+    def close(self) -> None:
+        """关闭日志文件"""
+        if not self._file.closed:
+            self._file.close()
@@ -0,0 +1,43 @@
+"""
+按长度分桶的批量编码
+把文本按 token 长度排序后切成批次，使每批内部长度相近、padding 最少，
+编码完成后再按原顺序还原
+"""
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+
+def bucketed_encode(
+    texts: List[str],
+    encode_fn: Callable[[List[str]], np.ndarray],
+    batch_size: int,
+    lengths: Optional[Sequence[int]] = None,
+) -> np.ndarray:
+    """
+    按长度分桶批量编码
+
+    Args:
+        texts: 文本列表
+        encode_fn: 编码函数，输入一批文本，返回形状为 (n, dim) 的向量
+        batch_size: 每批文本数
+        lengths: 各文本的长度（可选，通常为 token 数），默认使用字符数
+
+    Returns:
+        与 texts 顺序一致的向量数组
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+
+    if lengths is None:
+        lengths = [len(text) for text in texts]
+    order = np.argsort(np.asarray(lengths), kind="stable")
+
+    result = None
+    for start in range(0, len(texts), batch_size):
+        rows = order[start : start + batch_size]
+        embeddings = np.asarray(encode_fn([texts[i] for i in rows]))
+        if result is None:
+            result = np.empty((len(texts), embeddings.shape[1]), dtype=embeddings.dtype)
+        result[rows] = embeddings
+    return result
@@ -3,30 +3,243 @@
 不依赖 ChromaDB，使用内存存储
 用于避免 SQLite 版本问题
 """
+import copy
+import threading
 import numpy as np
-from typing import List, Dict, Optional
+from pathlib import Path
+from typing import Callable, Iterable, List, Dict, Optional, Union
 from loguru import logger
-from sklearn.metrics.pairwise import cosine_similarity
+
+from src.content_hash import content_ids, partition_new
+from src.kb_snapshot import (
+    LazyColumn,
+    generation_path,
+    latest_generation,
+    prune_generations,
+    read_manifest,
+    read_snapshot,
+    read_snapshot_extras,
+    write_snapshot,
+)
+from src.kb_wal import OP_ADD, OP_CLEAR, OP_DELETE, OP_DELETE_MANY, WriteAheadLog
+from src.metadata_index import (
+    MetadataIndex,
+    references,
+    remaining_references,
+    same_source,
+    with_references,
+)
+from src.rwlock import ReadWriteLock
+from src.stream_ingest import add_documents_stream
+from src.vector_utils import normalize_rows, top_k_indices
+
+# 向量矩阵的初始容量（行数），之后按倍增扩容
+_INITIAL_CAPACITY = 1024
+
+# 墓碑行达到该数量且占比超过 _RECLAIM_RATIO 时，在后台回收
+_RECLAIM_MIN_DELETED = 1024
+_RECLAIM_RATIO = 0.25
+
+# 混合检索：稠密与 BM25 各取 max(top_k * _FUSION_DEPTH_FACTOR, _FUSION_MIN_DEPTH) 个候选做 RRF 融合
+_FUSION_DEPTH_FACTOR = 4
+_FUSION_MIN_DEPTH = 20
+_RRF_K = 60
+
+# 批量暴力检索时每块相似度矩阵 (n_queries, n_docs) 的最大元素数（float32，约 64 MB）
+_SCORE_BLOCK_ELEMENTS = 16 * 1024 * 1024
+
+# 持久化目录中的 WAL 文件名
+WAL_FILE = "wal.log"
+
+# vector_storage="disk" 时向量矩阵的磁盘映射文件名（进程内临时文件，重启时清理）
+_SCRATCH_PATTERN = "vectors-*.f32"
+
+
+def _take(column, rows: np.ndarray):
+    """按行号取出 documents / metadata 的子序列：快照中的 LazyColumn 保持惰性，列表直接复制"""
+    if isinstance(column, LazyColumn):
+        return column.take(rows)
+    return [column[i] for i in rows]
 
 
 class MemoryKBHandler:
     """内存版知识库处理器"""
 
-    def __init__(self, embedding_handler):
+    def __init__(
+        self,
+        embedding_handler,
+        persist_directory: Optional[Union[str, Path]] = None,
+        wal_compact_bytes: int = 64 * 1024 * 1024,
+        index=None,
+        vector_storage: str = "memory",
+        lexical_index=None,
+    ):
         """
         初始化内存知识库
 
         Args:
             embedding_handler: BGE 向量化处理器
+            persist_directory: 持久化目录（可选）。提供时启用快照 + WAL，
+                启动时加载最新快照并重放 WAL
+            wal_compact_bytes: WAL 超过该大小时在后台折叠为新快照
+            index: 近似最近邻索引（可选），如 IVFIndex、HNSWIndex、
+                ScalarQuantizedIndex、ProductQuantizedIndex；为 None 或尚未就绪时暴力检索
+            vector_storage: float 向量矩阵的存放位置。"memory" 为进程内存；
+                "disk" 为持久化目录中的内存映射文件，配合量化索引可大幅降低常驻内存
+            lexical_index: 稀疏词项索引（可选），如 BM25Index。提供时检索结果为
+                稠密检索与 BM25 检索的倒数排名融合（RRF）
         """
+        if vector_storage not in ("memory", "disk"):
+            raise ValueError(f"Unsupported vector_storage: {vector_storage}")
+        if vector_storage == "disk" and persist_directory is None:
+            raise ValueError("vector_storage='disk' requires persist_directory")
+
         self.embedding_handler = embedding_handler
+        # 以下三个列表与向量矩阵按行对齐，已删除的行在回收前仍保留；
+        # 从快照加载后 documents / metadata 为按需解码的 LazyColumn
         self.documents = []  # 存储文档内容
-        self.embeddings = []  # 存储向量
         self.metadata = []  # 存储元数据
         self.ids = []  # 存储文档 ID
 
+        # 连续的 float32 向量矩阵（已 L2 归一化），前 _size 行有效，容量按倍增扩展
+        self._matrix: Optional[np.ndarray] = None
+        self._size = 0
+        self.vector_storage = vector_storage
+        self._matrix_file: Optional[Path] = None
+        self._matrix_generation = 0
+
+        # 删除只打墓碑标记，检索时跳过，后台回收时才真正移除
+        self._row_of: Dict[str, int] = {}  # 文档 ID -> 行号（仅未删除的行）
+        self._deleted = np.zeros(0, dtype=bool)
+        self._n_deleted = 0
+        self._reclaiming = False
+
+        self.index = index
+        self.lexical_index = lexical_index
+        # 近似索引是否已包含全部已发布的行：首批建索引在发布前完成，此前检索走暴力路径
+        self._index_live = False
+
+        # 元数据倒排索引，首次按元数据过滤时构建，之后随写入增量维护
+        self._metadata_index: Optional[MetadataIndex] = None
+        self._metadata_lock = threading.Lock()
+
+        # 并发控制：
+        #   _write_lock 串行化写者（保证 WAL 顺序与内存一致），写 WAL、写入新行的向量、
+        #   更新近似索引和分词期间持有，不阻塞读者
+        #   _rw_lock 保护已发布的内存结构：检索以共享方式持有；写者准备好一批写入后
+        #   只在发布时短暂独占，因此检索要么看到整批写入，要么完全看不到
+        self._write_lock = threading.Lock()
+        self._rw_lock = ReadWriteLock()
+
+        # 持久化：写操作先追加到 WAL，再应用到内存
+        self.persist_directory = Path(persist_directory) if persist_directory else None
+        self.wal_compact_bytes = wal_compact_bytes
+        self._wal: Optional[WriteAheadLog] = None
+        self._compacting = False
+
+        if self.persist_directory is not None:
+            self.persist_directory.mkdir(parents=True, exist_ok=True)
+            for stale in self.persist_directory.glob(_SCRATCH_PATTERN):
+                stale.unlink(missing_ok=True)
+            self._recover()
+
         logger.info("Memory KB Handler initialized")
 
+    @property
+    def embeddings(self) -> np.ndarray:
+        """有效向量（已归一化）的视图，形状为 (n_docs, embedding_dim)，不复制数据"""
+        if self._matrix is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return self._matrix[: self._size]
+
+    def _allocate(self, capacity: int, dim: int) -> np.ndarray:
+        """
+        分配新的向量矩阵：内存数组，或持久化目录中的内存映射文件
+
+        使用磁盘映射文件时，原来的文件在切换后删除（仍被映射时删除失败，重启时清理）
+        """
+        if self.vector_storage != "disk":
+            return np.empty((capacity, dim), dtype=np.float32)
+
+        self._matrix_generation += 1
+        path = self.persist_directory / _SCRATCH_PATTERN.replace("*", str(self._matrix_generation))
+        matrix = np.memmap(path, dtype=np.float32, mode="w+", shape=(capacity, dim))
+
+        previous, self._matrix_file = self._matrix_file, path
+        if previous is not None:
+            try:
+                previous.unlink(missing_ok=True)
+            except OSError:
+                pass
+        return matrix
+
+    def _check_batch(
+        self, embeddings: np.ndarray, documents: List[str], metadata: List[Dict], ids: List[str]
+    ) -> None:
+        """
+        校验待写入批次的形状，调用方需持有写者锁
+
+        Args:
+            embeddings: 文档向量
+            documents: 文档内容列表
+            metadata: 元数据列表
+            ids: 文档 ID 列表
+        """
+        if not (len(documents) == len(metadata) == len(ids)):
+            raise ValueError(
+                f"Length mismatch: {len(documents)} documents, "
+                f"{len(metadata)} metadata, {len(ids)} ids"
+            )
+        if embeddings.ndim != 2 or embeddings.shape[0] != len(documents):
+            raise ValueError(
+                f"Expected embeddings of shape ({len(documents)}, dim), got {embeddings.shape}"
+            )
+        if self._matrix is not None and self._matrix.shape[1] != embeddings.shape[1]:
+            raise ValueError(
+                f"Embedding dimension mismatch: expected {self._matrix.shape[1]}, "
+                f"got {embeddings.shape[1]}"
+            )
+
+    def _grown(self, n_rows: int, dim: int):
+        """
+        返回至少能容纳 n_rows 行的 (向量矩阵, 墓碑掩码)，不足时按倍增扩容
+
+        容量足够时直接返回当前数组（新行写在检索可见的范围之外），
+        否则返回复制了已有行的新数组，由调用方在发布时替换。调用方需持有写者锁
+
+        Args:
+            n_rows: 需要的总行数
+            dim: 向量维度
+        """
+        if self._matrix is None:
+            capacity = max(_INITIAL_CAPACITY, n_rows)
+            return self._allocate(capacity, dim), np.zeros(capacity, dtype=bool)
+
+        if self._matrix.shape[1] != dim:
+            raise ValueError(
+                f"Embedding dimension mismatch: expected {self._matrix.shape[1]}, got {dim}"
+            )
+
+        capacity = self._matrix.shape[0]
+        if n_rows <= capacity:
+            return self._matrix, self._deleted
+
+        while capacity < n_rows:
+            capacity *= 2
+        logger.debug(f"Growing embedding matrix capacity to {capacity} rows")
+        grown = self._allocate(capacity, dim)
+        grown[: self._size] = self._matrix[: self._size]
+
+        deleted = np.zeros(capacity, dtype=bool)
+        deleted[: self._size] = self._deleted[: self._size]
+        return grown, deleted
+
+    def _mask_deleted(self, similarities: np.ndarray) -> np.ndarray:
+        """把墓碑行的相似度置为 -inf，使其不会进入 top-k"""
+        if self._n_deleted:
+            similarities[..., self._deleted[: self._size]] = -np.inf
+        return similarities
+
     def add_documents(
         self,
         documents: List[str],
@@ -36,7 +249,49 @@ class MemoryKBHandler:
         """
         添加文档到知识库
 
+        已存在的文档 ID 会被新内容覆盖
+
         Args:
+            documents: 文档内容列表
+            metadata: 元数据列表（可选）
+            ids: 文档 ID 列表（可选）。不提供时使用内容哈希作为 ID，
+                知识库中已有的内容直接跳过，不再向量化，其元数据记为该分块的其他来源（见 add_references）
+        """
+        if not documents:
+            raise ValueError("Documents list cannot be empty")
+
+        if metadata is None:
+            metadata = [{} for _ in documents]
+
+        shared_meta, shared_ids = [], []
+        if ids is None:
+            total = len(documents)
+            ids = content_ids(documents)
+            documents, metadata, ids, shared_meta, shared_ids = partition_new(
+                documents, metadata, ids, self.get_existing_ids(ids)
+            )
+            if len(documents) < total:
+                logger.info(f"Skipping {total - len(documents)} chunks already in the knowledge base")
+
+        if documents:
+            # 向量化文档
+            embeddings = self.embedding_handler.embed_texts(documents)
+            self.add_embeddings(embeddings, documents, metadata, ids)
+        if shared_ids:
+            self.add_references(shared_ids, shared_meta)
+
+    def add_embeddings(
+        self,
+        embeddings: np.ndarray,
+        documents: List[str],
+        metadata: Optional[List[Dict]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> None:
+        """
+        添加已向量化的文档（如 ShardedKBHandler 的分片由协调进程统一向量化）
+
+        Args:
+            embeddings: 文档向量，形状为 (n_docs, embedding_dim)
             documents: 文档内容列表
             metadata: 元数据列表（可选）
             ids: 文档 ID 列表（可选）
@@ -48,31 +303,70 @@ class MemoryKBHandler:
             metadata = [{} for _ in documents]
 
         if ids is None:
-            ids = [f"doc_{i}_{hash(doc)}" for i, doc in enumerate(documents)]
+            ids = content_ids(documents)
 
         try:
             logger.info(f"Adding {len(documents)} documents to memory KB")
 
-            # 向量化文档
-            embeddings = self.embedding_handler.embed_texts(documents)
+            # 写入时归一化一次，检索时只需做点积
+            embeddings = normalize_rows(embeddings)
 
-            # 添加到内存
-            self.documents.extend(documents)
-            self.embeddings.extend(embeddings)
-            self.metadata.extend(metadata)
-            self.ids.extend(ids)
+            with self._write_lock:
+                # 先校验再写 WAL：写入 WAL 的记录在每次重启时都会重放，不合法的批次必须在此拒绝
+                self._check_batch(embeddings, documents, metadata, ids)
+                if self._wal is not None:
+                    self._wal.append_add(embeddings, documents, metadata, ids)
+                self._apply_add(embeddings, documents, metadata, ids)
 
             logger.info(f"Successfully added {len(documents)} documents")
-            logger.info(f"Knowledge base now contains {len(self.documents)} documents")
+            logger.info(f"Knowledge base now contains {self.get_document_count()} documents")
+            self._maybe_compact()
+            self._maybe_reclaim()
 
         except Exception as e:
             logger.error(f"Error adding documents: {str(e)}")
             raise
 
+    def add_documents_stream(
+        self,
+        documents: Iterable[str],
+        metadata: Optional[Iterable[Dict]] = None,
+        batch_size: int = 256,
+        embedder=None,
+        progress_callback: Optional[Callable[[int], None]] = None,
+    ) -> int:
+        """
+        流式添加文档：逐批去重、向量化并写入，峰值内存与 batch_size 成正比
+
+        Args:
+            documents: 文档内容的可迭代对象（可以是生成器）
+            metadata: 与 documents 对齐的元数据可迭代对象（可选）
+            batch_size: 每批文档数
+            embedder: 提供 embed_stream 的向量化器（可选），默认使用 embedding_handler，
+                也可传入 EmbeddingPool 使用多进程向量化
+            progress_callback: 每写入一批后以已处理的文档数调用（可选）
+
+        Returns:
+            实际写入的文档数（知识库中已有的内容被跳过）
+        """
+        try:
+            return add_documents_stream(
+                self,
+                embedder or self.embedding_handler,
+                documents,
+                metadata,
+                batch_size=batch_size,
+                progress_callback=progress_callback,
+            )
+        except Exception as e:
+            logger.error(f"Error adding documents: {str(e)}")
+            raise
+
     def retrieve(
         self,
         query: str,
         top_k: int = 5,
+        where: Optional[Dict] = None,
     ) -> Dict:
         """
         检索相关文档
@@ -80,6 +374,8 @@ class MemoryKBHandler:
         Args:
             query: 查询文本
             top_k: 返回最相关的 k 个文档
+            where: 元数据过滤条件（可选），如 {"filename": "manual.pdf"}，
+                语法见 src.metadata_index；只对命中的行打分。共用分块的任一来源满足条件即命中
 
         Returns:
             包含检索结果的字典
@@ -87,7 +383,8 @@ class MemoryKBHandler:
         if not query or not query.strip():
             raise ValueError("Query cannot be empty")
 
-        if not self.documents:
+        # 知识库为空时不必向量化查询；持有读锁后还会再检查一次（期间可能被清空）
+        if self.get_document_count() == 0:
             logger.debug("Knowledge base is empty")
             return {
                 "ids": [],
@@ -102,28 +399,10 @@ class MemoryKBHandler:
             # 向量化查询
             query_embedding = self.embedding_handler.embed_query(query)
 
-            # 计算相似度
-            if len(self.embeddings) == 0:
-                return {
-                    "ids": [],
-                    "documents": [],
-                    "metadatas": [],
-                    "distances": [],
-                }
-
-            embeddings_array = np.array(self.embeddings)
-            similarities = cosine_similarity([query_embedding], embeddings_array)[0]
-
-            # 获取 top-k 索引
-            top_indices = np.argsort(-similarities)[:top_k]
-
-            # 构建结果
-            results = {
-                "ids": [self.ids[i] for i in top_indices],
-                "documents": [self.documents[i] for i in top_indices],
-                "metadatas": [self.metadata[i] for i in top_indices],
-                "distances": [1 - similarities[i] for i in top_indices],  # 转换为距离
-            }
+            query_embeddings = normalize_rows(np.atleast_2d(query_embedding))
+
+            with self._rw_lock.read():
+                results = self._retrieve_by_embeddings(query_embeddings, top_k, where, [query])[0]
 
             logger.debug(f"Retrieved {len(results['documents'])} documents")
             return results
@@ -132,6 +411,207 @@ class MemoryKBHandler:
             logger.error(f"Error retrieving documents: {str(e)}")
             raise
 
+    def retrieve_many(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        where: Optional[Dict] = None,
+    ) -> List[Dict]:
+        """
+        批量检索相关文档
+
+        所有查询一次性向量化；暴力检索时按块做矩阵-矩阵乘法与知识库打分
+
+        Args:
+            queries: 查询文本列表
+            top_k: 每个查询返回最相关的 k 个文档
+            where: 元数据过滤条件（可选），对所有查询生效
+
+        Returns:
+            检索结果字典列表，与 queries 一一对应，格式同 retrieve()
+        """
+        if not queries:
+            return []
+
+        if any(not query or not query.strip() for query in queries):
+            raise ValueError("Query cannot be empty")
+
+        logger.debug(f"Retrieving top {top_k} documents for {len(queries)} queries")
+
+        # 一次性向量化所有查询
+        query_embeddings = self.embedding_handler.embed_queries(queries)
+        return self.retrieve_by_embeddings(query_embeddings, top_k, where, queries)
+
+    def retrieve_by_embeddings(
+        self,
+        query_embeddings: np.ndarray,
+        top_k: int = 5,
+        where: Optional[Dict] = None,
+        queries: Optional[List[str]] = None,
+    ) -> List[Dict]:
+        """
+        用已向量化的查询批量检索（如 ShardedKBHandler 的分片）
+
+        Args:
+            query_embeddings: 查询向量，形状为 (n_queries, embedding_dim)
+            top_k: 每个查询返回最相关的 k 个文档
+            where: 元数据过滤条件（可选），对所有查询生效
+            queries: 查询原文（可选），启用混合检索时必需
+
+        Returns:
+            检索结果字典列表，与 query_embeddings 一一对应，格式同 retrieve()
+        """
+        try:
+            query_embeddings = normalize_rows(query_embeddings)
+            with self._rw_lock.read():
+                return self._retrieve_by_embeddings(query_embeddings, top_k, where, queries)
+        except Exception as e:
+            logger.error(f"Error retrieving documents: {str(e)}")
+            raise
+
+    def _retrieve_by_embeddings(
+        self,
+        query_embeddings: np.ndarray,
+        top_k: int,
+        where: Optional[Dict],
+        queries: Optional[List[str]],
+    ) -> List[Dict]:
+        """retrieve_by_embeddings 的实现，调用方需持有读锁"""
+        if self._count() == 0:
+            logger.debug("Knowledge base is empty")
+            return [
+                {"ids": [], "documents": [], "metadatas": [], "distances": []}
+                for _ in query_embeddings
+            ]
+
+        top_k = min(top_k, self._count())
+
+        candidates = self._filter_rows(where) if where else None
+        if self.lexical_index is not None and queries is not None:
+            results = [
+                self._build_results(
+                    *self._hybrid_search(query, query_embedding, top_k, candidates)
+                )
+                for query, query_embedding in zip(queries, query_embeddings)
+            ]
+        elif candidates is not None:
+            results = [
+                self._build_results(*self._search_rows(query_embedding, candidates, top_k))
+                for query_embedding in query_embeddings
+            ]
+        elif self._index_ready():
+            results = [
+                self._build_results(*self._search(query_embedding, top_k))
+                for query_embedding in query_embeddings
+            ]
+        else:
+            # 按块做 (block, dim) @ (dim, n_docs)，临时相似度矩阵的大小与查询总数无关
+            block = max(1, _SCORE_BLOCK_ELEMENTS // self._size)
+            results = []
+            for start in range(0, len(query_embeddings), block):
+                queries_block = query_embeddings[start : start + block]
+                similarities = self._mask_deleted(queries_block @ self.embeddings.T)
+                for row in similarities:
+                    top = top_k_indices(row, top_k)
+                    results.append(self._build_results(top, row[top]))
+
+        logger.debug(f"Retrieved documents for {len(results)} queries")
+        return results
+
+    def _index_ready(self) -> bool:
+        """是否使用近似索引检索"""
+        return self._index_live
+
+    def _search(self, query_embedding: np.ndarray, k: int):
+        """
+        对单个已归一化的查询向量检索 top-k
+
+        Returns:
+            (行号数组, 相似度数组)，按相似度降序
+        """
+        if self._index_ready():
+            deleted = self._deleted[: self._size] if self._n_deleted else None
+            return self.index.search(query_embedding, self.embeddings, k, deleted)
+
+        # 向量已归一化，余弦相似度即为一次矩阵-向量点积
+        similarities = self._mask_deleted(self.embeddings @ query_embedding)
+        top = top_k_indices(similarities, k)
+        return top, similarities[top]
+
+    def _filter_rows(self, where: Dict) -> np.ndarray:
+        """返回元数据满足过滤条件的未删除行号，调用方需持有读锁或写者锁"""
+        with self._metadata_lock:
+            if self._metadata_index is None:
+                self._metadata_index = MetadataIndex()
+                self._metadata_index.rebuild(self.metadata)
+            rows = self._metadata_index.match(where)
+
+        if self._n_deleted and len(rows):
+            rows = rows[~self._deleted[rows]]
+        return rows
+
+    def _search_rows(self, query_embedding: np.ndarray, rows: np.ndarray, k: int):
+        """
+        只在给定的候选行中精确检索 top-k
+
+        Returns:
+            (行号数组, 相似度数组)，按相似度降序
+        """
+        similarities = self.embeddings[rows] @ query_embedding
+        top = top_k_indices(similarities, k)
+        return rows[top], similarities[top]
+
+    def _hybrid_search(
+        self,
+        query: str,
+        query_embedding: np.ndarray,
+        k: int,
+        candidates: Optional[np.ndarray] = None,
+    ):
+        """
+        稠密检索与 BM25 检索的倒数排名融合
+
+        两路各取若干候选，按 sum(1 / (_RRF_K + rank)) 排序取 top-k；
+        返回的相似度仍为稠密余弦相似度，使 distances 的含义与纯稠密检索一致
+
+        Returns:
+            (行号数组, 相似度数组)，按融合分数降序
+        """
+        depth = max(k * _FUSION_DEPTH_FACTOR, _FUSION_MIN_DEPTH)
+        if candidates is not None:
+            dense_rows, _ = self._search_rows(query_embedding, candidates, depth)
+        else:
+            dense_rows, _ = self._search(query_embedding, min(depth, self._count()))
+
+        deleted = self._deleted[: self._size] if self._n_deleted else None
+        sparse_rows, _ = self.lexical_index.search(query, depth, deleted, candidates)
+
+        fused: Dict[int, float] = {}
+        for ranked in (dense_rows, sparse_rows):
+            for rank, row in enumerate(ranked.tolist(), 1):
+                fused[row] = fused.get(row, 0.0) + 1.0 / (_RRF_K + rank)
+
+        rows = np.array(sorted(fused, key=fused.get, reverse=True)[:k], dtype=np.int64)
+        return rows, self.embeddings[rows] @ query_embedding
+
+    def _build_results(self, indices: np.ndarray, scores: np.ndarray) -> Dict:
+        """
+        根据行下标构建检索结果字典
+
+        Args:
+            indices: 按相关度排序的行下标
+            scores: 与 indices 一一对应的相似度
+
+        Returns:
+            包含 ids、documents、metadatas、distances 的字典
+        """
+        return {
+            "ids": [self.ids[i] for i in indices],
+            "documents": [self.documents[i] for i in indices],
+            "metadatas": [self.metadata[i] for i in indices],
+            "distances": [float(1 - score) for score in scores],  # 转换为距离
+        }
+
     def delete_document(self, doc_id: str) -> None:
         """
         删除指定的文档
@@ -142,14 +622,18 @@ class MemoryKBHandler:
         try:
             logger.info(f"Deleting document: {doc_id}")
 
-            if doc_id in self.ids:
-                idx = self.ids.index(doc_id)
-                self.ids.pop(idx)
-                self.documents.pop(idx)
-                self.embeddings.pop(idx)
-                self.metadata.pop(idx)
+            with self._write_lock:
+                found = doc_id in self._row_of
+                if found:
+                    if self._wal is not None:
+                        self._wal.append_delete(doc_id)
+                    with self._rw_lock.write():
+                        self._apply_delete(doc_id)
 
-                logger.info(f"Document deleted. KB now contains {len(self.documents)} documents")
+            if found:
+                logger.info(f"Document deleted. KB now contains {self.get_document_count()} documents")
+                self._maybe_compact()
+                self._maybe_reclaim()
             else:
                 logger.warning(f"Document not found: {doc_id}")
 
@@ -157,27 +641,540 @@ class MemoryKBHandler:
             logger.error(f"Error deleting document: {str(e)}")
             raise
 
+    def delete_documents(self, doc_ids: List[str]) -> int:
+        """
+        批量删除文档，整批只写一条 WAL 记录（不存在的 ID 被忽略）
+
+        Args:
+            doc_ids: 文档 ID 列表
+
+        Returns:
+            删除的文档数量
+        """
+        try:
+            with self._write_lock:
+                doc_ids = [doc_id for doc_id in dict.fromkeys(doc_ids) if doc_id in self._row_of]
+                if doc_ids:
+                    if self._wal is not None:
+                        self._wal.append_delete_many(doc_ids)
+                    with self._rw_lock.write():
+                        for doc_id in doc_ids:
+                            self._apply_delete(doc_id)
+
+            logger.info(
+                f"Deleted {len(doc_ids)} documents. KB now contains {self.get_document_count()} documents"
+            )
+            if doc_ids:
+                self._maybe_compact()
+                self._maybe_reclaim()
+            return len(doc_ids)
+
+        except Exception as e:
+            logger.error(f"Error deleting documents: {str(e)}")
+            raise
+
+    def delete_where(self, **filters) -> int:
+        """
+        删除元数据匹配全部过滤条件的文档，例如 delete_where(filename="manual.pdf")
+
+        通过元数据倒排索引定位待删除的行，整批删除只写一条 WAL 记录。
+        多个文件共用的分块只去掉匹配的引用，仍被其他文件引用时保留该行
+
+        Args:
+            **filters: 元数据字段及其取值
+
+        Returns:
+            删除的文档数量
+        """
+        if not filters:
+            raise ValueError("At least one filter is required")
+
+        try:
+            logger.info(f"Deleting documents where {filters}")
+            with self._write_lock:
+                doc_ids = [self.ids[row] for row in self._filter_rows(filters)]
+                deleted, updated = self._drop_references(doc_ids, filters)
+
+            logger.info(
+                f"Deleted {deleted} documents, kept {updated} shared by other sources. "
+                f"KB now contains {self.get_document_count()} documents"
+            )
+            if deleted or updated:
+                self._maybe_compact()
+                self._maybe_reclaim()
+            return deleted
+
+        except Exception as e:
+            logger.error(f"Error deleting documents: {str(e)}")
+            raise
+
+    def add_references(self, doc_ids: List[str], metadata: List[Dict]) -> int:
+        """
+        为已入库的分块记录其他来源的元数据（内容相同的分块在多个文件中出现时）
+
+        引用记在该行元数据的 REFS_FIELD 中，where 过滤和 delete_where 会逐个引用判断。
+        与已有引用来自同一来源（SOURCE_FIELDS 相同）的元数据被忽略，不存在的 ID 被忽略
+
+        Args:
+            doc_ids: 文档 ID 列表
+            metadata: 与 doc_ids 对齐的来源元数据
+
+        Returns:
+            元数据被更新的文档数量
+        """
+        try:
+            with self._write_lock:
+                updates: Dict[str, List[Dict]] = {}
+                for doc_id, meta in zip(doc_ids, metadata):
+                    if doc_id not in self._row_of:
+                        continue
+                    refs = updates.get(doc_id)
+                    if refs is None:
+                        refs = references(self.metadata[self._row_of[doc_id]])
+                    if any(same_source(ref, meta) for ref in refs):
+                        continue
+                    updates[doc_id] = refs + [dict(meta)]
+                if updates:
+                    self._rewrite_metadata(
+                        {doc_id: with_references(refs) for doc_id, refs in updates.items()}
+                    )
+
+            if updates:
+                logger.info(f"Recorded new sources for {len(updates)} shared chunks")
+                self._maybe_compact()
+                self._maybe_reclaim()
+            return len(updates)
+
+        except Exception as e:
+            logger.error(f"Error adding references: {str(e)}")
+            raise
+
+    def remove_references(self, doc_ids: List[str], **filters) -> int:
+        """
+        从指定文档中去掉匹配过滤条件的引用，只改元数据，不删除文档
+
+        用于增量入库：文件不再包含某个共用分块时，只去掉该文件对它的引用。
+        全部引用都匹配的文档保持不变，是否删除由调用方（入库清单的引用计数）决定
+
+        Args:
+            doc_ids: 文档 ID 列表（不存在的 ID 被忽略）
+            **filters: 标识引用的元数据字段及其取值
+
+        Returns:
+            元数据被更新的文档数量
+        """
+        if not filters:
+            raise ValueError("At least one filter is required")
+
+        try:
+            with self._write_lock:
+                doc_ids = [doc_id for doc_id in dict.fromkeys(doc_ids) if doc_id in self._row_of]
+                _, updated = self._drop_references(doc_ids, filters, delete=False)
+
+            if updated:
+                logger.info(f"Removed references {filters} from {updated} documents")
+                self._maybe_compact()
+                self._maybe_reclaim()
+            return updated
+
+        except Exception as e:
+            logger.error(f"Error removing references: {str(e)}")
+            raise
+
+    def _drop_references(self, doc_ids: List[str], where: Dict, delete: bool = True):
+        """
+        delete_where / remove_references 的实现，调用方需持有写者锁
+
+        还有剩余引用的文档以剩余引用作为元数据重新写入；
+        没有剩余引用的文档在 delete 为 True 时整批删除，否则保持不变
+
+        Returns:
+            (删除的文档数, 重新写入元数据的文档数)
+        """
+        deleted, updates = [], {}
+        for doc_id in doc_ids:
+            meta = self.metadata[self._row_of[doc_id]]
+            remaining = remaining_references(meta, where)
+            if not remaining:
+                if delete:
+                    deleted.append(doc_id)
+            elif len(remaining) < len(references(meta)):
+                updates[doc_id] = with_references(remaining)
+
+        if deleted:
+            if self._wal is not None:
+                self._wal.append_delete_many(deleted)
+            with self._rw_lock.write():
+                for doc_id in deleted:
+                    self._apply_delete(doc_id)
+        if updates:
+            self._rewrite_metadata(updates)
+        return len(deleted), len(updates)
+
+    def _rewrite_metadata(self, updates: Dict[str, Dict]) -> None:
+        """
+        用新的元数据重新写入已有文档（沿用原向量，不重新向量化），调用方需持有写者锁
+
+        按覆盖已有 ID 的添加处理：WAL 中记为一次添加，旧行打墓碑
+
+        Args:
+            updates: 文档 ID -> 新的元数据
+        """
+        ids = list(updates)
+        rows = [self._row_of[doc_id] for doc_id in ids]
+        embeddings = np.array(self._matrix[rows], dtype=np.float32)
+        documents = [self.documents[row] for row in rows]
+        metadata = [updates[doc_id] for doc_id in ids]
+        if self._wal is not None:
+            self._wal.append_add(embeddings, documents, metadata, ids)
+        self._apply_add(embeddings, documents, metadata, ids)
+
     def clear_collection(self) -> None:
         """清空整个知识库"""
         try:
             logger.warning("Clearing entire knowledge base")
-            self.documents = []
-            self.embeddings = []
-            self.metadata = []
-            self.ids = []
+            with self._write_lock:
+                if self._wal is not None:
+                    self._wal.append_clear()
+                with self._rw_lock.write():
+                    self._apply_clear()
             logger.info("Knowledge base cleared")
+            self._maybe_compact()
         except Exception as e:
             logger.error(f"Error clearing knowledge base: {str(e)}")
             raise
 
+    def _apply_add(
+        self,
+        embeddings: np.ndarray,
+        documents: List[str],
+        metadata: List[Dict],
+        ids: List[str],
+    ) -> None:
+        """
+        把一批已归一化的向量及其文档写入内存（不记录 WAL），调用方需持有写者锁
+
+        耗时的部分（扩容复制矩阵、写入新行、更新近似索引、BM25 分词）在发布前完成，
+        此时新行在检索可见的范围之外，检索照常进行；只有发布时独占读写锁
+        """
+        start = self._size
+        end = start + len(documents)
+        matrix, deleted = self._grown(end, embeddings.shape[1])
+        matrix[start:end] = embeddings
+
+        if self.index is not None:
+            self.index.add(np.arange(start, end), matrix[:end])
+        prepared = self.lexical_index.prepare(documents) if self.lexical_index is not None else None
+
+        with self._rw_lock.write():
+            self._matrix = matrix
+            self._deleted = deleted
+            self._size = end
+
+            # 添加到内存
+            self.documents.extend(documents)
+            self.metadata.extend(metadata)
+            self.ids.extend(ids)
+            if self._metadata_index is not None:
+                self._metadata_index.add(start, metadata)
+            if self.lexical_index is not None:
+                self.lexical_index.add(start, documents, prepared)
+            for offset, doc_id in enumerate(ids):
+                # 覆盖已存在的 ID：旧行打墓碑
+                if doc_id in self._row_of:
+                    self._apply_delete(doc_id)
+                self._row_of[doc_id] = start + offset
+
+            self._index_live = self.index is not None and self.index.is_trained
+
+    def _apply_delete(self, doc_id: str) -> bool:
+        """给文档打墓碑标记（不记录 WAL），O(1)，返回是否找到"""
+        row = self._row_of.pop(doc_id, None)
+        if row is None:
+            return False
+
+        self._deleted[row] = True
+        self._n_deleted += 1
+        if self.lexical_index is not None:
+            self.lexical_index.remove(row, self.documents[row])
+        return True
+
+    def _apply_clear(self) -> None:
+        """清空内存中的全部内容（不记录 WAL）"""
+        self.documents = []
+        self.metadata = []
+        self.ids = []
+        self._matrix = None
+        self._size = 0
+        self._row_of = {}
+        self._deleted = np.zeros(0, dtype=bool)
+        self._n_deleted = 0
+        self._metadata_index = None
+        self._index_live = False
+        if self.index is not None:
+            self.index.reset()
+        if self.lexical_index is not None:
+            self.lexical_index.reset()
+
+    def _live_rows(self) -> np.ndarray:
+        """未删除行的行号"""
+        return np.flatnonzero(~self._deleted[: self._size])
+
+    def _live_state(self):
+        """复制未删除行的 (向量, ID, 文档, 元数据, 索引状态)，用于写快照"""
+        rows = self._live_rows()
+        extras = {}
+        if self.index is not None:
+            extras.update(self.index.state(rows, self.embeddings))
+        if self.lexical_index is not None:
+            extras.update(self.lexical_index.state(rows))
+        return (
+            self.embeddings[rows],
+            [self.ids[i] for i in rows],
+            _take(self.documents, rows),
+            _take(self.metadata, rows),
+            extras,
+        )
+
+    def _maybe_reclaim(self) -> None:
+        """墓碑行过多时在后台线程中回收"""
+        if self._reclaiming or self._n_deleted < _RECLAIM_MIN_DELETED:
+            return
+        if self._n_deleted < self._size * _RECLAIM_RATIO:
+            return
+
+        self._reclaiming = True
+        threading.Thread(target=self.reclaim, name="kb-tombstone-reclaim", daemon=True).start()
+
+    def reclaim(self) -> None:
+        """把未删除的行紧凑到矩阵前部，真正释放墓碑行占用的空间"""
+        try:
+            with self._write_lock:
+                if self._n_deleted == 0:
+                    return
+
+                rows = self._live_rows()
+                logger.info(f"Reclaiming {self._n_deleted} deleted rows ({len(rows)} live)")
+
+                # 持有写者锁时内存结构不会变化，先在旁边构建紧凑后的副本（包括重排后的索引），
+                # 检索照常进行；索引的 remap 只替换属性、不修改原对象，浅拷贝即可
+                capacity = max(_INITIAL_CAPACITY, len(rows))
+                matrix = self._allocate(capacity, self._matrix.shape[1])
+                matrix[: len(rows)] = self._matrix[rows]
+                ids = [self.ids[i] for i in rows]
+                documents = _take(self.documents, rows)
+                metadata = _take(self.metadata, rows)
+                row_of = {doc_id: row for row, doc_id in enumerate(ids)}
+
+                index = copy.copy(self.index)
+                if index is not None:
+                    index.remap(rows, matrix[: len(rows)])
+                lexical_index = copy.copy(self.lexical_index)
+                if lexical_index is not None:
+                    lexical_index.remap(rows)
+
+                with self._rw_lock.write():
+                    self.ids = ids
+                    self.documents = documents
+                    self.metadata = metadata
+                    self._matrix = matrix
+                    self._size = len(rows)
+                    self._deleted = np.zeros(capacity, dtype=bool)
+                    self._n_deleted = 0
+                    self._row_of = row_of
+                    self._metadata_index = None
+                    self.index = index
+                    self.lexical_index = lexical_index
+        except Exception as e:
+            logger.error(f"Error reclaiming deleted rows: {str(e)}")
+        finally:
+            self._reclaiming = False
+
+    def _recover(self) -> None:
+        """加载持久化目录中最新的快照，并重放其后的 WAL 记录"""
+        snapshot_seq = 0
+        snapshot_dir = latest_generation(self.persist_directory)
+        if snapshot_dir is not None:
+            self.load(snapshot_dir)
+            snapshot_seq = read_manifest(snapshot_dir).get("wal_seq", 0)
+
+        self._wal = WriteAheadLog(self.persist_directory / WAL_FILE)
+
+        replayed = 0
+        for record in self._wal.replay(after_seq=snapshot_seq):
+            if record.op == OP_ADD:
+                self._apply_add(
+                    record.vectors,
+                    record.meta["documents"],
+                    record.meta["metadata"],
+                    record.meta["ids"],
+                )
+            elif record.op == OP_DELETE:
+                self._apply_delete(record.meta["id"])
+            elif record.op == OP_DELETE_MANY:
+                for doc_id in record.meta["ids"]:
+                    self._apply_delete(doc_id)
+            elif record.op == OP_CLEAR:
+                self._apply_clear()
+            replayed += 1
+
+        logger.info(
+            f"Recovered memory KB from {self.persist_directory}: "
+            f"{self.get_document_count()} documents, {replayed} WAL records replayed"
+        )
+        self._maybe_reclaim()
+
+    def _maybe_compact(self) -> None:
+        """WAL 超过阈值时在后台线程中折叠为新快照"""
+        if self._wal is None or self._compacting:
+            return
+        if self._wal.size_bytes() < self.wal_compact_bytes:
+            return
+
+        threading.Thread(target=self.compact, name="kb-wal-compaction", daemon=True).start()
+
+    def compact(self) -> None:
+        """
+        将当前状态写成新快照，并丢弃已被快照包含的 WAL 记录
+
+        只在复制内存状态时持有写锁，快照写盘期间新的写操作继续追加到 WAL，
+        整理完成后这些记录会保留在截断后的 WAL 中。快照的全部文件和目录项
+        fsync 之后才截断 WAL，断电时不会出现日志已丢弃而快照尚未落盘的情况
+        """
+        if self._wal is None:
+            return
+
+        with self._write_lock:
+            if self._compacting:
+                return
+            wal_seq = self._wal.seq
+            wal_offset = self._wal.size_bytes()
+            snapshot_dir = generation_path(self.persist_directory, wal_seq)
+            if snapshot_dir.exists():
+                # 自上次整理以来没有新的写操作
+                return
+            self._compacting = True
+            vectors, ids, documents, metadata, extras = self._live_state()
+
+        try:
+            logger.info(f"Compacting memory KB WAL ({wal_offset} bytes, seq={wal_seq})")
+            write_snapshot(
+                snapshot_dir, vectors, ids, documents, metadata, wal_seq=wal_seq, extras=extras
+            )
+
+            # write_snapshot 返回时快照已落盘，此后才能丢弃被它包含的日志记录
+            with self._write_lock:
+                self._wal.truncate_through(wal_offset)
+
+            prune_generations(self.persist_directory, keep=snapshot_dir)
+            logger.info(f"WAL compacted into {snapshot_dir}")
+        except Exception as e:
+            logger.error(f"Error compacting WAL: {str(e)}")
+        finally:
+            self._compacting = False
+
+    def close(self) -> None:
+        """关闭 WAL 文件"""
+        if self._wal is not None:
+            self._wal.close()
+
+    def save(self, path: Union[str, Path]) -> None:
+        """
+        将知识库保存为磁盘快照
+
+        Args:
+            path: 快照目录
+        """
+        try:
+            logger.info(f"Saving memory KB to {path}")
+            # 索引在写者锁下更新（不持有读写锁），复制状态时需要持有写者锁
+            with self._write_lock:
+                wal_seq = self._wal.seq if self._wal is not None else 0
+                vectors, ids, documents, metadata, extras = self._live_state()
+            write_snapshot(
+                path, vectors, ids, documents, metadata, wal_seq=wal_seq, extras=extras
+            )
+        except Exception as e:
+            logger.error(f"Error saving knowledge base: {str(e)}")
+            raise
+
+    def load(self, path: Union[str, Path], mmap: bool = True) -> None:
+        """
+        从磁盘快照加载知识库，替换当前内容
+
+        mmap=True 时向量文件以写时复制的内存映射方式打开，文档和元数据也以内存映射方式
+        按需解码，加载时只需读入文档 ID，其余内容由操作系统按需分页
+
+        Args:
+            path: 快照目录
+            mmap: 是否内存映射向量和文本文件
+        """
+        try:
+            logger.info(f"Loading memory KB from {path}")
+            vectors, ids, documents, metadata = read_snapshot(path, mmap=mmap)
+            extras = read_snapshot_extras(path, mmap=mmap)
+
+            with self._write_lock:
+                # 在旁边构建新索引，检索继续使用当前内容，只在替换时独占；
+                # 优先使用快照中的索引结构，没有时按快照中的向量重建
+                index = copy.copy(self.index)
+                if index is not None:
+                    index.reset()
+                    if not index.load_state(extras):
+                        index.add(np.arange(len(vectors)), vectors)
+                lexical_index = copy.copy(self.lexical_index)
+                if lexical_index is not None:
+                    lexical_index.reset()
+                    if not lexical_index.load_state(extras):
+                        lexical_index.add(0, documents)
+                row_of = {doc_id: row for row, doc_id in enumerate(ids)}
+
+                with self._rw_lock.write():
+                    self.documents = documents
+                    self.metadata = metadata
+                    self.ids = ids
+                    self._matrix = vectors if len(vectors) > 0 else None
+                    self._size = len(vectors)
+                    self._row_of = row_of
+                    self._deleted = np.zeros(len(vectors), dtype=bool)
+                    self._n_deleted = 0
+                    self._metadata_index = None
+                    self.index = index
+                    self.lexical_index = lexical_index
+                    self._index_live = index is not None and index.is_trained
+
+                if self._wal is not None:
+                    self._wal.reserve_seq()
+
+            logger.info(f"Knowledge base now contains {self.get_document_count()} documents")
+
+            if self._wal is not None:
+                # 整体替换不经过 WAL，立即写出新快照使持久化状态与内存一致
+                self.compact()
+        except Exception as e:
+            logger.error(f"Error loading knowledge base: {str(e)}")
+            raise
+
+    def get_existing_ids(self, ids: List[str]) -> List[str]:
+        """返回 ids 中已在知识库里的 ID"""
+        with self._rw_lock.read():
+            return [doc_id for doc_id in ids if doc_id in self._row_of]
+
+    def _count(self) -> int:
+        """未删除的文档数量，调用方需持有读锁或写者锁"""
+        return self._size - self._n_deleted
+
     def get_document_count(self) -> int:
         """获取知识库中的文档数量"""
-        return len(self.documents)
+        with self._rw_lock.read():
+            return self._count()
 
     def get_all_documents(self) -> Dict:
         """获取知识库中的所有文档"""
-        return {
-            "ids": self.ids.copy(),
-            "documents": self.documents.copy(),
-            "metadatas": self.metadata.copy(),
-        }
+        with self._rw_lock.read():
+            rows = self._live_rows()
+            return {
+                "ids": [self.ids[i] for i in rows],
+                "documents": [self.documents[i] for i in rows],
+                "metadatas": [self.metadata[i] for i in rows],
+            }
@@ -0,0 +1,172 @@
+"""
+元数据倒排索引
+为 MemoryKBHandler 的 where= 过滤提供 字段值 -> 行号 的倒排表，
+过滤检索时只对命中的行打分，而不是全量扫描后再过滤
+
+where 语法与 ChromaDB 的元数据过滤保持一致（子集）：
+    {"filename": "a.pdf"}                          等值
+    {"chunk_index": {"$in": [0, 1, 2]}}            $eq / $ne / $in / $nin
+    {"$and": [{...}, {...}]}、{"$or": [...]}       组合
+顶层多个字段视为 $and
+
+多个文件共用的分块（内容哈希相同）只存一行，其余文件的元数据以列表形式记在
+REFS_FIELD 字段中。这类行逐个引用判断过滤条件，任意一个引用满足即命中
+"""
+from typing import Dict, Hashable, List
+
+import numpy as np
+
+_EMPTY = np.empty(0, dtype=np.int64)
+
+# 共用分块的其他来源的元数据列表
+REFS_FIELD = "_refs"
+
+# 判断两个引用是否来自同一来源（同一文件）的字段
+SOURCE_FIELDS = ("collection", "filename")
+
+
+def references(meta: Dict) -> List[Dict]:
+    """拆出一行元数据中的全部引用：自身的元数据在前，之后是 REFS_FIELD 中的引用"""
+    primary = {field: value for field, value in meta.items() if field != REFS_FIELD}
+    return [primary] + list(meta.get(REFS_FIELD, []))
+
+
+def with_references(refs: List[Dict]) -> Dict:
+    """references() 的逆操作：第一个引用作为该行的元数据，其余记在 REFS_FIELD 中"""
+    meta = dict(refs[0])
+    if len(refs) > 1:
+        meta[REFS_FIELD] = list(refs[1:])
+    return meta
+
+
+def same_source(a: Dict, b: Dict) -> bool:
+    """两个引用是否来自同一来源：比较 SOURCE_FIELDS，两者都没有这些字段时比较全部元数据"""
+    key_a = tuple(a.get(field) for field in SOURCE_FIELDS)
+    key_b = tuple(b.get(field) for field in SOURCE_FIELDS)
+    if any(value is not None for value in key_a + key_b):
+        return key_a == key_b
+    return a == b
+
+
+def remaining_references(meta: Dict, where: Dict) -> List[Dict]:
+    """返回一行元数据中不满足过滤条件的引用"""
+    refs = references(meta)
+    index = MetadataIndex()
+    index.rebuild(refs)
+    matched = set(index.match(where).tolist())
+    return [ref for i, ref in enumerate(refs) if i not in matched]
+
+
+class MetadataIndex:
+    """元数据倒排索引"""
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[Hashable, List[int]]] = {}
+        self._cache: Dict[tuple, np.ndarray] = {}
+        # 带有 REFS_FIELD 的行 -> 由其全部引用构成的小索引
+        self._shared: Dict[int, "MetadataIndex"] = {}
+        self._n_rows = 0
+
+    def add(self, start_row: int, metadata: List[Dict]) -> None:
+        """
+        索引从 start_row 开始的连续若干行的元数据
+
+        不可哈希的取值（如列表）不会被索引
+        """
+        for offset, meta in enumerate(metadata):
+            row = start_row + offset
+            if REFS_FIELD in meta:
+                shared = MetadataIndex()
+                shared.rebuild(references(meta))
+                self._shared[row] = shared
+                continue
+            for field, value in meta.items():
+                try:
+                    self._postings.setdefault(field, {}).setdefault(value, []).append(row)
+                except TypeError:
+                    continue
+        self._n_rows = max(self._n_rows, start_row + len(metadata))
+        self._cache.clear()
+
+    def rebuild(self, metadata: List[Dict]) -> None:
+        """按当前全部行的元数据重建索引"""
+        self._postings = {}
+        self._shared = {}
+        self._n_rows = 0
+        self.add(0, metadata)
+
+    def _rows(self, field: str, value) -> np.ndarray:
+        """字段等于 value 的行号（升序）"""
+        try:
+            key = (field, value)
+            cached = self._cache.get(key)
+        except TypeError:
+            raise ValueError(f"Unhashable filter value for '{field}': {value!r}")
+        if cached is None:
+            rows = self._postings.get(field, {}).get(value)
+            cached = np.array(rows, dtype=np.int64) if rows else _EMPTY
+            self._cache[key] = cached
+        return cached
+
+    def _union(self, arrays: List[np.ndarray]) -> np.ndarray:
+        return np.unique(np.concatenate(arrays)) if arrays else _EMPTY
+
+    def _intersect(self, arrays: List[np.ndarray]) -> np.ndarray:
+        result = arrays[0]
+        for array in arrays[1:]:
+            result = np.intersect1d(result, array, assume_unique=True)
+        return result
+
+    def _match_field(self, field: str, condition) -> np.ndarray:
+        if not isinstance(condition, dict):
+            return self._rows(field, condition)
+
+        if len(condition) != 1:
+            raise ValueError(f"Filter on '{field}' must have exactly one operator")
+        op, value = next(iter(condition.items()))
+
+        if op == "$eq":
+            return self._rows(field, value)
+        if op == "$in":
+            return self._union([self._rows(field, v) for v in value])
+        if op in ("$ne", "$nin"):
+            values = [value] if op == "$ne" else value
+            excluded = self._union([self._rows(field, v) for v in values])
+            return np.setdiff1d(np.arange(self._n_rows), excluded, assume_unique=True)
+        raise ValueError(f"Unsupported filter operator: {op}")
+
+    def match(self, where: Dict) -> np.ndarray:
+        """
+        返回满足过滤条件的行号（升序，可能包含已删除的行）
+
+        Args:
+            where: 过滤条件
+
+        Raises:
+            ValueError: 过滤条件格式不正确或使用了不支持的操作符
+        """
+        rows = self._match(where)
+        if not self._shared:
+            return rows
+        # 共用分块的行不在倒排表中，逐行对其引用求值
+        shared = np.array(sorted(self._shared), dtype=np.int64)
+        hits = [row for row in shared.tolist() if len(self._shared[row].match(where))]
+        rows = np.setdiff1d(rows, shared, assume_unique=True)
+        return np.union1d(rows, np.array(hits, dtype=np.int64))
+
+    def _match(self, where: Dict) -> np.ndarray:
+        """match() 在倒排表上的部分"""
+        if not isinstance(where, dict) or not where:
+            raise ValueError("where must be a non-empty dict")
+
+        parts = []
+        for key, condition in where.items():
+            if key == "$and":
+                parts.append(self._intersect([self._match(c) for c in condition]))
+            elif key == "$or":
+                parts.append(self._union([self._match(c) for c in condition]))
+            elif key.startswith("$"):
+                raise ValueError(f"Unsupported filter operator: {key}")
+            else:
+                parts.append(self._match_field(key, condition))
+        return self._intersect(parts)
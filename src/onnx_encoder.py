@@ -0,0 +1,156 @@
+"""
+ONNX Runtime 向量化后端
+把 BGE 模型导出为 ONNX（可选动态 int8 量化），在 CPU 上用 ONNX Runtime 推理，
+对外提供与 FlagModel 相同的 encode / encode_queries / tokenizer 接口，
+输出与 FlagModel 一致：取 [CLS] 向量并做 L2 归一化
+"""
+from pathlib import Path
+from typing import List, Union
+
+import numpy as np
+from loguru import logger
+
+_MODEL_FILE = "model.onnx"
+_QUANTIZED_MODEL_FILE = "model.int8.onnx"
+
+
+def export_onnx_model(model_name: str, output_dir: Union[str, Path], quantize: bool = False) -> Path:
+    """
+    导出 ONNX 模型及分词器（已存在时直接复用）
+
+    导出需要 torch 和 transformers，量化需要 onnxruntime；推理时只需要 onnxruntime 和分词器
+
+    Args:
+        model_name: Hugging Face 模型名或本地路径
+        output_dir: 输出目录
+        quantize: 是否额外生成动态 int8 量化模型
+
+    Returns:
+        推理要使用的 ONNX 文件路径
+    """
+    output_dir = Path(output_dir)
+    model_path = output_dir / _MODEL_FILE
+    quantized_path = output_dir / _QUANTIZED_MODEL_FILE
+
+    if not model_path.exists():
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        logger.info(f"Exporting {model_name} to ONNX: {model_path}")
+        output_dir.mkdir(parents=True, exist_ok=True)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name)
+        model.config.return_dict = False
+        model.eval()
+
+        sample = tokenizer(["示例文本"], return_tensors="pt")
+        input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+        dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+        tmp_path = model_path.with_suffix(".onnx.tmp")
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                tuple(sample[name] for name in input_names),
+                str(tmp_path),
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic_axes,
+                opset_version=14,
+            )
+        tmp_path.replace(model_path)
+        tokenizer.save_pretrained(str(output_dir))
+        logger.info(f"ONNX export completed: {model_path}")
+
+    if not quantize:
+        return model_path
+
+    if not quantized_path.exists():
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        logger.info(f"Quantizing ONNX model to int8: {quantized_path}")
+        tmp_path = quantized_path.with_suffix(".onnx.tmp")
+        quantize_dynamic(str(model_path), str(tmp_path), weight_type=QuantType.QInt8)
+        tmp_path.replace(quantized_path)
+    return quantized_path
+
+
+class ONNXEncoder:
+    """基于 ONNX Runtime 的 BGE 编码器，接口与 FlagModel 兼容"""
+
+    def __init__(
+        self,
+        model_name: str,
+        onnx_dir: Union[str, Path],
+        quantize: bool = False,
+        intra_op_threads: int = 0,
+        query_instruction_for_retrieval: str = "",
+        max_length: int = 512,
+    ):
+        """
+        导出（首次）并加载 ONNX 模型
+
+        Args:
+            model_name: Hugging Face 模型名或本地路径
+            onnx_dir: ONNX 模型及分词器的存放目录
+            quantize: 是否使用动态 int8 量化模型
+            intra_op_threads: 单个算子内部的线程数，0 表示由 ONNX Runtime 自行决定
+            query_instruction_for_retrieval: 查询前缀指令，与 FlagModel 的同名参数一致
+            max_length: 最大 token 数，超出部分截断
+        """
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError(
+                "ONNX backend requires onnxruntime: pip install onnxruntime"
+            ) from e
+        from transformers import AutoTokenizer
+
+        model_path = export_onnx_model(model_name, onnx_dir, quantize=quantize)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads > 0:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(
+            str(model_path), sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {node.name for node in self.session.get_inputs()}
+
+        self.tokenizer = AutoTokenizer.from_pretrained(str(onnx_dir))
+        self.query_instruction_for_retrieval = query_instruction_for_retrieval
+        self.max_length = max_length
+        logger.info(f"ONNX encoder loaded: {model_path} (intra-op threads: {intra_op_threads or 'auto'})")
+
+    def encode(self, sentences: List[str], batch_size: int = 256) -> np.ndarray:
+        """
+        编码文本
+
+        Args:
+            sentences: 文本列表
+            batch_size: 单次推理的文本数
+
+        Returns:
+            L2 归一化后的 float32 向量，形状为 (n, embedding_dim)
+        """
+        batches = []
+        for start in range(0, len(sentences), batch_size):
+            inputs = self.tokenizer(
+                sentences[start : start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="np",
+            )
+            feed = {name: value.astype(np.int64) for name, value in inputs.items() if name in self._input_names}
+            last_hidden_state = self.session.run(["last_hidden_state"], feed)[0]
+            batches.append(last_hidden_state[:, 0])
+
+        embeddings = np.concatenate(batches).astype(np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings
+
+    def encode_queries(self, queries: List[str], batch_size: int = 256) -> np.ndarray:
+        """编码查询：在每条查询前加上检索指令后编码"""
+        return self.encode([self.query_instruction_for_retrieval + query for query in queries], batch_size)
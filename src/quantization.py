@@ -0,0 +1,335 @@
+"""
+向量量化索引
+用压缩编码代替 float32 向量参与检索打分，降低 MemoryKBHandler 的常驻内存
+
+- ScalarQuantizedIndex：逐维 int8 标量量化，每个向量 dim 字节（float32 的 1/4）
+- ProductQuantizedIndex：乘积量化（PQ），每个向量 n_subvectors 字节，
+  查询时用非对称距离计算（ADC）查表打分
+
+两者都支持对量化打分的前 rerank 个候选，用原始 float 向量重新精确打分。
+配合 MemoryKBHandler(vector_storage="disk")，float 向量只保存在磁盘映射文件中，
+扫描时只访问压缩编码，重排时只读取少量候选行。
+检索只扫描传入矩阵范围内的行，知识库可以在检索进行时为尚未发布的新行编码
+"""
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from src.vector_utils import top_k_indices
+
+# 分块扫描编码时每块的行数，控制临时 float 矩阵大小
+_SCAN_BLOCK = 65536
+
+
+def _kmeans(vectors: np.ndarray, k: int, n_iter: int, rng: np.random.Generator) -> np.ndarray:
+    """欧氏距离 k-means，返回 (k, dim) 的聚类中心"""
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(n_iter):
+        # argmin ||x - c||^2 = argmax (x·c - ||c||^2 / 2)
+        assign = np.argmax(vectors @ centroids.T - 0.5 * np.sum(centroids**2, axis=1), axis=1)
+        counts = np.bincount(assign, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        nonempty = counts > 0
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+        # 空聚类重新随机初始化
+        empty = np.flatnonzero(~nonempty)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+    return centroids
+
+
+class _QuantizedIndex(ABC):
+    """量化索引的公共逻辑：编码存储、分块扫描、墓碑过滤与 float 重排"""
+
+    def __init__(self, rerank: int, min_train_points: int, max_train_points: int, seed: int):
+        self.rerank = rerank
+        self.min_train_points = min_train_points
+        self.max_train_points = max_train_points
+        self.seed = seed
+        self.reset()
+
+    @property
+    def is_trained(self) -> bool:
+        """索引是否已训练并可用于检索"""
+        return self._trained
+
+    @property
+    def code_size(self) -> int:
+        """每个向量编码占用的字节数"""
+        return self._codes.shape[1] if self._codes.ndim == 2 else 0
+
+    def reset(self) -> None:
+        """清空编码和训练结果"""
+        self._trained = False
+        self._codes = np.empty((0, 0), dtype=np.uint8)
+        self._size = 0
+
+    @abstractmethod
+    def _train(self, vectors: np.ndarray) -> None:
+        """用采样向量训练量化参数"""
+
+    @abstractmethod
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        """把 float 向量编码为 (n, code_size) 的 uint8 编码"""
+
+    @abstractmethod
+    def _score_block(self, codes: np.ndarray, query_state) -> np.ndarray:
+        """对一块编码计算与查询的近似相似度"""
+
+    @abstractmethod
+    def _prepare_query(self, query: np.ndarray):
+        """预处理查询向量，返回传给 _score_block 的查询状态"""
+
+    @abstractmethod
+    def state(self, live_rows: np.ndarray, matrix: np.ndarray) -> Dict[str, np.ndarray]:
+        """导出存活行的编码和训练结果，用于写入快照"""
+
+    @abstractmethod
+    def load_state(self, state: Dict[str, np.ndarray]) -> bool:
+        """从快照恢复编码和训练结果，成功返回 True"""
+
+    def add(self, rows: np.ndarray, matrix: np.ndarray) -> None:
+        """
+        编码新增的行
+
+        尚未训练时，若向量数已达到 min_train_points，则先训练再编码全部已有向量
+
+        Args:
+            rows: 新增行的行号（紧接在已有编码之后）
+            matrix: 知识库的完整向量矩阵（已归一化）
+        """
+        if not self._trained:
+            if len(matrix) < self.min_train_points:
+                return
+            rng = np.random.default_rng(self.seed)
+            sample = matrix
+            if len(matrix) > self.max_train_points:
+                sample = matrix[np.sort(rng.choice(len(matrix), self.max_train_points, replace=False))]
+            self._train(np.ascontiguousarray(sample, dtype=np.float32))
+            self._trained = True
+            rows = np.arange(len(matrix))
+
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return
+
+        end = int(rows[-1]) + 1
+        codes = self._encode(np.asarray(matrix[rows], dtype=np.float32))
+        if end > len(self._codes):
+            grown = np.zeros((max(end, 2 * len(self._codes)), codes.shape[1]), dtype=np.uint8)
+            if self._size:
+                grown[: self._size] = self._codes[: self._size]
+            self._codes = grown
+        self._codes[rows] = codes
+        self._size = max(self._size, end)
+
+    def search(
+        self,
+        query: np.ndarray,
+        matrix: np.ndarray,
+        k: int,
+        deleted: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        用量化编码打分检索，可选对前 rerank 个候选做 float 精确重排
+
+        Args:
+            query: 已归一化的查询向量
+            matrix: 知识库的完整向量矩阵（仅重排时读取候选行）
+            k: 返回的结果数量
+            deleted: 墓碑掩码（可选）
+
+        Returns:
+            (行号数组, 相似度数组)，按相似度降序；未重排时相似度为量化近似值
+        """
+        query_state = self._prepare_query(query)
+        # 编码数组可能在写入时被替换为扩容后的副本，先取出引用；只扫描对检索可见的行
+        codes = self._codes
+        n = min(self._size, len(matrix), len(codes))
+        scores = np.empty(n, dtype=np.float32)
+        for start in range(0, n, _SCAN_BLOCK):
+            end = min(start + _SCAN_BLOCK, n)
+            scores[start:end] = self._score_block(codes[start:end], query_state)
+
+        if deleted is not None:
+            scores[deleted[:n]] = -np.inf
+
+        n_candidates = max(k, self.rerank)
+        candidates = top_k_indices(scores, n_candidates)
+        candidates = candidates[np.isfinite(scores[candidates])]
+
+        if self.rerank > 0:
+            # 按行号顺序读取候选，对磁盘映射的矩阵更友好
+            candidates = np.sort(candidates)
+            exact = np.asarray(matrix[candidates], dtype=np.float32) @ query
+            top = top_k_indices(exact, k)
+            return candidates[top], exact[top]
+
+        candidates = candidates[:k]
+        return candidates, scores[candidates]
+
+    def remap(self, live_rows: np.ndarray, matrix: np.ndarray) -> None:
+        """
+        知识库回收墓碑行后重排行号：新行号 i 对应旧行号 live_rows[i]
+
+        Args:
+            live_rows: 保留下来的旧行号（升序）
+            matrix: 回收后的向量矩阵（不使用）
+        """
+        if not self._trained:
+            return
+        self._codes = self._codes[live_rows].copy()
+        self._size = len(live_rows)
+
+
+class ScalarQuantizedIndex(_QuantizedIndex):
+    """逐维 int8 标量量化索引"""
+
+    def __init__(
+        self,
+        rerank: int = 0,
+        min_train_points: int = 1000,
+        max_train_points: int = 100_000,
+        seed: int = 0,
+    ):
+        """
+        初始化标量量化索引
+
+        Args:
+            rerank: 用 float 向量重排的候选数量，0 表示不重排
+            min_train_points: 向量数达到该值才训练量化范围，之前由知识库暴力检索
+            max_train_points: 训练采样的最大向量数
+            seed: 随机种子
+        """
+        super().__init__(rerank, min_train_points, max_train_points, seed)
+
+    def reset(self) -> None:
+        super().reset()
+        self._vmin: Optional[np.ndarray] = None
+        self._scale: Optional[np.ndarray] = None
+
+    def _train(self, vectors: np.ndarray) -> None:
+        """按维度统计取值范围，映射到 0-255"""
+        logger.info(f"Training scalar quantizer on {len(vectors)} points")
+        self._vmin = vectors.min(axis=0)
+        self._scale = np.maximum(vectors.max(axis=0) - self._vmin, 1e-12) / 255.0
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint((vectors - self._vmin) / self._scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def _prepare_query(self, query: np.ndarray):
+        # q·x ≈ q·vmin + (q * scale)·code
+        return float(query @ self._vmin), (query * self._scale).astype(np.float32)
+
+    def _score_block(self, codes: np.ndarray, query_state) -> np.ndarray:
+        offset, weights = query_state
+        return codes.astype(np.float32) @ weights + offset
+
+    def state(self, live_rows: np.ndarray, matrix: np.ndarray) -> Dict[str, np.ndarray]:
+        """导出与快照对齐的量化参数和编码"""
+        if not self._trained:
+            return {}
+        return {"sq8_vmin": self._vmin, "sq8_scale": self._scale, "sq8_codes": self._codes[live_rows]}
+
+    def load_state(self, state: Dict[str, np.ndarray]) -> bool:
+        """从快照恢复，返回快照中是否包含 int8 量化状态"""
+        if "sq8_codes" not in state:
+            return False
+        self._vmin = np.asarray(state["sq8_vmin"], dtype=np.float32)
+        self._scale = np.asarray(state["sq8_scale"], dtype=np.float32)
+        self._codes = np.array(state["sq8_codes"], dtype=np.uint8)
+        self._size = len(self._codes)
+        self._trained = True
+        return True
+
+
+class ProductQuantizedIndex(_QuantizedIndex):
+    """乘积量化（PQ）索引，查询时使用非对称距离计算（ADC）"""
+
+    def __init__(
+        self,
+        n_subvectors: Optional[int] = None,
+        rerank: int = 0,
+        n_iter: int = 15,
+        min_train_points: int = 10_000,
+        max_train_points: int = 65_536,
+        seed: int = 0,
+    ):
+        """
+        初始化 PQ 索引
+
+        Args:
+            n_subvectors: 子空间数量（每个向量的编码字节数），须整除向量维度；
+                默认每 4 维一个子空间，即 float32 的 1/16
+            rerank: 用 float 向量重排的候选数量，0 表示不重排
+            n_iter: 每个子空间 k-means 的迭代次数
+            min_train_points: 向量数达到该值才训练码本，之前由知识库暴力检索
+            max_train_points: 训练采样的最大向量数
+            seed: 随机种子
+        """
+        self.n_subvectors = n_subvectors
+        self.n_iter = n_iter
+        super().__init__(rerank, min_train_points, max_train_points, seed)
+
+    def reset(self) -> None:
+        super().reset()
+        self._codebooks: Optional[np.ndarray] = None  # (n_subvectors, 256, sub_dim)
+
+    def _train(self, vectors: np.ndarray) -> None:
+        """在每个子空间上训练 256 个中心的码本"""
+        dim = vectors.shape[1]
+        m = self.n_subvectors or dim // 4
+        if dim % m != 0:
+            raise ValueError(f"Embedding dimension {dim} is not divisible by n_subvectors={m}")
+
+        logger.info(f"Training PQ codebooks: {len(vectors)} points, {m} subvectors")
+        rng = np.random.default_rng(self.seed)
+        sub_dim = dim // m
+        codebooks = np.zeros((m, 256, sub_dim), dtype=np.float32)
+        for j in range(m):
+            sub = vectors[:, j * sub_dim : (j + 1) * sub_dim]
+            centroids = _kmeans(sub, 256, self.n_iter, rng)
+            codebooks[j, : len(centroids)] = centroids
+        self._codebooks = codebooks
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        m, _, sub_dim = self._codebooks.shape
+        codes = np.empty((len(vectors), m), dtype=np.uint8)
+        for j in range(m):
+            sub = vectors[:, j * sub_dim : (j + 1) * sub_dim]
+            book = self._codebooks[j]
+            codes[:, j] = np.argmax(sub @ book.T - 0.5 * np.sum(book**2, axis=1), axis=1)
+        return codes
+
+    def _prepare_query(self, query: np.ndarray):
+        # ADC 查找表：table[j, c] = 查询第 j 段与第 j 个码本中心 c 的内积
+        m, _, sub_dim = self._codebooks.shape
+        return np.einsum("jcd,jd->jc", self._codebooks, query.reshape(m, sub_dim))
+
+    def _score_block(self, codes: np.ndarray, table: np.ndarray) -> np.ndarray:
+        # 逐子空间查表累加，比一次性二维花式索引少一次 (n, m) 临时数组
+        scores = np.zeros(len(codes), dtype=np.float32)
+        for j in range(table.shape[0]):
+            scores += table[j].take(codes[:, j])
+        return scores
+
+    def state(self, live_rows: np.ndarray, matrix: np.ndarray) -> Dict[str, np.ndarray]:
+        """导出与快照对齐的码本和编码"""
+        if not self._trained:
+            return {}
+        return {"pq_codebooks": self._codebooks, "pq_codes": self._codes[live_rows]}
+
+    def load_state(self, state: Dict[str, np.ndarray]) -> bool:
+        """从快照恢复，返回快照中是否包含 PQ 状态"""
+        if "pq_codes" not in state:
+            return False
+        self._codebooks = np.asarray(state["pq_codebooks"], dtype=np.float32)
+        self._codes = np.array(state["pq_codes"], dtype=np.uint8)
+        self._size = len(self._codes)
+        self._trained = True
+        return True
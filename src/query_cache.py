@@ -0,0 +1,84 @@
+"""
+查询向量 LRU 缓存
+相同或只有空白 / 大小写 / 全半角差异的问题直接复用已计算的查询向量，跳过模型前向计算
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+
+from src.content_hash import normalize_text
+
+
+class QueryEmbeddingCache:
+    """线程安全的有界 LRU 缓存（可选 TTL），可在多个会话间共享"""
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 0):
+        """
+        Args:
+            max_size: 最多缓存的查询数量，超出时淘汰最久未使用的条目
+            ttl_seconds: 条目有效期（秒），0 表示不过期
+        """
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # 键 -> (写入时间, 向量)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(query: str) -> str:
+        """规范化查询文本作为缓存键"""
+        return normalize_text(query).lower()
+
+    def get(self, query: str) -> Optional[np.ndarray]:
+        """
+        查找查询向量
+
+        Returns:
+            命中时返回向量副本，否则返回 None
+        """
+        key = self.key(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl_seconds and time.monotonic() - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1].copy()
+
+    def put(self, query: str, embedding: np.ndarray) -> None:
+        """写入查询向量，超出容量时淘汰最久未使用的条目"""
+        key = self.key(query)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), np.array(embedding, copy=True))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """清空缓存（不重置计数）"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """返回 hits、misses、hit_rate 和当前条目数"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._entries),
+            }
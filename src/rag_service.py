@@ -116,6 +116,25 @@ class RAGService:
             logger.error(f"Error retrieving context: {str(e)}")
             return ""
 
+    def retrieve_many(self, queries: List[str], top_k: Optional[int] = None) -> List[Dict]:
+        """
+        批量检索多个查询的相关文档（用于离线评测和多问题场景）
+
+        Args:
+            queries: 查询文本列表
+            top_k: 每个查询返回的文档数量，默认使用服务的 top_k
+
+        Returns:
+            检索结果字典列表，与 queries 一一对应
+        """
+        try:
+            return self.chroma_handler.retrieve_many(
+                queries, top_k=self.top_k if top_k is None else top_k
+            )
+        except Exception as e:
+            logger.error(f"Error retrieving documents: {str(e)}")
+            raise
+
     def _build_enhanced_messages(
         self,
         user_query: str,
@@ -0,0 +1,595 @@
+"""
+分片多进程知识库处理器
+把向量按文档 ID 哈希分散到 N 个工作进程，每个进程持有一个 MemoryKBHandler 分片，
+突破单进程内存上限，并让各分片的矩阵打分在多个 CPU 核上并行执行
+
+协调进程负责向量化（模型只加载一份），查询向量广播到所有分片，
+各分片返回本地 top-k，由协调进程按距离归并为全局 top-k。
+接口与 MemoryKBHandler / ChromaHandler 一致，可直接作为 RAGService 的 chroma_handler
+"""
+import itertools
+import json
+import multiprocessing as mp
+import threading
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+from loguru import logger
+
+from src.content_hash import content_ids, partition_new
+from src.memory_kb_handler import MemoryKBHandler
+from src.stream_ingest import add_documents_stream
+
+# 持久化目录中记录分片数量的文件
+SHARDS_FILE = "shards.json"
+
+
+def _shard_worker(
+    conn,
+    persist_directory: Optional[str],
+    vector_storage: str,
+    threads: int,
+    index_factory: Optional[Callable[[], object]],
+    lexical_index_factory: Optional[Callable[[], object]],
+    wal_compact_bytes: int,
+) -> None:
+    """
+    分片工作进程主循环
+
+    检索索引和稀疏词项索引由工厂函数在本进程内创建，各分片在自己的数据上训练 / 建图。
+    接收 (请求 ID, 方法名, 位置参数, 关键字参数)，交给线程池在本分片的 MemoryKBHandler 上执行，
+    完成后回传 (请求 ID, "ok", 返回值) 或 (请求 ID, "error", 错误信息)。
+    多个请求可以同时执行（MemoryKBHandler 自身是线程安全的），回复顺序与请求顺序无关；
+    收到 None 时等待在途请求完成，关闭分片并退出
+    """
+    kb = MemoryKBHandler(
+        None,
+        persist_directory=persist_directory,
+        wal_compact_bytes=wal_compact_bytes,
+        index=index_factory() if index_factory is not None else None,
+        vector_storage=vector_storage,
+        lexical_index=lexical_index_factory() if lexical_index_factory is not None else None,
+    )
+    send_lock = threading.Lock()
+
+    def handle(request_id: int, method: str, args: tuple, kwargs: dict) -> None:
+        try:
+            reply = (request_id, "ok", getattr(kb, method)(*args, **kwargs))
+        except Exception as e:
+            reply = (request_id, "error", f"{type(e).__name__}: {e}")
+        with send_lock:
+            try:
+                conn.send(reply)
+            except (BrokenPipeError, OSError):
+                pass
+            except Exception as e:
+                # 返回值无法序列化时（send 先序列化再写入，管道中不会留下半条消息）回传错误
+                conn.send((request_id, "error", f"{type(e).__name__}: {e}"))
+
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="kb-shard") as executor:
+        while True:
+            try:
+                request = conn.recv()
+            except EOFError:
+                request = None
+            if request is None:
+                break
+            executor.submit(handle, *request)
+    kb.close()
+    conn.close()
+
+
+class ShardedKBHandler:
+    """分片多进程知识库处理器"""
+
+    def __init__(
+        self,
+        embedding_handler,
+        n_shards: int = 4,
+        persist_directory: Optional[Union[str, Path]] = None,
+        vector_storage: str = "memory",
+        shard_threads: int = 4,
+        index_factory: Optional[Callable[[], object]] = None,
+        lexical_index_factory: Optional[Callable[[], object]] = None,
+        wal_compact_bytes: int = 64 * 1024 * 1024,
+    ):
+        """
+        初始化分片知识库并启动工作进程
+
+        Args:
+            embedding_handler: BGE 向量化处理器（只在协调进程中使用）
+            n_shards: 分片（工作进程）数量
+            persist_directory: 持久化目录（可选）。每个分片使用其中的
+                shard-XX 子目录保存自己的快照 + WAL；分片数量不可在已有数据上更改
+            vector_storage: 分片向量矩阵的存放位置，"memory" 或 "disk"（内存映射文件）
+            shard_threads: 每个分片同时执行的请求数，互不相关的检索 / 写入可以在同一分片上重叠
+            index_factory: 创建近似最近邻索引的工厂（可选），如 functools.partial(IVFIndex, nlist=256)。
+                在每个分片进程内调用一次，必须可以被 pickle（模块级函数、类或 partial）
+            lexical_index_factory: 创建稀疏词项索引的工厂（可选），如 BM25Index。
+                提供时各分片在本地做混合检索，协调进程按各分片的融合名次归并
+            wal_compact_bytes: 每个分片的 WAL 超过该大小时在后台折叠为新快照
+        """
+        if n_shards < 1:
+            raise ValueError("n_shards must be at least 1")
+        if shard_threads < 1:
+            raise ValueError("shard_threads must be at least 1")
+
+        self.embedding_handler = embedding_handler
+        self.n_shards = n_shards
+        self.hybrid = lexical_index_factory is not None
+        self.persist_directory = Path(persist_directory) if persist_directory else None
+        self._request_ids = itertools.count()
+        self._closed = False
+
+        shard_dirs: List[Optional[str]] = [None] * n_shards
+        if self.persist_directory is not None:
+            self._check_layout()
+            shard_dirs = [
+                str(self.persist_directory / f"shard-{i:02d}") for i in range(n_shards)
+            ]
+
+        # 使用 spawn 启动，避免 fork 继承协调进程中的模型和线程状态
+        context = mp.get_context("spawn")
+        self._conns = []
+        self._processes = []
+        # 每个分片一把发送锁和一个待回复表，由该分片的读线程按请求 ID 把回复交给对应的 Future
+        self._send_locks = [threading.Lock() for _ in range(n_shards)]
+        self._pending: List[Dict[int, Future]] = [{} for _ in range(n_shards)]
+        self._readers = []
+        for i in range(n_shards):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(
+                target=_shard_worker,
+                args=(
+                    child_conn,
+                    shard_dirs[i],
+                    vector_storage,
+                    shard_threads,
+                    index_factory,
+                    lexical_index_factory,
+                    wal_compact_bytes,
+                ),
+                name=f"kb-shard-{i}",
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._processes.append(process)
+
+            reader = threading.Thread(
+                target=self._read_replies, args=(i,), name=f"kb-shard-{i}-reader", daemon=True
+            )
+            reader.start()
+            self._readers.append(reader)
+
+        logger.info(f"Sharded KB Handler initialized with {n_shards} shards")
+
+    def _check_layout(self) -> None:
+        """确认持久化目录中的分片数量与当前配置一致（路由依赖分片数量）"""
+        self.persist_directory.mkdir(parents=True, exist_ok=True)
+        layout_file = self.persist_directory / SHARDS_FILE
+        if layout_file.exists():
+            with open(layout_file, "r", encoding="utf-8") as f:
+                stored = json.load(f)["n_shards"]
+            if stored != self.n_shards:
+                raise ValueError(
+                    f"{self.persist_directory} was created with {stored} shards, got n_shards={self.n_shards}"
+                )
+        else:
+            with open(layout_file, "w", encoding="utf-8") as f:
+                json.dump({"n_shards": self.n_shards}, f)
+
+    def _shard_of(self, doc_id: str) -> int:
+        """按文档 ID 路由到分片（crc32 在进程重启后保持稳定）"""
+        return zlib.crc32(doc_id.encode("utf-8")) % self.n_shards
+
+    def _read_replies(self, shard: int) -> None:
+        """分片读线程：按请求 ID 把回复交给等待中的 Future；连接断开时让所有在途请求失败"""
+        conn = self._conns[shard]
+        pending = self._pending[shard]
+        while True:
+            try:
+                request_id, status, value = conn.recv()
+            except (EOFError, OSError):
+                break
+            future = pending.pop(request_id, None)
+            if future is None:
+                continue
+            if status == "ok":
+                future.set_result(value)
+            else:
+                future.set_exception(RuntimeError(f"Shard {shard} failed: {value}"))
+
+        if not self._closed:
+            logger.error(f"Shard {shard} connection lost")
+        for request_id in list(pending):
+            future = pending.pop(request_id, None)
+            if future is not None:
+                future.set_exception(RuntimeError(f"Shard {shard} connection lost"))
+
+    def _submit(self, shard: int, request: tuple) -> Future:
+        """向分片发送一个请求，返回等待其回复的 Future"""
+        request_id = next(self._request_ids)
+        future = Future()
+        self._pending[shard][request_id] = future
+        try:
+            with self._send_locks[shard]:
+                self._conns[shard].send((request_id, *request))
+        except Exception:
+            self._pending[shard].pop(request_id, None)
+            raise
+        return future
+
+    def _call(self, requests: Dict[int, tuple]) -> Dict[int, object]:
+        """
+        向若干分片并行发送请求并等待全部返回
+
+        各分片的连接按请求 ID 复用，不同线程的请求可以在同一分片上同时执行
+
+        Args:
+            requests: 分片编号 -> (方法名, 位置参数, 关键字参数)
+
+        Returns:
+            分片编号 -> 返回值
+        """
+        if self._closed:
+            raise RuntimeError("Sharded KB handler is closed")
+
+        futures = {shard: self._submit(shard, request) for shard, request in requests.items()}
+        return {shard: future.result() for shard, future in futures.items()}
+
+    def _broadcast(self, method: str, *args, **kwargs) -> List:
+        """在所有分片上执行同一方法，按分片编号返回结果列表"""
+        results = self._call({i: (method, args, kwargs) for i in range(self.n_shards)})
+        return [results[i] for i in range(self.n_shards)]
+
+    def add_documents(
+        self,
+        documents: List[str],
+        metadata: Optional[List[Dict]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> None:
+        """
+        添加文档到知识库
+
+        Args:
+            documents: 文档内容列表
+            metadata: 元数据列表（可选）
+            ids: 文档 ID 列表（可选）。不提供时使用内容哈希作为 ID，
+                知识库中已有的内容直接跳过，不再向量化，其元数据记为该分块的其他来源
+        """
+        if not documents:
+            raise ValueError("Documents list cannot be empty")
+
+        if metadata is None:
+            metadata = [{} for _ in documents]
+
+        try:
+            shared_meta, shared_ids = [], []
+            if ids is None:
+                total = len(documents)
+                ids = content_ids(documents)
+                documents, metadata, ids, shared_meta, shared_ids = partition_new(
+                    documents, metadata, ids, self.get_existing_ids(ids)
+                )
+                if len(documents) < total:
+                    logger.info(f"Skipping {total - len(documents)} chunks already in the knowledge base")
+
+            if documents:
+                logger.info(f"Adding {len(documents)} documents to sharded KB")
+                embeddings = self.embedding_handler.embed_texts(documents)
+                self.add_embeddings(embeddings, documents, metadata, ids)
+                logger.info(f"Successfully added {len(documents)} documents")
+            if shared_ids:
+                self.add_references(shared_ids, shared_meta)
+
+        except Exception as e:
+            logger.error(f"Error adding documents: {str(e)}")
+            raise
+
+    def add_embeddings(
+        self,
+        embeddings: np.ndarray,
+        documents: List[str],
+        metadata: Optional[List[Dict]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> None:
+        """
+        添加已向量化的文档，按 ID 分组后并行写入各分片
+
+        Args:
+            embeddings: 文档向量，形状为 (n_docs, embedding_dim)
+            documents: 文档内容列表
+            metadata: 元数据列表（可选）
+            ids: 文档 ID 列表（可选），不提供时使用内容哈希
+        """
+        if not documents:
+            raise ValueError("Documents list cannot be empty")
+
+        if metadata is None:
+            metadata = [{} for _ in documents]
+        if ids is None:
+            ids = content_ids(documents)
+
+        groups: Dict[int, List[int]] = {}
+        for i, doc_id in enumerate(ids):
+            groups.setdefault(self._shard_of(doc_id), []).append(i)
+
+        self._call(
+            {
+                shard: (
+                    "add_embeddings",
+                    (
+                        embeddings[rows],
+                        [documents[i] for i in rows],
+                        [metadata[i] for i in rows],
+                        [ids[i] for i in rows],
+                    ),
+                    {},
+                )
+                for shard, rows in groups.items()
+            }
+        )
+
+    def add_documents_stream(
+        self,
+        documents: Iterable[str],
+        metadata: Optional[Iterable[Dict]] = None,
+        batch_size: int = 256,
+        embedder=None,
+        progress_callback: Optional[Callable[[int], None]] = None,
+    ) -> int:
+        """
+        流式添加文档：逐批去重、向量化并写入，峰值内存与 batch_size 成正比
+
+        Args:
+            documents: 文档内容的可迭代对象（可以是生成器）
+            metadata: 与 documents 对齐的元数据可迭代对象（可选）
+            batch_size: 每批文档数
+            embedder: 提供 embed_stream 的向量化器（可选），默认使用 embedding_handler，
+                也可传入 EmbeddingPool 使用多进程向量化
+            progress_callback: 每写入一批后以已处理的文档数调用（可选）
+
+        Returns:
+            实际写入的文档数（知识库中已有的内容被跳过）
+        """
+        try:
+            return add_documents_stream(
+                self,
+                embedder or self.embedding_handler,
+                documents,
+                metadata,
+                batch_size=batch_size,
+                progress_callback=progress_callback,
+            )
+        except Exception as e:
+            logger.error(f"Error adding documents: {str(e)}")
+            raise
+
+    def retrieve(
+        self,
+        query: str,
+        top_k: int = 5,
+        where: Optional[Dict] = None,
+    ) -> Dict:
+        """
+        检索相关文档
+
+        Args:
+            query: 查询文本
+            top_k: 返回最相关的 k 个文档
+            where: 元数据过滤条件（可选）
+
+        Returns:
+            包含检索结果的字典
+        """
+        if not query or not query.strip():
+            raise ValueError("Query cannot be empty")
+
+        return self.retrieve_many([query], top_k=top_k, where=where)[0]
+
+    def retrieve_many(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        where: Optional[Dict] = None,
+    ) -> List[Dict]:
+        """
+        批量检索相关文档
+
+        查询向量在协调进程中一次性计算后广播给所有分片，各分片返回本地 top-k
+
+        Args:
+            queries: 查询文本列表
+            top_k: 每个查询返回最相关的 k 个文档
+            where: 元数据过滤条件（可选），对所有查询生效
+
+        Returns:
+            检索结果字典列表，与 queries 一一对应，格式同 retrieve()
+        """
+        if not queries:
+            return []
+
+        if any(not query or not query.strip() for query in queries):
+            raise ValueError("Query cannot be empty")
+
+        try:
+            logger.debug(f"Retrieving top {top_k} documents for {len(queries)} queries")
+
+            query_embeddings = np.asarray(
+                self.embedding_handler.embed_queries(queries), dtype=np.float32
+            )
+            shard_results = self._broadcast(
+                "retrieve_by_embeddings",
+                query_embeddings,
+                top_k,
+                where,
+                queries if self.hybrid else None,
+            )
+
+            return [
+                self._merge([results[q] for results in shard_results], top_k)
+                for q in range(len(queries))
+            ]
+
+        except Exception as e:
+            logger.error(f"Error retrieving documents: {str(e)}")
+            raise
+
+    def _merge(self, partials: List[Dict], top_k: int) -> Dict:
+        """
+        把各分片的本地 top-k 归并为全局 top-k
+
+        纯稠密检索按距离归并；混合检索时分片结果已按本地融合名次排序、距离不再单调，
+        按本地名次归并（文档按 ID 哈希均匀分布，各分片的名次可比），同名次按距离
+        """
+        candidates = [
+            (i if self.hybrid else 0, distance, part["ids"][i], part["documents"][i], part["metadatas"][i])
+            for part in partials
+            for i, distance in enumerate(part["distances"])
+        ]
+        candidates.sort(key=lambda item: (item[0], item[1]))
+        candidates = candidates[:top_k]
+        return {
+            "ids": [item[2] for item in candidates],
+            "documents": [item[3] for item in candidates],
+            "metadatas": [item[4] for item in candidates],
+            "distances": [item[1] for item in candidates],
+        }
+
+    def delete_document(self, doc_id: str) -> None:
+        """
+        删除指定的文档
+
+        Args:
+            doc_id: 文档 ID
+        """
+        try:
+            shard = self._shard_of(doc_id)
+            self._call({shard: ("delete_document", (doc_id,), {})})
+        except Exception as e:
+            logger.error(f"Error deleting document: {str(e)}")
+            raise
+
+    def delete_documents(self, doc_ids: List[str]) -> int:
+        """
+        批量删除文档，按 ID 分组后并行在各分片上删除
+
+        Returns:
+            删除的文档数量
+        """
+        groups: Dict[int, List[str]] = {}
+        for doc_id in doc_ids:
+            groups.setdefault(self._shard_of(doc_id), []).append(doc_id)
+        try:
+            results = self._call(
+                {shard: ("delete_documents", (group,), {}) for shard, group in groups.items()}
+            )
+            return sum(results.values())
+        except Exception as e:
+            logger.error(f"Error deleting documents: {str(e)}")
+            raise
+
+    def add_references(self, doc_ids: List[str], metadata: List[Dict]) -> int:
+        """
+        为已入库的分块记录其他来源的元数据，按 ID 分组后并行在各分片上执行
+
+        Returns:
+            元数据被更新的文档数量
+        """
+        groups: Dict[int, Tuple[List[str], List[Dict]]] = {}
+        for doc_id, meta in zip(doc_ids, metadata):
+            group = groups.setdefault(self._shard_of(doc_id), ([], []))
+            group[0].append(doc_id)
+            group[1].append(meta)
+        try:
+            results = self._call(
+                {shard: ("add_references", group, {}) for shard, group in groups.items()}
+            )
+            return sum(results.values())
+        except Exception as e:
+            logger.error(f"Error adding references: {str(e)}")
+            raise
+
+    def remove_references(self, doc_ids: List[str], **filters) -> int:
+        """
+        从指定文档中去掉匹配过滤条件的引用（不删除文档），按 ID 分组后并行在各分片上执行
+
+        Returns:
+            元数据被更新的文档数量
+        """
+        groups: Dict[int, List[str]] = {}
+        for doc_id in doc_ids:
+            groups.setdefault(self._shard_of(doc_id), []).append(doc_id)
+        try:
+            results = self._call(
+                {shard: ("remove_references", (group,), filters) for shard, group in groups.items()}
+            )
+            return sum(results.values())
+        except Exception as e:
+            logger.error(f"Error removing references: {str(e)}")
+            raise
+
+    def delete_where(self, **filters) -> int:
+        """
+        删除元数据匹配全部过滤条件的文档（共用分块只去掉匹配的引用）
+
+        Returns:
+            删除的文档数量
+        """
+        try:
+            return sum(self._broadcast("delete_where", **filters))
+        except Exception as e:
+            logger.error(f"Error deleting documents: {str(e)}")
+            raise
+
+    def clear_collection(self) -> None:
+        """清空整个知识库"""
+        try:
+            logger.warning("Clearing entire sharded knowledge base")
+            self._broadcast("clear_collection")
+        except Exception as e:
+            logger.error(f"Error clearing knowledge base: {str(e)}")
+            raise
+
+    def get_existing_ids(self, ids: List[str]) -> List[str]:
+        """返回 ids 中已在知识库里的 ID"""
+        groups: Dict[int, List[str]] = {}
+        for doc_id in ids:
+            groups.setdefault(self._shard_of(doc_id), []).append(doc_id)
+        results = self._call(
+            {shard: ("get_existing_ids", (group,), {}) for shard, group in groups.items()}
+        )
+        return [doc_id for found in results.values() for doc_id in found]
+
+    def get_document_count(self) -> int:
+        """获取知识库中的文档数量"""
+        return sum(self._broadcast("get_document_count"))
+
+    def get_all_documents(self) -> Dict:
+        """获取知识库中的所有文档"""
+        merged = {"ids": [], "documents": [], "metadatas": []}
+        for part in self._broadcast("get_all_documents"):
+            for key in merged:
+                merged[key].extend(part[key])
+        return merged
+
+    def close(self) -> None:
+        """通知所有分片等待在途请求完成、关闭 WAL 并退出"""
+        self._closed = True
+        for conn, send_lock in zip(self._conns, self._send_locks):
+            with send_lock:
+                try:
+                    conn.send(None)
+                except (BrokenPipeError, OSError):
+                    pass
+        for process in self._processes:
+            process.join(timeout=10)
+        for reader in self._readers:
+            reader.join(timeout=10)
+        for conn in self._conns:
+            conn.close()
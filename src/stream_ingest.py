@@ -0,0 +1,100 @@
+"""
+流式入库
+文档按批读取、去重、向量化并写入知识库，任一时刻只持有少量批次的文本和向量，
+峰值内存与批大小成正比，与语料总量无关
+"""
+import itertools
+from collections import deque
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+from loguru import logger
+
+from src.content_hash import content_ids, partition_new
+
+
+def add_documents_stream(
+    kb_handler,
+    embedder,
+    documents: Iterable[str],
+    metadata: Optional[Iterable[Dict]] = None,
+    batch_size: int = 256,
+    progress_callback: Optional[Callable[[int], None]] = None,
+) -> int:
+    """
+    流式向量化文档并逐批写入知识库
+
+    文档以内容哈希为 ID：每读入一批先查询知识库，已入库或仍在途（已读入尚未写入）
+    的内容直接跳过，不再向量化，其元数据在该分块写入后交给 add_references 记为其他来源
+
+    Args:
+        kb_handler: 提供 get_existing_ids、add_embeddings 和 add_references 的知识库处理器
+        embedder: 提供 embed_stream(texts, batch_size) 的向量化器，
+            如 BGEEmbeddingHandler 或 EmbeddingPool
+        documents: 文档内容的可迭代对象（可以是生成器）
+        metadata: 与 documents 对齐的元数据可迭代对象（可选）
+        batch_size: 每批读取 / 向量化 / 写入的文档数
+        progress_callback: 每写入一批后以已处理的输入文档数调用（可选）
+
+    Returns:
+        实际写入的文档数
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    if metadata is None:
+        metadata = itertools.repeat({})
+
+    # 已交给 embedder 但尚未写入的 (元数据, ID, 输入序号)，embed_stream 按输入顺序返回
+    pending = deque()
+    in_flight = set()
+    # 跳过的共用分块 (ID, 元数据)，等对应分块写入后再记录引用
+    shared = []
+    seen = 0
+
+    def new_documents() -> Iterator[str]:
+        nonlocal seen
+        items = zip(documents, metadata)
+        while True:
+            chunk = list(itertools.islice(items, batch_size))
+            if not chunk:
+                return
+            start = seen
+            seen += len(chunk)
+
+            docs = [doc for doc, _ in chunk]
+            ids = content_ids(docs)
+            positions = {}
+            for doc_id, position in zip(ids, range(start, seen)):
+                positions.setdefault(doc_id, position)
+            existing = set(kb_handler.get_existing_ids(ids)) | in_flight
+            docs, metas, ids, shared_metas, shared_ids = partition_new(
+                docs, [dict(meta) for _, meta in chunk], ids, existing
+            )
+            shared.extend(zip(shared_ids, shared_metas))
+            for doc, meta, doc_id in zip(docs, metas, ids):
+                in_flight.add(doc_id)
+                pending.append((meta, doc_id, positions[doc_id]))
+                yield doc
+
+    def record_shared(final: bool = False) -> None:
+        ready = [item for item in shared if final or item[0] not in in_flight]
+        if not ready:
+            return
+        kb_handler.add_references([doc_id for doc_id, _ in ready], [meta for _, meta in ready])
+        shared[:] = [item for item in shared if not final and item[0] in in_flight]
+
+    added = 0
+    for docs, embeddings in embedder.embed_stream(new_documents(), batch_size):
+        items = [pending.popleft() for _ in docs]
+        ids = [doc_id for _, doc_id, _ in items]
+        kb_handler.add_embeddings(embeddings, docs, [meta for meta, _, _ in items], ids)
+        in_flight.difference_update(ids)
+        record_shared()
+        added += len(docs)
+        if progress_callback is not None:
+            progress_callback(items[-1][2] + 1)
+    record_shared(final=True)
+
+    if progress_callback is not None:
+        progress_callback(seen)
+    logger.info(f"Streaming ingestion added {added}/{seen} chunks ({seen - added} already present)")
+    return added
@@ -0,0 +1,28 @@
+"""
+向量计算工具函数
+供内存知识库及其近似最近邻索引共用
+"""
+import numpy as np
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """按行做 L2 归一化（零向量保持为零）"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    取相似度最高的 k 个下标（按相似度降序）
+
+    先用 argpartition 在 O(n) 内选出候选，再只对这 k 个候选排序
+    """
+    n = scores.shape[0]
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k >= n:
+        return np.argsort(-scores)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
@@ -0,0 +1,51 @@
+"""
+测试公共夹具
+提供不依赖 BGE 模型的确定性向量化处理器：同一段文本在任何进程中都得到相同的向量，
+查询与文档使用同一映射，检索文档原文时该文档应排在第一位
+"""
+import itertools
+import zlib
+from typing import Iterable, Iterator, List, Tuple
+
+import numpy as np
+import pytest
+
+
+class HashEmbeddingHandler:
+    """按文本 crc32 播种生成向量的向量化处理器，接口与 BGEEmbeddingHandler 一致"""
+
+    def __init__(self, dim: int = 32):
+        self.model_name = f"hash-{dim}"
+        self.dim = dim
+
+    def _vector(self, text: str) -> np.ndarray:
+        rng = np.random.default_rng(zlib.crc32(text.encode("utf-8")))
+        return rng.standard_normal(self.dim).astype(np.float32)
+
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        return np.stack([self._vector(text) for text in texts]).astype(np.float32)
+
+    def embed_query(self, query: str) -> np.ndarray:
+        return self._vector(query)
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        return self.embed_texts(queries)
+
+    def embed_stream(
+        self, texts: Iterable[str], batch_size: int = 256
+    ) -> Iterator[Tuple[List[str], np.ndarray]]:
+        iterator = iter(texts)
+        while True:
+            batch = list(itertools.islice(iterator, batch_size))
+            if not batch:
+                return
+            yield batch, self.embed_texts(batch)
+
+    def get_embedding_dim(self) -> int:
+        return self.dim
+
+
+@pytest.fixture
+def embedding_handler() -> HashEmbeddingHandler:
+    """确定性向量化处理器"""
+    return HashEmbeddingHandler()
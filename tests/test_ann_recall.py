@@ -0,0 +1,97 @@
+"""
+近似检索索引的召回率测试：与暴力精确检索的 top-k 结果对比
+"""
+import numpy as np
+import pytest
+
+from src.hnsw_index import HNSWIndex
+from src.ivf_index import IVFIndex
+from src.memory_kb_handler import MemoryKBHandler
+from src.quantization import ProductQuantizedIndex, ScalarQuantizedIndex, _QuantizedIndex
+
+N_DOCS = 2000
+DIM = 32
+TOP_K = 10
+
+INDEX_FACTORIES = {
+    "ivf": (lambda: IVFIndex(nlist=32, nprobe=8, min_train_points=500), 0.9),
+    "hnsw": (lambda: HNSWIndex(M=8, ef_construction=64, ef_search=100), 0.9),
+    "sq8": (lambda: ScalarQuantizedIndex(rerank=0, min_train_points=500), 0.9),
+    "sq8_rerank": (lambda: ScalarQuantizedIndex(rerank=50, min_train_points=500), 0.95),
+    "pq_rerank": (
+        lambda: ProductQuantizedIndex(n_subvectors=8, rerank=100, min_train_points=500),
+        0.9,
+    ),
+}
+
+
+def _clustered(n: int, seed: int) -> np.ndarray:
+    """围绕 40 个中心生成的向量，比均匀随机向量更接近真实语料的分布"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((40, DIM)).astype(np.float32)
+    return centers[rng.integers(0, 40, n)] + 0.3 * rng.standard_normal((n, DIM)).astype(np.float32)
+
+
+def _build(index) -> MemoryKBHandler:
+    kb = MemoryKBHandler(None, index=index)
+    vectors = _clustered(N_DOCS, seed=0)
+    ids = [f"doc{i}" for i in range(N_DOCS)]
+    # 分两批写入，第二批走增量添加路径
+    half = N_DOCS // 2
+    kb.add_embeddings(vectors[:half], ids[:half], ids=ids[:half])
+    kb.add_embeddings(vectors[half:], ids[half:], ids=ids[half:])
+    return kb
+
+
+def _recall(kb: MemoryKBHandler, exact: MemoryKBHandler, queries: np.ndarray) -> float:
+    approx_results = kb.retrieve_by_embeddings(queries, top_k=TOP_K)
+    exact_results = exact.retrieve_by_embeddings(queries, top_k=TOP_K)
+    hits = sum(
+        len(set(a["ids"]) & set(e["ids"])) for a, e in zip(approx_results, exact_results)
+    )
+    return hits / (len(queries) * TOP_K)
+
+
+@pytest.fixture(scope="module")
+def exact_kb() -> MemoryKBHandler:
+    return _build(None)
+
+
+@pytest.fixture(scope="module")
+def queries() -> np.ndarray:
+    return _clustered(100, seed=1)
+
+
+@pytest.mark.parametrize("kind", list(INDEX_FACTORIES))
+class TestANNRecall:
+    """各索引在同一数据集上的 recall@10"""
+
+    def test_recall(self, kind, exact_kb, queries):
+        factory, min_recall = INDEX_FACTORIES[kind]
+        kb = _build(factory())
+        assert kb.index.is_trained
+        assert _recall(kb, exact_kb, queries) >= min_recall
+
+    def test_deleted_rows_are_not_returned(self, kind, queries):
+        factory, _ = INDEX_FACTORIES[kind]
+        kb = _build(factory())
+        top = kb.retrieve_by_embeddings(queries[:5], top_k=TOP_K)
+        deleted = {doc_id for result in top for doc_id in result["ids"][:3]}
+        kb.delete_documents(sorted(deleted))
+        for result in kb.retrieve_by_embeddings(queries[:5], top_k=TOP_K):
+            assert not deleted & set(result["ids"])
+            assert len(result["ids"]) == TOP_K
+
+    def test_recall_after_snapshot_round_trip(self, kind, exact_kb, queries, tmp_path):
+        factory, min_recall = INDEX_FACTORIES[kind]
+        _build(factory()).save(tmp_path / "snapshot")
+        loaded = MemoryKBHandler(None, index=factory())
+        loaded.load(tmp_path / "snapshot")
+        assert loaded.index.is_trained
+        assert _recall(loaded, exact_kb, queries) >= min_recall
+
+
+def test_quantized_base_is_abstract():
+    """量化索引基类只定义公共流程，不能直接实例化"""
+    with pytest.raises(TypeError):
+        _QuantizedIndex(rerank=0, min_train_points=1, max_train_points=10, seed=0)
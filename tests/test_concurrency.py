@@ -0,0 +1,201 @@
+"""
+并发测试：读写锁的互斥语义，以及检索在并发写入 / 删除期间看到的是整批一致的快照
+"""
+import threading
+from collections import Counter
+
+import pytest
+
+from src.bm25_index import BM25Index
+from src.ivf_index import IVFIndex
+from src.memory_kb_handler import MemoryKBHandler
+from src.rwlock import ReadWriteLock
+
+BATCH_SIZE = 10
+N_BATCHES = 30
+
+
+def _start(target, *args) -> threading.Thread:
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    return thread
+
+
+class TestReadWriteLock:
+    """ReadWriteLock 的共享 / 独占 / 写者优先"""
+
+    def test_readers_share(self):
+        """多个读者可以同时持有锁"""
+        lock = ReadWriteLock()
+        inside = threading.Barrier(3, timeout=5)
+
+        def reader():
+            with lock.read():
+                inside.wait()
+
+        threads = [_start(reader) for _ in range(2)]
+        inside.wait()
+        for thread in threads:
+            thread.join(5)
+            assert not thread.is_alive()
+
+    def test_writer_excludes_readers(self):
+        """写者持有锁期间读者阻塞，释放后读者继续"""
+        lock = ReadWriteLock()
+        entered = threading.Event()
+
+        def reader():
+            with lock.read():
+                entered.set()
+
+        with lock.write():
+            thread = _start(reader)
+            assert not entered.wait(0.2)
+        thread.join(5)
+        assert entered.is_set()
+
+    def test_waiting_writer_blocks_new_readers(self):
+        """有写者等待时新读者排在写者之后，写者不会被持续到来的读者饿死"""
+        lock = ReadWriteLock()
+        order = []
+
+        def writer():
+            with lock.write():
+                order.append("writer")
+
+        def reader():
+            with lock.read():
+                order.append("reader")
+
+        with lock.read():
+            writer_thread = _start(writer)
+            while not lock._waiting_writers:
+                threading.Event().wait(0.01)
+            reader_thread = _start(reader)
+            # 第一个读者仍持有锁：写者与新读者都不能进入
+            threading.Event().wait(0.2)
+            assert order == []
+
+        writer_thread.join(5)
+        reader_thread.join(5)
+        assert order == ["writer", "reader"]
+
+
+def _batch_ids(b: int):
+    return [f"b{b}-{i}" for i in range(BATCH_SIZE)]
+
+
+def _add_batch(kb: MemoryKBHandler, b: int) -> None:
+    kb.add_documents(
+        [f"批次 {b} 文档 {i} 关键词 common" for i in range(BATCH_SIZE)],
+        [{"batch": b} for _ in range(BATCH_SIZE)],
+        ids=_batch_ids(b),
+    )
+
+
+@pytest.mark.parametrize(
+    "make_kb",
+    [
+        pytest.param(lambda h: MemoryKBHandler(h), id="flat"),
+        pytest.param(
+            lambda h: MemoryKBHandler(h, index=IVFIndex(nlist=4, nprobe=4, min_train_points=20)),
+            id="ivf",
+        ),
+        pytest.param(lambda h: MemoryKBHandler(h, lexical_index=BM25Index()), id="hybrid"),
+    ],
+)
+class TestSnapshotIsolation:
+    """检索与写入并发时，每一批写入 / 删除要么整批可见，要么完全不可见"""
+
+    def _check(self, ids):
+        """按批次统计可见的文档数，每个批次只能是 0 或 BATCH_SIZE"""
+        counts = Counter(doc_id.split("-")[0] for doc_id in ids)
+        partial = {batch: n for batch, n in counts.items() if n != BATCH_SIZE}
+        assert not partial, f"partially visible batches: {partial}"
+
+    def test_reads_see_whole_batches(self, embedding_handler, make_kb):
+        kb = make_kb(embedding_handler)
+        _add_batch(kb, 0)
+        done = threading.Event()
+        errors = []
+
+        def writer():
+            try:
+                for b in range(1, N_BATCHES):
+                    _add_batch(kb, b)
+                    if b % 3 == 0:
+                        kb.delete_documents(_batch_ids(b - 1))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                done.set()
+
+        def reader():
+            try:
+                while not done.is_set():
+                    self._check(kb.retrieve("关键词 common", top_k=N_BATCHES * BATCH_SIZE)["ids"])
+                    self._check(kb.get_all_documents()["ids"])
+                    count = kb.get_document_count()
+                    assert count % BATCH_SIZE == 0
+            except Exception as e:
+                errors.append(e)
+
+        readers = [_start(reader) for _ in range(3)]
+        _start(writer).join(60)
+        for thread in readers:
+            thread.join(60)
+
+        assert not errors, errors[0]
+        deleted = {b - 1 for b in range(3, N_BATCHES, 3)}
+        assert kb.get_document_count() == (N_BATCHES - len(deleted)) * BATCH_SIZE
+        self._check(kb.get_all_documents()["ids"])
+
+    def test_filtered_reads_see_whole_batches(self, embedding_handler, make_kb):
+        """按元数据过滤的检索同样不会看到写了一半的倒排索引"""
+        kb = make_kb(embedding_handler)
+        _add_batch(kb, 0)
+        kb.retrieve("关键词 common", where={"batch": 0})  # 先建好元数据倒排索引，之后增量维护
+        done = threading.Event()
+        errors = []
+
+        def writer():
+            try:
+                for b in range(1, N_BATCHES):
+                    _add_batch(kb, b)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                done.set()
+
+        def reader():
+            try:
+                while not done.is_set():
+                    ids = kb.retrieve(
+                        "关键词 common",
+                        top_k=N_BATCHES * BATCH_SIZE,
+                        where={"batch": {"$in": list(range(0, N_BATCHES, 2))}},
+                    )["ids"]
+                    self._check(ids)
+            except Exception as e:
+                errors.append(e)
+
+        thread = _start(reader)
+        _start(writer).join(60)
+        thread.join(60)
+
+        assert not errors, errors[0]
+
+    def test_held_read_lock_defers_publication(self, embedding_handler, make_kb):
+        """读者持锁期间写入准备完成也不会发布，释放后整批一次可见"""
+        kb = make_kb(embedding_handler)
+        _add_batch(kb, 0)
+
+        with kb._rw_lock.read():
+            writer = _start(_add_batch, kb, 1)
+            writer.join(0.3)
+            assert writer.is_alive()
+            assert kb._count() == BATCH_SIZE
+        writer.join(10)
+
+        assert not writer.is_alive()
+        assert kb.get_document_count() == 2 * BATCH_SIZE
@@ -0,0 +1,129 @@
+"""
+内容哈希去重测试：稳定 ID、跳过已入库的分块，以及多个文件共用同一分块时的来源记录
+"""
+import pytest
+
+from src.content_hash import content_id, partition_new
+from src.memory_kb_handler import MemoryKBHandler
+from src.metadata_index import REFS_FIELD
+
+SHARED = "两个文件都包含的段落"
+
+
+class CountingEmbeddingHandler:
+    """记录向量化过的文本数"""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.embedded = 0
+
+    def embed_texts(self, texts):
+        self.embedded += len(texts)
+        return self.inner.embed_texts(texts)
+
+    def embed_stream(self, texts, batch_size=256):
+        for batch, embeddings in self.inner.embed_stream(texts, batch_size):
+            self.embedded += len(batch)
+            yield batch, embeddings
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+
+def _file(name: str, paragraphs):
+    return list(paragraphs), [{"filename": name, "chunk_index": i} for i in range(len(paragraphs))]
+
+
+class TestContentIds:
+    """内容哈希 ID"""
+
+    def test_stable_and_normalized(self):
+        assert content_id("同一段 内容") == content_id("同一段 内容")
+        assert content_id("同一段  内容\n") == content_id("同一段 内容")
+        assert content_id("ＡＢＣ１２３") == content_id("ABC123")
+        assert content_id("内容甲") != content_id("内容乙")
+
+    def test_partition_new(self):
+        documents = ["a", "b", "a", "c"]
+        metadata = [{"i": i} for i in range(4)]
+        ids = [content_id(doc) for doc in documents]
+        docs, metas, kept, shared_meta, shared_ids = partition_new(documents, metadata, ids, {ids[3]})
+        assert docs == ["a", "b"]
+        assert metas == [{"i": 0}, {"i": 1}]
+        assert kept == ids[:2]
+        assert shared_ids == [ids[2], ids[3]]
+        assert shared_meta == [{"i": 2}, {"i": 3}]
+
+
+class TestSharedChunks:
+    """两个文件共用一个分块"""
+
+    @pytest.fixture
+    def embedder(self, embedding_handler):
+        return CountingEmbeddingHandler(embedding_handler)
+
+    def _ingest(self, kb, stream: bool):
+        for name, own in (("a.txt", "甲文件独有的段落"), ("b.txt", "乙文件独有的段落")):
+            documents, metadata = _file(name, [SHARED, own])
+            if stream:
+                kb.add_documents_stream(documents, metadata, batch_size=1)
+            else:
+                kb.add_documents(documents, metadata)
+
+    @pytest.mark.parametrize("stream", [False, True])
+    def test_shared_chunk_is_stored_once(self, embedder, stream):
+        kb = MemoryKBHandler(embedder)
+        self._ingest(kb, stream)
+        assert kb.get_document_count() == 3
+        assert embedder.embedded == 3
+
+        meta = kb.retrieve(SHARED, top_k=1)["metadatas"][0]
+        assert meta["filename"] == "a.txt"
+        assert meta[REFS_FIELD] == [{"filename": "b.txt", "chunk_index": 0}]
+
+    @pytest.mark.parametrize("stream", [False, True])
+    def test_where_and_delete_where(self, embedder, stream):
+        kb = MemoryKBHandler(embedder)
+        self._ingest(kb, stream)
+        shared = content_id(SHARED)
+
+        assert shared in kb.retrieve(SHARED, top_k=5, where={"filename": "a.txt"})["ids"]
+        assert shared in kb.retrieve(SHARED, top_k=5, where={"filename": "b.txt"})["ids"]
+
+        # 删除 a.txt 只删掉它独有的分块，共用分块改由 b.txt 引用
+        assert kb.delete_where(filename="a.txt") == 1
+        assert kb.retrieve(SHARED, top_k=5, where={"filename": "a.txt"})["ids"] == []
+        result = kb.retrieve(SHARED, top_k=1, where={"filename": "b.txt"})
+        assert result["ids"] == [shared]
+        assert result["metadatas"][0] == {"filename": "b.txt", "chunk_index": 0}
+
+        assert kb.delete_where(filename="b.txt") == 2
+        assert kb.get_document_count() == 0
+
+    def test_same_file_adds_no_reference(self, embedder):
+        kb = MemoryKBHandler(embedder)
+        documents, metadata = _file("a.txt", [SHARED, SHARED, "另一段"])
+        kb.add_documents(documents, metadata)
+        kb.add_documents(*_file("a.txt", [SHARED]))
+        assert kb.get_document_count() == 2
+        assert REFS_FIELD not in kb.retrieve(SHARED, top_k=1)["metadatas"][0]
+
+    def test_references_survive_restart(self, embedding_handler, tmp_path):
+        kb = MemoryKBHandler(embedding_handler, persist_directory=tmp_path)
+        self._ingest(kb, stream=False)
+        kb.delete_where(filename="a.txt")
+        kb.add_documents(*_file("c.txt", [SHARED]))
+        kb.close()
+
+        reopened = MemoryKBHandler(embedding_handler, persist_directory=tmp_path)
+        where = {"filename": {"$in": ["b.txt", "c.txt"]}}
+        assert reopened.retrieve(SHARED, top_k=5, where=where)["ids"][0] == content_id(SHARED)
+        reopened.compact()
+        reopened.close()
+
+        compacted = MemoryKBHandler(embedding_handler, persist_directory=tmp_path)
+        assert compacted.retrieve(SHARED, top_k=1, where={"filename": "c.txt"})["ids"] == [
+            content_id(SHARED)
+        ]
+        assert compacted.get_document_count() == 2
+        compacted.close()
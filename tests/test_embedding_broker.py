@@ -0,0 +1,130 @@
+"""
+查询向量微批处理测试：并发查询合批编码、结果按提交方交还、异常传递与关闭
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from src.embedding_broker import EmbeddingBroker
+
+
+class GatedEncoder:
+    """记录每批查询的编码函数；首批编码阻塞到 release()，使后续查询在队列中排队"""
+
+    def __init__(self, embedding_handler):
+        self.embedding_handler = embedding_handler
+        self.batches = []
+        self.entered = threading.Event()
+        self._gate = threading.Event()
+
+    def release(self) -> None:
+        self._gate.set()
+
+    def __call__(self, queries):
+        self.batches.append(list(queries))
+        self.entered.set()
+        self._gate.wait(5)
+        return self.embedding_handler.embed_queries(queries)
+
+
+@pytest.fixture
+def encoder(embedding_handler):
+    return GatedEncoder(embedding_handler)
+
+
+class TestEmbeddingBroker:
+    """EmbeddingBroker 的合批与生命周期"""
+
+    def test_queued_queries_share_a_forward_pass(self, encoder, embedding_handler):
+        """编码期间到达的查询按 max_batch_size 合批，每个调用方拿到自己的向量"""
+        broker = EmbeddingBroker(encoder, max_batch_size=4, max_wait_ms=1)
+        try:
+            first = broker.submit("q0")
+            assert encoder.entered.wait(5)
+            futures = [broker.submit(f"q{i}") for i in range(1, 11)]
+            encoder.release()
+
+            for i, future in enumerate([first, *futures]):
+                np.testing.assert_array_equal(
+                    future.result(5), embedding_handler.embed_query(f"q{i}")
+                )
+        finally:
+            broker.close()
+
+        assert [len(batch) for batch in encoder.batches] == [1, 4, 4, 2]
+        assert (broker.batches, broker.queries) == (4, 11)
+
+    def test_concurrent_callers(self, embedding_handler):
+        """多线程同时调用 embed_query 时结果与逐条编码一致，且批次数少于查询数"""
+        calls = []
+
+        def encode(queries):
+            calls.append(len(queries))
+            return embedding_handler.embed_queries(queries)
+
+        broker = EmbeddingBroker(encode, max_batch_size=16, max_wait_ms=20)
+        queries = [f"问题 {i}" for i in range(64)]
+        try:
+            with ThreadPoolExecutor(max_workers=16) as pool:
+                results = list(pool.map(broker.embed_query, queries))
+        finally:
+            broker.close()
+
+        for query, result in zip(queries, results):
+            np.testing.assert_array_equal(result, embedding_handler.embed_query(query))
+        assert sum(calls) == len(queries)
+        assert max(calls) <= 16
+        assert len(calls) < len(queries)
+
+    def test_encode_error_fails_the_batch_only(self, embedding_handler):
+        """编码失败时该批所有调用方收到异常，后续查询照常处理"""
+        def encode(queries):
+            if "bad" in queries:
+                raise RuntimeError("model failed")
+            return embedding_handler.embed_queries(queries)
+
+        broker = EmbeddingBroker(encode)
+        try:
+            with pytest.raises(RuntimeError, match="model failed"):
+                broker.embed_query("bad")
+            np.testing.assert_array_equal(broker.embed_query("ok"), embedding_handler.embed_query("ok"))
+        finally:
+            broker.close()
+
+    def test_cancelled_queries_are_skipped(self, encoder):
+        """排队期间被取消的查询不参与编码"""
+        broker = EmbeddingBroker(encoder, max_batch_size=8, max_wait_ms=1)
+        try:
+            broker.submit("q0")
+            assert encoder.entered.wait(5)
+            cancelled = broker.submit("cancelled")
+            kept = broker.submit("kept")
+            assert cancelled.cancel()
+            encoder.release()
+            kept.result(5)
+        finally:
+            broker.close()
+
+        assert encoder.batches == [["q0"], ["kept"]]
+
+    def test_close_drains_pending_queries(self, encoder):
+        """close 先处理完已提交的查询，之后拒绝新的提交"""
+        broker = EmbeddingBroker(encoder, max_batch_size=2, max_wait_ms=1)
+        broker.submit("q0")
+        assert encoder.entered.wait(5)
+        futures = [broker.submit(f"q{i}") for i in range(1, 5)]
+        closer = threading.Thread(target=broker.close)
+        closer.start()
+        encoder.release()
+        closer.join(5)
+
+        assert not closer.is_alive()
+        assert all(future.done() and future.exception() is None for future in futures)
+        with pytest.raises(RuntimeError):
+            broker.submit("late")
+
+    def test_invalid_batch_size(self, embedding_handler):
+        with pytest.raises(ValueError):
+            EmbeddingBroker(embedding_handler.embed_queries, max_batch_size=0)
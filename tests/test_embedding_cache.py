@@ -0,0 +1,119 @@
+"""
+文档向量磁盘缓存测试：读写往返、命中统计、条目 / 字节统计的增量维护与重启后保留
+"""
+import sqlite3
+
+import numpy as np
+import pytest
+
+from src.embedding_cache import EmbeddingCache
+
+DIM = 8
+
+
+def _vectors(n: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((n, DIM)).astype(np.float32)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache.sqlite")
+    yield cache
+    cache.close()
+
+
+class TestEmbeddingCache:
+    """EmbeddingCache 的读写与统计"""
+
+    def test_round_trip(self, cache):
+        """写入的向量按内容哈希原样取回，未写入的键不出现在结果中"""
+        vectors = _vectors(3)
+        cache.put_many("m", ["a", "b", "c"], vectors)
+
+        found = cache.get_many("m", ["a", "c", "missing"])
+
+        assert set(found) == {"a", "c"}
+        np.testing.assert_array_equal(found["a"], vectors[0])
+        np.testing.assert_array_equal(found["c"], vectors[2])
+
+    def test_models_are_separate(self, cache):
+        """同一内容哈希在不同模型下是不同的条目"""
+        cache.put_many("m1", ["a"], _vectors(1, seed=1))
+        assert cache.get_many("m2", ["a"]) == {}
+
+        cache.put_many("m2", ["a"], _vectors(1, seed=2))
+        assert not np.array_equal(cache.get_many("m1", ["a"])["a"], cache.get_many("m2", ["a"])["a"])
+
+    def test_hit_and_miss_counts(self, cache):
+        """命中 / 未命中按请求的每个哈希计数（重复的哈希各算一次）"""
+        cache.put_many("m", ["a", "b"], _vectors(2))
+
+        cache.get_many("m", ["a", "a", "x"])
+        cache.get_many("m", ["b", "y"])
+
+        stats = cache.stats()
+        assert stats["hits"] == 3
+        assert stats["misses"] == 2
+        assert stats["hit_rate"] == pytest.approx(0.6)
+
+    def test_empty_stats(self, cache):
+        """未查询过时命中率为 0 而不是除零"""
+        stats = cache.stats()
+        assert stats == {"hits": 0, "misses": 0, "hit_rate": 0.0, "entries": 0, "bytes_stored": 0}
+
+    def test_lookup_larger_than_sql_batch(self, cache):
+        """一次查找超过单条 SQL 的参数上限时分批查询"""
+        keys = [f"k{i}" for i in range(1200)]
+        cache.put_many("m", keys, _vectors(len(keys)))
+
+        assert len(cache.get_many("m", keys)) == len(keys)
+
+    def test_entries_and_bytes_are_incremental(self, cache):
+        """重复写入已有的键不增加条目数和字节数"""
+        cache.put_many("m", ["a", "b"], _vectors(2))
+        cache.put_many("m", ["b", "c"], _vectors(2, seed=1))
+
+        stats = cache.stats()
+        assert stats["entries"] == 3
+        assert stats["bytes_stored"] == 3 * DIM * 4
+        # 已有的键保持原值
+        np.testing.assert_array_equal(cache.get_many("m", ["b"])["b"], _vectors(2)[1])
+
+    def test_stats_survive_reopen(self, tmp_path):
+        """条目 / 字节统计保存在缓存文件中，命中计数只属于本进程"""
+        path = tmp_path / "cache.sqlite"
+        cache = EmbeddingCache(path)
+        cache.put_many("m", ["a", "b"], _vectors(2))
+        cache.get_many("m", ["a"])
+        cache.close()
+
+        reopened = EmbeddingCache(path)
+        try:
+            stats = reopened.stats()
+            assert (stats["entries"], stats["bytes_stored"]) == (2, 2 * DIM * 4)
+            assert (stats["hits"], stats["misses"]) == (0, 0)
+        finally:
+            reopened.close()
+
+    def test_legacy_file_is_counted_once(self, tmp_path):
+        """没有统计表的旧缓存文件在打开时统计一次已有条目"""
+        path = tmp_path / "cache.sqlite"
+        conn = sqlite3.connect(str(path))
+        conn.execute(
+            "CREATE TABLE embeddings (model TEXT NOT NULL, hash TEXT NOT NULL, "
+            "vector BLOB NOT NULL, PRIMARY KEY (model, hash)) WITHOUT ROWID"
+        )
+        conn.executemany(
+            "INSERT INTO embeddings VALUES (?, ?, ?)",
+            [("m", key, vector.tobytes()) for key, vector in zip("abc", _vectors(3))],
+        )
+        conn.commit()
+        conn.close()
+
+        for _ in range(2):
+            cache = EmbeddingCache(path)
+            try:
+                assert cache.stats()["entries"] == 3
+                assert cache.stats()["bytes_stored"] == 3 * DIM * 4
+            finally:
+                cache.close()
@@ -0,0 +1,119 @@
+"""
+BM25 稀疏索引与稠密 + BM25 倒数排名融合（RRF）检索测试
+"""
+import numpy as np
+import pytest
+
+from src.bm25_index import BM25Index, tokenize
+from src.kb_snapshot import read_snapshot_extras
+from src.memory_kb_handler import MemoryKBHandler
+
+
+def _docs(n: int):
+    documents = [f"第 {i} 号设备的日常维护记录 kw{i}" for i in range(n)]
+    documents[42] = "网关返回 ERR-404 错误时需要重启第 42 号设备"
+    metadata = [{"filename": f"log_{i % 2}.txt"} for i in range(n)]
+    return documents, metadata, [f"doc{i}" for i in range(n)]
+
+
+class TestTokenize:
+    """无词典分词"""
+
+    def test_cjk_bigrams_and_latin_words(self):
+        assert tokenize("向量检索") == ["向量", "量检", "检索"]
+        assert tokenize("是 API") == ["是", "api"]
+        assert tokenize("ERR-404 与 v1.2") == ["err-404", "与", "v1.2"]
+        # 全角字符先做 NFKC 规范化
+        assert tokenize("ＥＲＲ－４０４") == ["err-404"]
+
+
+class TestBM25Index:
+    """BM25 倒排索引"""
+
+    def test_rare_term_ranks_first(self):
+        index = BM25Index()
+        documents, _, _ = _docs(100)
+        index.add(0, documents)
+        rows, scores = index.search("err-404", k=5)
+        assert rows.tolist() == [42]
+        assert scores[0] > 0
+        assert len(index.search("完全无关的查询", k=5)[0]) == 0
+
+    def test_remove_and_candidates(self):
+        index = BM25Index()
+        documents, _, _ = _docs(100)
+        index.add(0, documents)
+        assert index.search("设备", k=100, candidates=np.array([3, 42, 50]))[0].tolist() != []
+        assert set(index.search("设备", k=100, candidates=np.array([3, 50]))[0].tolist()) == {3, 50}
+
+        index.remove(42, documents[42])
+        deleted = np.zeros(100, dtype=bool)
+        deleted[42] = True
+        assert len(index.search("err-404", k=5, deleted=deleted)[0]) == 0
+
+    def test_state_round_trip(self):
+        index = BM25Index()
+        documents, _, _ = _docs(50)
+        index.add(0, documents)
+        index.remove(7, documents[7])
+        live_rows = np.array([i for i in range(50) if i != 7])
+        state = index.state(live_rows)
+        # 词表按 UTF-8 数据 + 偏移保存，不使用定长 Unicode 数组
+        assert state["bm25_vocab_blob"].dtype == np.uint8
+        assert all(array.dtype.kind != "U" for array in state.values())
+
+        restored = BM25Index()
+        assert restored.load_state(state)
+        rows, scores = restored.search("err-404 设备", k=5)
+        expected_rows, expected_scores = index.search("err-404 设备", k=5)
+        # 行号按 live_rows 重新编号
+        assert rows.tolist() == [int(np.searchsorted(live_rows, r)) for r in expected_rows.tolist()]
+        assert np.allclose(scores, expected_scores)
+        assert not BM25Index().load_state({})
+
+
+class TestHybridRetrieval:
+    """MemoryKBHandler 的混合检索"""
+
+    @pytest.fixture
+    def kb(self, embedding_handler):
+        kb = MemoryKBHandler(embedding_handler, lexical_index=BM25Index())
+        kb.add_documents(*_docs(200))
+        return kb
+
+    def test_keyword_match_is_fused_into_results(self, kb, embedding_handler):
+        # 哈希向量对改写过的查询没有语义，只能靠 BM25 找到字面匹配
+        result = kb.retrieve("ERR-404 怎么处理", top_k=3)
+        assert "doc42" in result["ids"]
+        # distances 仍为稠密向量的余弦距离
+        dense = MemoryKBHandler(embedding_handler)
+        dense.add_documents(*_docs(200))
+        assert "doc42" not in dense.retrieve("ERR-404 怎么处理", top_k=3)["ids"]
+
+    def test_exact_text_still_first(self, kb):
+        documents, _, _ = _docs(200)
+        assert kb.retrieve(documents[10], top_k=3)["ids"][0] == "doc10"
+
+    def test_hybrid_with_where_and_deletes(self, kb):
+        assert "doc42" in kb.retrieve("ERR-404", top_k=3, where={"filename": "log_0.txt"})["ids"]
+        assert "doc42" not in kb.retrieve("ERR-404", top_k=5, where={"filename": "log_1.txt"})["ids"]
+
+        kb.delete_document("doc42")
+        assert "doc42" not in kb.retrieve("ERR-404", top_k=5)["ids"]
+
+    def test_retrieve_many_matches_retrieve(self, kb):
+        queries = ["ERR-404", "第 7 号设备"]
+        batched = kb.retrieve_many(queries, top_k=3)
+        assert [r["ids"] for r in batched] == [kb.retrieve(q, top_k=3)["ids"] for q in queries]
+
+    def test_snapshot_keeps_lexical_state(self, kb, embedding_handler, tmp_path):
+        kb.delete_document("doc3")
+        kb.save(tmp_path / "snapshot")
+        extras = read_snapshot_extras(tmp_path / "snapshot")
+        assert extras["bm25_vocab_blob"].dtype == np.uint8
+
+        loaded = MemoryKBHandler(embedding_handler, lexical_index=BM25Index())
+        loaded.load(tmp_path / "snapshot")
+        assert loaded.retrieve("ERR-404 怎么处理", top_k=3)["ids"] == kb.retrieve(
+            "ERR-404 怎么处理", top_k=3
+        )["ids"]
@@ -0,0 +1,218 @@
+"""
+增量入库测试：清单对未变化、修改过以及与其他文件共用分块的文件的差异计算
+"""
+import pytest
+
+from src.content_hash import content_id
+from src.ingest_manifest import IngestManifest, file_hash
+
+
+class TestIngestManifest:
+    """IngestManifest 的增量记录与引用计数"""
+
+    def setup_method(self):
+        """测试前准备"""
+        self.old_chunks = {content_id(text) for text in ("第一段", "第二段", "共用段落")}
+
+    def test_unchanged_file(self, tmp_path):
+        """文件哈希未变时返回上次记录的哈希和全部分块"""
+        path = tmp_path / "a.txt"
+        path.write_text("内容", encoding="utf-8")
+        manifest = IngestManifest(tmp_path / "manifest.sqlite3")
+        manifest.update("default/a.txt", file_hash(path), self.old_chunks, [])
+
+        assert manifest.get_file_hash("default/a.txt") == file_hash(path)
+        assert set(manifest.get_chunk_ids("default/a.txt")) == self.old_chunks
+        assert manifest.get_file_hash("default/b.txt") is None
+
+    def test_edited_file(self, tmp_path):
+        """修改后只记录分块增量：新增的分块加入，消失的分块移除"""
+        manifest = IngestManifest(tmp_path / "manifest.sqlite3")
+        manifest.update("a.txt", "h1", self.old_chunks, [])
+
+        new_chunks = {content_id(text) for text in ("第一段", "共用段落", "新段落")}
+        added = new_chunks - self.old_chunks
+        removed = self.old_chunks - new_chunks
+        assert manifest.orphaned("a.txt", removed) == [content_id("第二段")]
+
+        manifest.update("a.txt", "h2", added, removed)
+        assert manifest.get_file_hash("a.txt") == "h2"
+        assert set(manifest.get_chunk_ids("a.txt")) == new_chunks
+
+    def test_shared_chunk(self, tmp_path):
+        """被其他来源引用的分块不会被视为孤立分块"""
+        manifest = IngestManifest(tmp_path / "manifest.sqlite3")
+        manifest.update("a.txt", "h1", self.old_chunks, [])
+        manifest.update("b.txt", "h2", {content_id("共用段落")}, [])
+
+        assert set(manifest.orphaned("a.txt", self.old_chunks)) == self.old_chunks - {content_id("共用段落")}
+        # b.txt 不再引用后，a.txt 消失的共用分块才成为孤立分块
+        manifest.update("b.txt", "h3", [], {content_id("共用段落")})
+        assert set(manifest.orphaned("a.txt", self.old_chunks)) == self.old_chunks
+
+    def test_same_name_in_different_collections(self, tmp_path):
+        """不同分组中的同名文件是不同的来源"""
+        manifest = IngestManifest(tmp_path / "manifest.sqlite3")
+        manifest.update("alice/report.pdf", "h1", {content_id("甲")}, [])
+        manifest.update("bob/report.pdf", "h2", {content_id("乙")}, [])
+
+        assert manifest.get_chunk_ids("alice/report.pdf") == [content_id("甲")]
+        assert manifest.orphaned("bob/report.pdf", [content_id("乙")]) == [content_id("乙")]
+
+    def test_add_chunks_keeps_file_hash(self, tmp_path):
+        """只记录分块时不更新文件哈希"""
+        manifest = IngestManifest(tmp_path / "manifest.sqlite3")
+        manifest.add_chunks("a.txt", [content_id("第一段")])
+        assert manifest.get_file_hash("a.txt") is None
+        assert manifest.get_chunk_ids("a.txt") == [content_id("第一段")]
+
+        manifest.update("a.txt", "h1", self.old_chunks, [])
+        manifest.add_chunks("a.txt", [content_id("新段落")])
+        assert manifest.get_file_hash("a.txt") == "h1"
+        assert len(manifest.get_chunk_ids("a.txt")) == 4
+
+    def test_clear(self, tmp_path):
+        """清空后所有来源都被视为新文件"""
+        manifest = IngestManifest(tmp_path / "manifest.sqlite3")
+        manifest.update("a.txt", "h1", self.old_chunks, [])
+        manifest.clear()
+        assert manifest.get_file_hash("a.txt") is None
+        assert manifest.get_chunk_ids("a.txt") == []
+
+
+def _paragraph(text: str) -> str:
+    """把短文本重复为 15 个字符左右的段落：两段合并后超过 chunk_size，每段恰好成为一个分块"""
+    return text * 3
+
+
+class TestIncrementalIngestion:
+    """IngestionPipeline 配合清单的增量入库（需要 langchain）"""
+
+    @pytest.fixture(autouse=True)
+    def _setup(self, embedding_handler, tmp_path):
+        pytest.importorskip("langchain")
+        from src.ingest_pipeline import IngestionPipeline
+        from src.memory_kb_handler import MemoryKBHandler
+
+        self.kb = MemoryKBHandler(embedding_handler)
+        self.manifest = IngestManifest(tmp_path / "manifest.sqlite3")
+        # 按段落分块：每段不超过 chunk_size，两段之和超过 chunk_size，分块结果与段落一一对应
+        self.pipeline = IngestionPipeline(chunk_size=20, chunk_overlap=0, n_workers=1)
+        self.tmp_path = tmp_path
+
+    def _write(self, name: str, paragraphs) -> str:
+        path = self.tmp_path / name
+        path.write_text("\n\n".join(_paragraph(text) for text in paragraphs), encoding="utf-8")
+        return str(path)
+
+    def _run(self, path: str, filename: str, collection: str = "default"):
+        return self.pipeline.run(
+            self.kb, [(path, {"filename": filename, "collection": collection})], manifest=self.manifest
+        )
+
+    def test_unchanged_file_is_skipped(self):
+        """再次上传未变化的文件时直接跳过"""
+        path = self._write("a.txt", ["第一段内容", "第二段内容"])
+        first = self._run(path, "a.txt")
+        assert first["added"] == self.kb.get_document_count() == 2
+
+        second = self._run(path, "a.txt")
+        assert second["skipped"] == ["default/a.txt"]
+        assert second["added"] == second["deleted"] == 0
+
+    def test_edited_file_replaces_stale_chunks(self):
+        """修改后的文件只写入新增分块，并删除消失的分块"""
+        self._run(self._write("v1.txt", ["第一段内容", "第二段内容"]), "a.txt")
+        count = self.kb.get_document_count()
+
+        stats = self._run(self._write("v2.txt", ["第一段内容", "新写的段落"]), "a.txt")
+        assert stats["added"] == 1
+        assert stats["deleted"] == 1
+        assert self.kb.get_document_count() == count
+        assert not self.kb.get_existing_ids([content_id(_paragraph("第二段内容"))])
+
+    def test_shared_chunk_survives_edit(self):
+        """与其他文件共用的分块在一个文件修改后仍保留"""
+        self._run(self._write("a1.txt", ["共用的段落", "甲独有段落"]), "a.txt")
+        self._run(self._write("b1.txt", ["共用的段落", "乙独有段落"]), "b.txt")
+
+        shared = content_id(_paragraph("共用的段落"))
+        assert shared in self.kb.retrieve("x", top_k=5, where={"filename": "b.txt"})["ids"]
+
+        stats = self._run(self._write("a2.txt", ["甲的新段落"]), "a.txt")
+        assert stats["deleted"] == 1
+        assert self.kb.get_existing_ids([shared]) == [shared]
+        # a.txt 不再包含该分块，只去掉它的引用
+        assert shared not in self.kb.retrieve("x", top_k=5, where={"filename": "a.txt"})["ids"]
+        assert shared in self.kb.retrieve("x", top_k=5, where={"filename": "b.txt"})["ids"]
+
+    def test_same_name_in_other_collection_is_kept(self):
+        """另一分组上传同名文件不会删除本分组的分块"""
+        self._run(self._write("alice.txt", ["甲的报告内容"]), "report.txt", collection="alice")
+        stats = self._run(self._write("bob.txt", ["乙的报告内容"]), "report.txt", collection="bob")
+
+        assert stats["deleted"] == 0
+        assert self.kb.get_document_count() == 2
+
+    def _assert_no_orphans(self):
+        """知识库中的每个分块都被清单中的某个来源引用"""
+        referenced = set()
+        for source in ("default/a.txt", "default/b.txt"):
+            referenced.update(self.manifest.get_chunk_ids(source))
+        assert set(self.kb.get_all_documents()["ids"]) <= referenced
+
+    def test_failed_file_keeps_written_chunks(self, monkeypatch):
+        """解析中途失败的文件：已写入的分块记入清单，文件哈希不更新，重新上传后清理旧分块"""
+        import src.ingest_pipeline as ingest_pipeline
+
+        iter_file = ingest_pipeline._iter_file
+
+        def failing(*args):
+            for i, item in enumerate(iter_file(*args)):
+                if i == 2:
+                    raise ValueError("corrupt page")
+                yield item
+
+        path = self._write("a.txt", ["第一段内容", "第二段内容", "第三段内容"])
+        monkeypatch.setattr(ingest_pipeline, "_iter_file", failing)
+        stats = self._run(path, "a.txt")
+        assert [error for _, error in stats["failed"]] == ["corrupt page"]
+        assert self.kb.get_document_count() == 2
+        assert self.manifest.get_file_hash("default/a.txt") is None
+        self._assert_no_orphans()
+
+        # 修复后上传的新版本删除了第二段，失败时写入的第二段分块随之被删除
+        monkeypatch.setattr(ingest_pipeline, "_iter_file", iter_file)
+        stats = self._run(self._write("a2.txt", ["第一段内容", "第三段内容"]), "a.txt")
+        assert stats["deleted"] == 1
+        assert self.kb.get_document_count() == 2
+        self._assert_no_orphans()
+
+    def test_write_error_keeps_manifest_consistent(self, monkeypatch):
+        """写入中途出错：已写入的分块仍记入清单"""
+        self.pipeline.batch_size = 1
+        add_embeddings = self.kb.add_embeddings
+        calls = []
+
+        def flaky(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 3:
+                raise OSError("disk full")
+            return add_embeddings(*args, **kwargs)
+
+        monkeypatch.setattr(self.kb, "add_embeddings", flaky)
+        files = [
+            (self._write("a.txt", ["第一段内容", "第二段内容"]), {"filename": "a.txt", "collection": "default"}),
+            (self._write("b.txt", ["乙的第一段", "乙的第二段"]), {"filename": "b.txt", "collection": "default"}),
+        ]
+        with pytest.raises(OSError):
+            self.pipeline.run(self.kb, files, manifest=self.manifest)
+        assert self.kb.get_document_count() == 2
+        assert self.manifest.get_file_hash("default/a.txt") is None
+        self._assert_no_orphans()
+
+        monkeypatch.setattr(self.kb, "add_embeddings", add_embeddings)
+        stats = self.pipeline.run(self.kb, files, manifest=self.manifest)
+        assert not stats["skipped"]
+        assert self.kb.get_document_count() == 4
+        assert self.manifest.get_file_hash("default/a.txt") == file_hash(files[0][0])
@@ -0,0 +1,79 @@
+"""
+按长度分桶编码测试：批内长度相近、批大小受限、结果按原顺序还原
+"""
+import numpy as np
+import pytest
+
+from src.length_batching import bucketed_encode
+
+
+class RecordingEncoder:
+    """记录每批输入的编码函数"""
+
+    def __init__(self, embedding_handler):
+        self.embedding_handler = embedding_handler
+        self.batches = []
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        return self.embedding_handler.embed_texts(texts)
+
+
+def _texts():
+    rng = np.random.default_rng(0)
+    return ["字" * int(n) for n in rng.integers(1, 200, size=50)] + ["短", "较长的文本" * 30]
+
+
+class TestBucketedEncode:
+    """bucketed_encode 的分批与还原"""
+
+    def test_matches_unbatched_encoding(self, embedding_handler):
+        """结果与整体编码逐行一致（按原顺序还原）"""
+        texts = _texts()
+        result = bucketed_encode(texts, RecordingEncoder(embedding_handler), batch_size=8)
+
+        np.testing.assert_array_equal(result, embedding_handler.embed_texts(texts))
+
+    def test_batches_are_grouped_by_length(self, embedding_handler):
+        """各批按长度递增，批内长度不与其他批交错，每批不超过 batch_size"""
+        texts = _texts()
+        encoder = RecordingEncoder(embedding_handler)
+        bucketed_encode(texts, encoder, batch_size=8)
+
+        assert [len(batch) for batch in encoder.batches] == [8] * 6 + [4]
+        lengths = [[len(text) for text in batch] for batch in encoder.batches]
+        for batch in lengths:
+            assert batch == sorted(batch)
+        for previous, current in zip(lengths, lengths[1:]):
+            assert max(previous) <= min(current)
+
+    def test_less_padding_than_input_order(self, embedding_handler):
+        """按批内最长文本计算的 padding 总量少于按输入顺序切批"""
+        texts = _texts()
+        encoder = RecordingEncoder(embedding_handler)
+        bucketed_encode(texts, encoder, batch_size=8)
+
+        def padding(batches):
+            return sum(max(map(len, batch)) * len(batch) - sum(map(len, batch)) for batch in batches)
+
+        naive = [texts[i : i + 8] for i in range(0, len(texts), 8)]
+        assert padding(encoder.batches) < padding(naive) / 2
+
+    def test_explicit_lengths(self, embedding_handler):
+        """提供 lengths（如 token 数）时按其排序，而不是字符数"""
+        texts = ["a", "bb", "ccc", "dddd"]
+        encoder = RecordingEncoder(embedding_handler)
+        result = bucketed_encode(texts, encoder, batch_size=2, lengths=[4, 3, 2, 1])
+
+        assert encoder.batches == [["dddd", "ccc"], ["bb", "a"]]
+        np.testing.assert_array_equal(result, embedding_handler.embed_texts(texts))
+
+    def test_preserves_dtype(self):
+        """输出 dtype 跟随编码函数"""
+        result = bucketed_encode(["a", "bb"], lambda batch: np.ones((len(batch), 3), dtype=np.float16), 1)
+        assert result.dtype == np.float16
+        assert result.shape == (2, 3)
+
+    def test_invalid_batch_size(self, embedding_handler):
+        with pytest.raises(ValueError):
+            bucketed_encode(["a"], embedding_handler.embed_texts, batch_size=0)
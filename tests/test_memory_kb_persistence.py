@@ -0,0 +1,194 @@
+"""
+MemoryKBHandler 持久化测试：崩溃后的 WAL 重放、损坏的 WAL 尾部、整理（compaction）后重启
+"""
+import json
+
+import numpy as np
+import pytest
+
+from src.kb_snapshot import MANIFEST_FILE, latest_generation, read_snapshot
+from src.memory_kb_handler import WAL_FILE, MemoryKBHandler
+
+
+def _docs(start: int, end: int):
+    documents = [f"文档 {i} 的内容" for i in range(start, end)]
+    metadata = [{"filename": f"file_{i % 3}.txt", "chunk_index": i} for i in range(start, end)]
+    ids = [f"doc{i}" for i in range(start, end)]
+    return documents, metadata, ids
+
+
+class TestMemoryKBPersistence:
+    """快照 + WAL 持久化"""
+
+    def _open(self, embedding_handler, path, **kwargs) -> MemoryKBHandler:
+        # 阈值足够大，整理只在测试显式调用 compact() 时发生
+        return MemoryKBHandler(
+            embedding_handler, persist_directory=path, wal_compact_bytes=1 << 40, **kwargs
+        )
+
+    def test_wal_replay_after_crash(self, embedding_handler, tmp_path):
+        """未关闭、未整理就“崩溃”后，重启时从 WAL 恢复全部写操作"""
+        kb = self._open(embedding_handler, tmp_path)
+        kb.add_documents(*_docs(0, 50))
+        kb.add_documents(*_docs(50, 80))
+        kb.delete_document("doc3")
+        kb.delete_documents(["doc4", "doc5"])
+        kb.delete_where(filename="file_2.txt")
+        expected = sorted(kb.get_all_documents()["ids"])
+        # 不调用 close()，模拟进程被杀死
+
+        recovered = self._open(embedding_handler, tmp_path)
+        assert latest_generation(tmp_path) is None
+        assert sorted(recovered.get_all_documents()["ids"]) == expected
+        assert recovered.get_document_count() == len(expected)
+        assert recovered.retrieve("文档 10 的内容", top_k=1)["ids"] == ["doc10"]
+        assert "doc3" not in recovered.retrieve("文档 3 的内容", top_k=5)["ids"]
+        recovered.close()
+
+    def test_clear_is_replayed(self, embedding_handler, tmp_path):
+        """清空操作同样记录在 WAL 中，清空之后的写入在重启后保留"""
+        kb = self._open(embedding_handler, tmp_path)
+        kb.add_documents(*_docs(0, 20))
+        kb.clear_collection()
+        kb.add_documents(*_docs(20, 25))
+        kb.close()
+
+        recovered = self._open(embedding_handler, tmp_path)
+        assert sorted(recovered.get_all_documents()["ids"]) == sorted(f"doc{i}" for i in range(20, 25))
+        recovered.close()
+
+    def test_torn_wal_tail(self, embedding_handler, tmp_path):
+        """写入过程中崩溃留下的残缺尾部被丢弃，之前的记录完整恢复，之后的追加仍可读"""
+        kb = self._open(embedding_handler, tmp_path)
+        kb.add_documents(*_docs(0, 30))
+        wal_path = tmp_path / WAL_FILE
+        intact_size = wal_path.stat().st_size
+        kb.add_documents(*_docs(30, 40))
+        kb.close()
+
+        # 截掉最后一条记录的末尾若干字节
+        with open(wal_path, "r+b") as f:
+            f.truncate(wal_path.stat().st_size - 7)
+
+        recovered = self._open(embedding_handler, tmp_path)
+        assert recovered.get_document_count() == 30
+        assert wal_path.stat().st_size == intact_size
+        recovered.add_documents(*_docs(40, 45))
+        recovered.close()
+
+        reopened = self._open(embedding_handler, tmp_path)
+        assert sorted(reopened.get_all_documents()["ids"]) == sorted(
+            [f"doc{i}" for i in range(30)] + [f"doc{i}" for i in range(40, 45)]
+        )
+        reopened.close()
+
+    def test_corrupt_wal_record_is_discarded(self, embedding_handler, tmp_path):
+        """校验失败的最后一条记录被丢弃"""
+        kb = self._open(embedding_handler, tmp_path)
+        kb.add_documents(*_docs(0, 10))
+        kb.delete_document("doc1")
+        kb.close()
+
+        wal_path = tmp_path / WAL_FILE
+        data = bytearray(wal_path.read_bytes())
+        data[-1] ^= 0xFF
+        wal_path.write_bytes(bytes(data))
+
+        recovered = self._open(embedding_handler, tmp_path)
+        assert recovered.get_document_count() == 10
+        assert "doc1" in recovered.get_existing_ids(["doc1"])
+        recovered.close()
+
+    def test_rejected_add_is_not_logged(self, embedding_handler, tmp_path):
+        """维度或长度不匹配的批次在写 WAL 之前被拒绝，重启不受影响"""
+        kb = self._open(embedding_handler, tmp_path)
+        kb.add_documents(*_docs(0, 10))
+        wal_size = (tmp_path / WAL_FILE).stat().st_size
+
+        documents, metadata, ids = _docs(10, 12)
+        with pytest.raises(ValueError, match="dimension mismatch"):
+            kb.add_embeddings(np.ones((2, 16), dtype=np.float32), documents, metadata, ids)
+        with pytest.raises(ValueError, match="Length mismatch"):
+            kb.add_embeddings(np.ones((2, 32), dtype=np.float32), documents, metadata[:1], ids)
+        assert (tmp_path / WAL_FILE).stat().st_size == wal_size
+        kb.close()
+
+        recovered = self._open(embedding_handler, tmp_path)
+        assert recovered.get_document_count() == 10
+        recovered.add_documents(*_docs(10, 12))
+        assert recovered.get_document_count() == 12
+        recovered.close()
+
+    def test_compaction_and_restart(self, embedding_handler, tmp_path):
+        """整理后 WAL 只保留快照之后的记录，重启时在快照之上重放"""
+        kb = self._open(embedding_handler, tmp_path)
+        kb.add_documents(*_docs(0, 100))
+        kb.delete_documents([f"doc{i}" for i in range(0, 100, 10)])
+        wal_before = (tmp_path / WAL_FILE).stat().st_size
+
+        kb.compact()
+        snapshot_dir = latest_generation(tmp_path)
+        assert snapshot_dir is not None
+        assert (tmp_path / WAL_FILE).stat().st_size < wal_before
+
+        # 整理之后的写入只在 WAL 中
+        kb.add_documents(*_docs(100, 120))
+        kb.delete_document("doc11")
+        expected = sorted(kb.get_all_documents()["ids"])
+        kb.close()
+
+        recovered = self._open(embedding_handler, tmp_path)
+        assert latest_generation(tmp_path) == snapshot_dir
+        assert sorted(recovered.get_all_documents()["ids"]) == expected
+        assert recovered.retrieve("文档 110 的内容", top_k=1)["ids"] == ["doc110"]
+        assert recovered.retrieve("x", top_k=200, where={"filename": "file_1.txt"})["ids"]
+        recovered.close()
+
+    def test_repeated_compaction_keeps_one_generation(self, embedding_handler, tmp_path):
+        """多次整理后只保留最新一代快照，重启结果不变"""
+        kb = self._open(embedding_handler, tmp_path)
+        for start in range(0, 60, 20):
+            kb.add_documents(*_docs(start, start + 20))
+            kb.compact()
+        kb.close()
+
+        snapshots = [p for p in tmp_path.iterdir() if p.is_dir()]
+        assert snapshots == [latest_generation(tmp_path)]
+
+        recovered = self._open(embedding_handler, tmp_path)
+        assert recovered.get_document_count() == 60
+        recovered.close()
+
+    @pytest.mark.parametrize("mmap", [True, False])
+    def test_snapshot_round_trip(self, embedding_handler, tmp_path, mmap):
+        """save / load 后文档、元数据和向量与保存前一致"""
+        kb = MemoryKBHandler(embedding_handler)
+        kb.add_documents(*_docs(0, 40))
+        kb.delete_document("doc7")
+        kb.save(tmp_path / "snapshot")
+
+        loaded = MemoryKBHandler(embedding_handler)
+        loaded.load(tmp_path / "snapshot", mmap=mmap)
+        original, restored = kb.get_all_documents(), loaded.get_all_documents()
+        assert restored == original
+        assert np.allclose(
+            loaded.embeddings[[loaded._row_of["doc8"]]], kb.embeddings[[kb._row_of["doc8"]]]
+        )
+
+        # 加载后继续写入
+        loaded.add_documents(*_docs(40, 45))
+        assert loaded.get_document_count() == 44
+        assert loaded.retrieve("文档 42 的内容", top_k=1)["ids"] == ["doc42"]
+
+    def test_unsupported_snapshot_version(self, embedding_handler, tmp_path):
+        """只接受当前版本的快照"""
+        kb = MemoryKBHandler(embedding_handler)
+        kb.add_documents(*_docs(0, 5))
+        kb.save(tmp_path / "snapshot")
+
+        manifest_path = tmp_path / "snapshot" / MANIFEST_FILE
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+        manifest["version"] = 1
+        manifest_path.write_text(json.dumps(manifest), encoding="utf-8")
+        with pytest.raises(ValueError, match="Unsupported snapshot version"):
+            read_snapshot(tmp_path / "snapshot")
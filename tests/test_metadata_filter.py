@@ -0,0 +1,130 @@
+"""
+where= 元数据过滤与 delete_where 测试
+"""
+import pytest
+
+from src.memory_kb_handler import MemoryKBHandler
+from src.metadata_index import REFS_FIELD
+
+
+def _docs():
+    documents = [f"第 {i} 段内容" for i in range(30)]
+    metadata = [{"filename": f"file_{i % 3}.txt", "page": i // 10} for i in range(30)]
+    ids = [f"doc{i}" for i in range(30)]
+    return documents, metadata, ids
+
+
+@pytest.fixture
+def kb(embedding_handler) -> MemoryKBHandler:
+    kb = MemoryKBHandler(embedding_handler)
+    kb.add_documents(*_docs())
+    return kb
+
+
+def _ids(result):
+    return sorted(result["ids"], key=lambda doc_id: int(doc_id[3:]))
+
+
+class TestWhereFilter:
+    """检索时的元数据过滤"""
+
+    def test_equality(self, kb):
+        result = kb.retrieve("第 3 段内容", top_k=30, where={"filename": "file_0.txt"})
+        assert _ids(result) == [f"doc{i}" for i in range(0, 30, 3)]
+        assert result["ids"][0] == "doc3"
+
+    def test_top_k_within_filter(self, kb):
+        result = kb.retrieve("第 4 段内容", top_k=2, where={"filename": "file_1.txt"})
+        assert len(result["ids"]) == 2
+        assert result["ids"][0] == "doc4"
+
+    def test_operators(self, kb):
+        assert _ids(kb.retrieve("x", top_k=30, where={"page": {"$in": [0, 2]}})) == [
+            f"doc{i}" for i in list(range(10)) + list(range(20, 30))
+        ]
+        assert len(kb.retrieve("x", top_k=30, where={"filename": {"$ne": "file_0.txt"}})["ids"]) == 20
+        assert len(kb.retrieve("x", top_k=30, where={"page": {"$nin": [0, 1]}})["ids"]) == 10
+        both = {"$and": [{"filename": "file_0.txt"}, {"page": 1}]}
+        assert _ids(kb.retrieve("x", top_k=30, where=both)) == ["doc12", "doc15", "doc18"]
+        either = {"$or": [{"filename": "file_0.txt"}, {"page": 1}]}
+        assert len(kb.retrieve("x", top_k=30, where=either)["ids"]) == 17
+        # 顶层多个字段视为 $and
+        assert _ids(kb.retrieve("x", top_k=30, where={"filename": "file_0.txt", "page": 1})) == [
+            "doc12",
+            "doc15",
+            "doc18",
+        ]
+
+    def test_no_match_and_deleted_rows(self, kb):
+        assert kb.retrieve("x", top_k=5, where={"filename": "missing.txt"})["ids"] == []
+        kb.delete_documents(["doc0", "doc3"])
+        result = kb.retrieve("x", top_k=30, where={"filename": "file_0.txt"})
+        assert not {"doc0", "doc3"} & set(result["ids"])
+        assert len(result["ids"]) == 8
+
+    def test_unsupported_operator(self, kb):
+        with pytest.raises(ValueError, match="Unsupported filter operator"):
+            kb.retrieve("x", top_k=5, where={"page": {"$gt": 0}})
+
+
+class TestDeleteWhere:
+    """按元数据批量删除"""
+
+    def test_delete_where(self, kb):
+        assert kb.delete_where(filename="file_1.txt") == 10
+        assert kb.get_document_count() == 20
+        assert kb.retrieve("x", top_k=30, where={"filename": "file_1.txt"})["ids"] == []
+        assert kb.delete_where(filename="file_1.txt") == 0
+        with pytest.raises(ValueError):
+            kb.delete_where()
+
+    def test_delete_where_is_replayed(self, embedding_handler, tmp_path):
+        kb = MemoryKBHandler(embedding_handler, persist_directory=tmp_path)
+        kb.add_documents(*_docs())
+        kb.delete_where(filename="file_2.txt", page=0)
+        kb.close()
+
+        reopened = MemoryKBHandler(embedding_handler, persist_directory=tmp_path)
+        assert reopened.get_document_count() == 27
+        assert not {"doc2", "doc5", "doc8"} & set(reopened.get_all_documents()["ids"])
+        reopened.close()
+
+
+class TestSharedRows:
+    """带有其他来源引用（REFS_FIELD）的行"""
+
+    @pytest.fixture
+    def shared_kb(self, kb, embedding_handler):
+        meta = {"filename": "a.txt", "page": 1, REFS_FIELD: [{"filename": "b.txt", "page": 7}]}
+        kb.add_embeddings(embedding_handler.embed_texts(["共用段落"]), ["共用段落"], [meta], ["shared"])
+        return kb
+
+    def test_where_matches_any_reference(self, shared_kb):
+        assert shared_kb.retrieve("共用段落", top_k=5, where={"filename": "a.txt"})["ids"] == ["shared"]
+        assert shared_kb.retrieve("共用段落", top_k=5, where={"filename": "b.txt"})["ids"] == ["shared"]
+        assert shared_kb.retrieve("共用段落", top_k=5, where={"filename": "b.txt", "page": 7})["ids"] == [
+            "shared"
+        ]
+        # 条件必须由同一个引用满足
+        assert shared_kb.retrieve("x", top_k=5, where={"filename": "b.txt", "page": 1})["ids"] == []
+        assert "shared" in shared_kb.retrieve(
+            "共用段落", top_k=40, where={"filename": {"$ne": "a.txt"}}
+        )["ids"]
+
+    def test_delete_where_keeps_other_references(self, shared_kb):
+        assert shared_kb.delete_where(filename="a.txt") == 0
+        assert shared_kb.retrieve("共用段落", top_k=5, where={"filename": "a.txt"})["ids"] == []
+        result = shared_kb.retrieve("共用段落", top_k=1, where={"filename": "b.txt"})
+        assert result["ids"] == ["shared"]
+        assert result["metadatas"][0] == {"filename": "b.txt", "page": 7}
+
+        assert shared_kb.delete_where(filename="b.txt") == 1
+        assert shared_kb.get_existing_ids(["shared"]) == []
+
+    def test_remove_references(self, shared_kb):
+        assert shared_kb.remove_references(["shared", "doc0"], filename="b.txt") == 1
+        assert shared_kb.get_existing_ids(["doc0"]) == ["doc0"]
+        assert shared_kb.retrieve("共用段落", top_k=1)["metadatas"][0] == {"filename": "a.txt", "page": 1}
+        # 最后一个引用不会被去掉，文档也不会被删除
+        assert shared_kb.remove_references(["shared"], filename="a.txt") == 0
+        assert shared_kb.get_existing_ids(["shared"]) == ["shared"]
@@ -0,0 +1,81 @@
+"""
+查询向量 LRU 缓存测试：键规范化、LRU 淘汰、TTL 过期与命中统计
+"""
+import numpy as np
+import pytest
+
+from src import query_cache
+from src.query_cache import QueryEmbeddingCache
+
+
+def _vector(seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal(8).astype(np.float32)
+
+
+class TestQueryEmbeddingCache:
+    """QueryEmbeddingCache 的查找、淘汰与统计"""
+
+    def test_normalized_queries_share_an_entry(self):
+        """只有空白 / 大小写 / 全半角差异的问题命中同一条目"""
+        cache = QueryEmbeddingCache()
+        vector = _vector(0)
+        cache.put("什么是 RAG？", vector)
+
+        for query in ("什么是 RAG？", "  什么是   rag？ ", "什么是 ＲＡＧ?"):
+            np.testing.assert_array_equal(cache.get(query), vector)
+        assert cache.get("什么是 RAG 系统？") is None
+
+    def test_returns_copies(self):
+        """修改写入或取回的数组不影响缓存中的向量"""
+        cache = QueryEmbeddingCache()
+        vector = _vector(0)
+        cache.put("q", vector)
+        vector[:] = 0
+
+        cached = cache.get("q")
+        cached[:] = 1
+
+        np.testing.assert_array_equal(cache.get("q"), _vector(0))
+
+    def test_evicts_least_recently_used(self):
+        """超出容量时淘汰最久未使用（而不是最早写入）的条目"""
+        cache = QueryEmbeddingCache(max_size=2)
+        cache.put("a", _vector(0))
+        cache.put("b", _vector(1))
+        cache.get("a")
+        cache.put("c", _vector(2))
+
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.get("c") is not None
+        assert cache.stats()["size"] == 2
+
+    def test_ttl_expiry(self, monkeypatch):
+        """超过有效期的条目按未命中处理并被移除"""
+        now = [1000.0]
+        monkeypatch.setattr(query_cache.time, "monotonic", lambda: now[0])
+        cache = QueryEmbeddingCache(ttl_seconds=10)
+        cache.put("q", _vector(0))
+
+        now[0] += 5
+        assert cache.get("q") is not None
+        now[0] += 10
+        assert cache.get("q") is None
+        assert cache.stats()["size"] == 0
+
+    def test_stats(self):
+        """命中 / 未命中计数与命中率；clear 只清空条目"""
+        cache = QueryEmbeddingCache()
+        assert cache.stats() == {"hits": 0, "misses": 0, "hit_rate": 0.0, "size": 0}
+
+        cache.get("q")
+        cache.put("q", _vector(0))
+        cache.get("Q")
+        cache.get("q")
+        cache.clear()
+
+        assert cache.stats() == {"hits": 2, "misses": 1, "hit_rate": pytest.approx(2 / 3), "size": 0}
+
+    def test_invalid_size(self):
+        with pytest.raises(ValueError):
+            QueryEmbeddingCache(max_size=0)
@@ -0,0 +1,115 @@
+"""
+墓碑回收测试：各类近似索引及 BM25 索引在 reclaim() 重排行号后仍与知识库一致
+"""
+import pytest
+
+from src.bm25_index import BM25Index
+from src.hnsw_index import HNSWIndex
+from src.ivf_index import IVFIndex
+from src.memory_kb_handler import MemoryKBHandler
+from src.quantization import ProductQuantizedIndex, ScalarQuantizedIndex
+
+# 小规模参数：几百个向量即可训练，重排 / 全量探测使检索结果可预期
+INDEX_FACTORIES = {
+    "flat": lambda: None,
+    "ivf": lambda: IVFIndex(nlist=4, nprobe=4, min_train_points=50),
+    "hnsw": lambda: HNSWIndex(M=8, ef_construction=50, ef_search=50),
+    "sq8": lambda: ScalarQuantizedIndex(rerank=20, min_train_points=50),
+    "pq": lambda: ProductQuantizedIndex(n_subvectors=8, rerank=20, n_iter=5, min_train_points=50),
+}
+
+
+def _doc(i: int) -> str:
+    return f"文档 {i} 关键词 kw{i}"
+
+
+def _add(kb: MemoryKBHandler, start: int, end: int) -> None:
+    kb.add_documents(
+        [_doc(i) for i in range(start, end)],
+        [{"group": i % 2} for i in range(start, end)],
+        ids=[f"doc{i}" for i in range(start, end)],
+    )
+
+
+@pytest.mark.parametrize("index_name", list(INDEX_FACTORIES))
+class TestReclaim:
+    """reclaim() 对每种索引的行号重排"""
+
+    def _build(self, embedding_handler, index_name, **kwargs) -> MemoryKBHandler:
+        kb = MemoryKBHandler(embedding_handler, index=INDEX_FACTORIES[index_name](), **kwargs)
+        # 分三批写入：首批之后索引完成训练，后两批走增量插入
+        for start in range(0, 300, 100):
+            _add(kb, start, start + 100)
+        kb.delete_documents([f"doc{i}" for i in range(0, 300, 3)])
+        return kb
+
+    def test_reclaim_keeps_live_rows(self, embedding_handler, index_name):
+        """回收后墓碑行被移除，存活文档仍可检索，被删文档不会出现"""
+        kb = self._build(embedding_handler, index_name)
+        kb.reclaim()
+
+        assert kb._n_deleted == 0
+        assert len(kb.ids) == kb.get_document_count() == 200
+        assert kb._row_of == {doc_id: row for row, doc_id in enumerate(kb.ids)}
+        if index_name != "flat":
+            assert kb._index_ready()
+
+        for i in (1, 2, 4, 100, 298):
+            assert kb.retrieve(_doc(i), top_k=1)["ids"] == [f"doc{i}"]
+        for i in (0, 3, 150, 297):
+            assert f"doc{i}" not in kb.retrieve(_doc(i), top_k=10)["ids"]
+
+        # 元数据倒排索引按新行号重建
+        matched = kb.retrieve(_doc(4), top_k=200, where={"group": 0})["ids"]
+        assert len(matched) == len([i for i in range(300) if i % 3 and i % 2 == 0])
+
+    def test_add_after_reclaim(self, embedding_handler, index_name):
+        """回收后继续写入的行接在紧凑后的行号之后"""
+        kb = self._build(embedding_handler, index_name)
+        kb.reclaim()
+        _add(kb, 300, 350)
+
+        assert kb.get_document_count() == 250
+        assert kb.retrieve(_doc(320), top_k=1)["ids"] == ["doc320"]
+        assert kb.retrieve(_doc(5), top_k=1)["ids"] == ["doc5"]
+
+    def test_reclaim_then_restart(self, embedding_handler, index_name, tmp_path):
+        """回收后整理快照，重启时从快照恢复索引状态"""
+        kb = self._build(embedding_handler, index_name, persist_directory=tmp_path, wal_compact_bytes=1 << 40)
+        kb.reclaim()
+        kb.compact()
+        kb.close()
+
+        recovered = MemoryKBHandler(
+            embedding_handler,
+            persist_directory=tmp_path,
+            index=INDEX_FACTORIES[index_name](),
+            wal_compact_bytes=1 << 40,
+        )
+        assert recovered.get_document_count() == 200
+        if index_name != "flat":
+            assert recovered._index_ready()
+        assert recovered.retrieve(_doc(7), top_k=1)["ids"] == ["doc7"]
+        assert "doc6" not in recovered.retrieve(_doc(6), top_k=10)["ids"]
+        recovered.close()
+
+
+class TestReclaimLexical:
+    """reclaim() 对 BM25 索引的行号重排"""
+
+    def test_bm25_after_reclaim(self, embedding_handler):
+        """回收后关键词检索只返回存活文档，文档频率与行号一致"""
+        kb = MemoryKBHandler(embedding_handler, lexical_index=BM25Index())
+        _add(kb, 0, 200)
+        kb.delete_documents([f"doc{i}" for i in range(0, 200, 2)])
+        kb.reclaim()
+
+        rows, _ = kb.lexical_index.search("kw11", 5)
+        assert [kb.ids[row] for row in rows] == ["doc11"]
+        assert len(kb.lexical_index.search("kw10", 5)[0]) == 0
+
+        # 回收后继续写入的行接在新行号之后，混合检索结果包含关键词命中的文档
+        _add(kb, 200, 210)
+        rows, _ = kb.lexical_index.search("kw205", 5)
+        assert [kb.ids[row] for row in rows] == ["doc205"]
+        assert "doc205" in kb.retrieve("kw205", top_k=3)["ids"]
@@ -0,0 +1,112 @@
+"""
+ShardedKBHandler 测试：分片进程中的写入、检索归并、删除，以及索引配置向分片的传递
+"""
+from functools import partial
+
+import pytest
+
+from src.bm25_index import BM25Index
+from src.ivf_index import IVFIndex
+from src.kb_snapshot import latest_generation, read_snapshot_extras
+from src.memory_kb_handler import MemoryKBHandler
+from src.sharded_kb_handler import ShardedKBHandler
+
+
+def _docs(n: int):
+    documents = [f"第 {i} 号设备的维护记录" for i in range(n)]
+    documents[42] = "网关返回 ERR-404 错误时需要重启设备"
+    metadata = [{"filename": f"log_{i % 3}.txt"} for i in range(n)]
+    return documents, metadata, [f"doc{i}" for i in range(n)]
+
+
+@pytest.fixture(scope="module")
+def sharded(request):
+    from tests.conftest import HashEmbeddingHandler
+
+    kb = ShardedKBHandler(HashEmbeddingHandler(), n_shards=2)
+    request.addfinalizer(kb.close)
+    return kb
+
+
+@pytest.fixture
+def kb(sharded):
+    sharded.clear_collection()
+    sharded.add_documents(*_docs(200))
+    return sharded
+
+
+class TestShardedKB:
+    """分片知识库与单进程知识库行为一致"""
+
+    def test_matches_single_process(self, kb, embedding_handler):
+        single = MemoryKBHandler(embedding_handler)
+        single.add_documents(*_docs(200))
+
+        assert kb.get_document_count() == 200
+        queries = ["第 7 号设备的维护记录", "设备", "第 120 号设备的维护记录"]
+        for merged, expected in zip(kb.retrieve_many(queries, top_k=5), single.retrieve_many(queries, top_k=5)):
+            assert merged["ids"] == expected["ids"]
+            assert merged["distances"] == pytest.approx(expected["distances"], abs=1e-5)
+
+        where = {"filename": "log_1.txt"}
+        assert kb.retrieve("设备", top_k=10, where=where)["ids"] == single.retrieve(
+            "设备", top_k=10, where=where
+        )["ids"]
+
+    def test_deletes(self, kb):
+        kb.delete_document("doc7")
+        assert kb.delete_documents(["doc8", "doc9", "missing"]) == 2
+        assert kb.get_existing_ids(["doc7", "doc8", "doc10"]) == ["doc10"]
+        assert kb.delete_where(filename="log_0.txt") == 66
+        assert kb.get_document_count() == 200 - 3 - 66
+        assert kb.retrieve("x", top_k=5, where={"filename": "log_0.txt"})["ids"] == []
+
+    def test_content_dedup_and_shared_chunks(self, kb):
+        kb.add_documents(["共用段落", "甲独有"], [{"filename": "a.txt"}, {"filename": "a.txt"}])
+        kb.add_documents(["共用段落", "乙独有"], [{"filename": "b.txt"}, {"filename": "b.txt"}])
+        assert kb.get_document_count() == 203
+        assert len(kb.retrieve("共用段落", top_k=1, where={"filename": "b.txt"})["ids"]) == 1
+        assert kb.delete_where(filename="a.txt") == 1
+        assert kb.retrieve("共用段落", top_k=1)["metadatas"][0] == {"filename": "b.txt"}
+
+    def test_shard_errors_are_raised(self, kb):
+        with pytest.raises(RuntimeError, match="Shard"):
+            kb.retrieve("x", top_k=5, where={"page": {"$gt": 1}})
+        # 出错后分片仍可继续使用
+        assert kb.get_document_count() == 200
+
+
+class TestShardConfiguration:
+    """索引、混合检索和 WAL 配置在每个分片进程内生效"""
+
+    def test_index_and_lexical_factories(self, embedding_handler, tmp_path):
+        kb = ShardedKBHandler(
+            embedding_handler,
+            n_shards=2,
+            persist_directory=tmp_path,
+            index_factory=partial(IVFIndex, nlist=4, nprobe=4, min_train_points=20),
+            lexical_index_factory=BM25Index,
+            wal_compact_bytes=1 << 40,
+        )
+        try:
+            kb.add_documents(*_docs(200))
+            # 哈希向量对改写过的查询没有语义，只有分片内的 BM25 能找到字面匹配；
+            # 它在所在分片的融合名次为前二，按名次归并后在全局前 2 * n_shards 中
+            assert "doc42" in kb.retrieve("ERR-404 怎么处理", top_k=4)["ids"]
+
+            kb._broadcast("compact")
+            for shard in range(2):
+                extras = read_snapshot_extras(latest_generation(tmp_path / f"shard-{shard:02d}"))
+                assert "ivf_centroids" in extras
+                assert "bm25_vocab_blob" in extras
+        finally:
+            kb.close()
+
+        with pytest.raises(ValueError, match="shards"):
+            ShardedKBHandler(embedding_handler, n_shards=3, persist_directory=tmp_path)
+
+        reopened = ShardedKBHandler(embedding_handler, n_shards=2, persist_directory=tmp_path)
+        try:
+            assert reopened.get_document_count() == 200
+        finally:
+            reopened.close()
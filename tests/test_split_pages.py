@@ -0,0 +1,100 @@
+"""
+流式跨页分块测试：分块起止页码、分块序号、惰性读取页面（需要 langchain）
+"""
+import re
+
+import pytest
+
+pytest.importorskip("langchain")
+
+from src.document_processor import DocumentProcessor  # noqa: E402
+
+CHUNK_SIZE = 100
+N_PAGES = 40
+SENTENCES_PER_PAGE = 4
+
+
+def _page(page_num: int) -> str:
+    """每句话带页码标记，便于从分块文本反推它覆盖的页"""
+    return "".join(f"第{page_num}页第{i}句话。" for i in range(SENTENCES_PER_PAGE))
+
+
+def _pages_in(chunk: str):
+    return [int(page) for page in re.findall(r"第(\d+)页", chunk)]
+
+
+class CountingPages:
+    """记录已被读取页数的页面生成器"""
+
+    def __init__(self, n_pages: int):
+        self.n_pages = n_pages
+        self.consumed = 0
+
+    def __iter__(self):
+        for page_num in range(1, self.n_pages + 1):
+            self.consumed += 1
+            yield page_num, _page(page_num)
+
+
+@pytest.fixture
+def processor():
+    return DocumentProcessor(chunk_size=CHUNK_SIZE, chunk_overlap=20)
+
+
+class TestSplitPages:
+    """DocumentProcessor.split_pages 的分块元数据"""
+
+    def test_page_range_matches_chunk_text(self, processor):
+        """page / page_end 是分块文本所覆盖的首末页"""
+        chunks = list(processor.split_pages(CountingPages(N_PAGES), {"filename": "a.pdf"}))
+
+        spanning = 0
+        for chunk, metadata in chunks:
+            pages = _pages_in(chunk)
+            assert pages, chunk
+            assert (metadata["page"], metadata["page_end"]) == (min(pages), max(pages))
+            spanning += metadata["page_end"] > metadata["page"]
+        # 每页约 40 字符、分块 100 字符：多页合并为一个分块
+        assert spanning > 0
+
+    def test_every_page_is_covered(self, processor):
+        """所有页面的每句话都出现在某个分块中，分块不超过 chunk_size"""
+        chunks = [chunk for chunk, _ in processor.split_pages(CountingPages(N_PAGES))]
+
+        assert all(len(chunk) <= CHUNK_SIZE for chunk in chunks)
+        text = "".join(chunks)
+        for page_num in range(1, N_PAGES + 1):
+            for i in range(SENTENCES_PER_PAGE):
+                assert f"第{page_num}页第{i}句话" in text
+
+    def test_chunk_index_and_file_metadata(self, processor):
+        """chunk_index 从 0 连续递增，文件元数据复制到每个分块且互不共享"""
+        file_metadata = {"filename": "a.pdf", "collection": "docs"}
+        metadatas = [metadata for _, metadata in processor.split_pages(CountingPages(5), file_metadata)]
+
+        assert [metadata["chunk_index"] for metadata in metadatas] == list(range(len(metadatas)))
+        assert all(metadata["filename"] == "a.pdf" for metadata in metadatas)
+        metadatas[0]["filename"] = "changed"
+        assert file_metadata["filename"] == "a.pdf"
+        assert metadatas[1]["filename"] == "a.pdf"
+
+    def test_unpaginated_text_has_no_page_numbers(self, processor):
+        """页码为 None（如 TXT 文件）时分块不带 page / page_end"""
+        chunks = list(processor.split_pages([(None, _page(1) * 10)]))
+
+        assert len(chunks) > 1
+        assert all("page" not in metadata and "page_end" not in metadata for _, metadata in chunks)
+
+    def test_reads_pages_lazily(self, processor):
+        """首个分块在读完所有页面之前产出"""
+        pages = CountingPages(N_PAGES)
+        chunks = processor.split_pages(pages)
+
+        next(chunks)
+        assert pages.consumed < N_PAGES
+        list(chunks)
+        assert pages.consumed == N_PAGES
+
+    def test_empty_input(self, processor):
+        assert list(processor.split_pages([])) == []
+        assert list(processor.split_pages([(1, "  ")])) == []
@@ -0,0 +1,106 @@
+"""
+流式入库测试：按批惰性读取、内容去重、进度回调，以及与 add_documents 结果一致
+"""
+import pytest
+
+from src.content_hash import content_id
+from src.memory_kb_handler import MemoryKBHandler
+from src.stream_ingest import add_documents_stream
+
+BATCH_SIZE = 16
+
+
+def _doc(i: int) -> str:
+    return f"流式文档 {i} 关键词 kw{i}"
+
+
+class CountingSource:
+    """记录已被读取条数的文档生成器"""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.consumed = 0
+
+    def __iter__(self):
+        for document in self.documents:
+            self.consumed += 1
+            yield document
+
+
+@pytest.fixture
+def kb(embedding_handler):
+    return MemoryKBHandler(embedding_handler)
+
+
+class TestAddDocumentsStream:
+    """add_documents_stream 的读取、去重与写入"""
+
+    def test_matches_add_documents(self, embedding_handler, kb):
+        """流式写入与一次性 add_documents 得到相同的 ID、文档和元数据"""
+        documents = [_doc(i) for i in range(100)]
+        metadata = [{"chunk_index": i} for i in range(100)]
+        expected = MemoryKBHandler(embedding_handler)
+        expected.add_documents(documents, metadata)
+
+        added = kb.add_documents_stream(iter(documents), iter(metadata), batch_size=BATCH_SIZE)
+
+        assert added == 100
+        assert kb.get_all_documents() == expected.get_all_documents()
+        assert kb.retrieve(_doc(42), top_k=1)["ids"] == [content_id(_doc(42))]
+
+    def test_reads_lazily(self, embedding_handler, kb):
+        """写入每一批时只多读入了有限的几批，不会先把整个输入读完"""
+        source = CountingSource([_doc(i) for i in range(200)])
+        lag = []
+        add_embeddings = kb.add_embeddings
+
+        def recording_add(embeddings, documents, metadata, ids):
+            add_embeddings(embeddings, documents, metadata, ids)
+            lag.append(source.consumed - kb.get_document_count())
+
+        kb.add_embeddings = recording_add
+        add_documents_stream(kb, embedding_handler, source, batch_size=BATCH_SIZE)
+
+        assert len(lag) == 200 // BATCH_SIZE + 1
+        assert max(lag) <= 2 * BATCH_SIZE
+
+    def test_skips_existing_and_repeated_content(self, kb):
+        """知识库中已有的内容以及输入内重复（含仅空白差异）的内容不再写入"""
+        kb.add_documents([_doc(i) for i in range(10)])
+        documents = [_doc(i) for i in range(5, 20)] + [_doc(15), f"  {_doc(16)} "]
+
+        added = kb.add_documents_stream(documents, batch_size=4)
+
+        assert added == 10
+        assert kb.get_document_count() == 20
+
+    def test_progress_callback(self, kb):
+        """进度按已处理的输入条数单调递增，最后一次等于输入总数（包括被跳过的）"""
+        kb.add_documents([_doc(i) for i in range(40, 50)])
+        progress = []
+
+        kb.add_documents_stream(
+            (_doc(i) for i in range(50)), batch_size=BATCH_SIZE, progress_callback=progress.append
+        )
+
+        assert progress == sorted(progress)
+        assert progress[-1] == 50
+        assert len(progress) >= 50 // BATCH_SIZE
+
+    def test_metadata_is_copied(self, kb):
+        """同一个元数据字典对象被多条输入复用时，各分块得到独立的副本"""
+        shared_meta = {"filename": "a.txt"}
+
+        kb.add_documents_stream([_doc(0), _doc(1)], [shared_meta, shared_meta])
+        metadatas = kb.get_all_documents()["metadatas"]
+
+        assert metadatas == [shared_meta, shared_meta]
+        assert metadatas[0] is not metadatas[1]
+
+    def test_empty_input(self, kb):
+        assert kb.add_documents_stream(iter([])) == 0
+        assert kb.get_document_count() == 0
+
+    def test_invalid_batch_size(self, embedding_handler, kb):
+        with pytest.raises(ValueError):
+            add_documents_stream(kb, embedding_handler, [_doc(0)], batch_size=0)